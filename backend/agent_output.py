@@ -0,0 +1,300 @@
+"""
+Agent Output Parsing
+Tolerant JSON extraction (first balanced object, usable incrementally on a
+stream) and precompiled per-agent pydantic schemas that validate and coerce
+in one pass
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Literal
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, field_validator
+
+
+class JSONObjectExtractor:
+    """
+    Finds the first balanced, parseable JSON object in text fed in chunks.
+    Prose, markdown fences and trailing text around the object are ignored;
+    a brace-balanced span that isn't valid JSON (e.g. "{name}" in prose) is
+    skipped and scanning resumes after its opening brace.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0          # next character to scan
+        self._start = -1       # index of the candidate's opening brace
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.result: Optional[Any] = None
+        self.errors: List[str] = []
+
+    def feed(self, chunk: str) -> Optional[Any]:
+        """Add text; returns the parsed object once one is complete"""
+        if self.result is not None:
+            return self.result
+        self._buffer += chunk
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._start < 0:
+                if ch == "{":
+                    self._start, self._depth = i, 1
+                    self._in_string = self._escape = False
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = buf[self._start:i + 1]
+                    try:
+                        self.result = json.loads(candidate)
+                        self._pos = i + 1
+                        return self.result
+                    except json.JSONDecodeError as e:
+                        self.errors.append(f"skipped non-JSON span at {self._start}: {e.msg}")
+                        i = self._start
+                        self._start = -1
+            i += 1
+        self._pos = i
+        return None
+
+
+def extract_json_object(text: Optional[str]) -> Optional[Any]:
+    """First balanced JSON object in text, or None"""
+    if not text:
+        return None
+    return JSONObjectExtractor().feed(text)
+
+
+# ----------------------------------------------------------------------------
+# Per-agent schemas. Fields the writers read are required; everything else is
+# passed through so table columns the model adds still reach the insert.
+# ----------------------------------------------------------------------------
+
+class _Row(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+
+class IncomePattern(_Row):
+    average_weekly_income: float
+    income_volatility: float = 0.0
+    seasonal_factors: str = ""
+    confidence_score: float = Field(default=0.8, ge=0, le=1)
+
+    @field_validator("seasonal_factors", mode="before")
+    @classmethod
+    def _flatten_factors(cls, value):
+        # Column is TEXT; models often return a dict or list here
+        return value if isinstance(value, str) or value is None else json.dumps(value)
+
+
+class Scenario(_Row):
+    expected_income: float
+    confidence: Optional[float] = None
+    daily_average: Optional[float] = None
+
+
+class IncomeForecast(_Row):
+    forecast_period_days: int = 30
+    pessimistic_scenario: Scenario
+    realistic_scenario: Scenario
+    optimistic_scenario: Scenario
+    volatility_score: float = Field(ge=0, le=1)
+    volatility_category: Literal["low", "moderate", "high"]
+    forecast_confidence: float = Field(default=0.7, ge=0, le=1)
+
+
+class Budget(_Row):
+    budget_type: str
+    total_income_expected: float = 0.0
+    fixed_costs: Dict[str, float] = {}
+    variable_costs: Dict[str, float] = {}
+    savings_target: float = 0.0
+    discretionary_budget: float = 0.0
+    category_limits: Dict[str, float] = {}
+
+
+class RiskAssessment(_Row):
+    overall_risk_level: Literal["low", "medium", "high", "critical"]
+    risk_score: float = Field(ge=0, le=10)
+    escalation_needed: bool = False
+
+
+class CashflowStatus(_Row):
+    status: Literal["on_track", "at_risk", "critical"]
+    projected_gap: float = 0.0
+    daily_earning_target: float = 0.0
+    message: str = ""
+
+
+class TaxRecord(_Row):
+    financial_year: str
+
+
+class FinancialHealth(_Row):
+    health_category: str
+
+
+class Recommendation(_Row):
+    title: str
+
+
+class Action(_Row):
+    description: Optional[str] = None
+    action_id: Optional[str] = None
+    target_amount: float = 0.0
+
+
+class ActionPlan(_Row):
+    plan_type: str = "automation"
+    actions: List[Action] = []
+
+
+class SavingsPlan(_Row):
+    emergency_fund: Optional[Dict[str, Any]] = None
+    investment_recommendations: List[Dict[str, Any]] = []
+
+
+class Bill(_Row):
+    bill_name: str
+    amount: float = 0.0
+    due_date: str
+
+
+class BillAnalysis(_Row):
+    bills: List[Bill] = []
+
+
+class Goal(_Row):
+    goal_name: str
+    target_amount: float = 0.0
+
+
+class GoalsPlan(_Row):
+    goals: List[Goal] = []
+
+
+class PatternOutput(_Row):
+    income_patterns: IncomePattern
+
+
+class VolatilityOutput(_Row):
+    income_forecast: IncomeForecast
+
+
+class BudgetOutput(_Row):
+    budgets: List[Budget]
+
+
+class RiskOutput(_Row):
+    risk_assessment: RiskAssessment
+
+
+class TaxOutput(_Row):
+    tax_record: TaxRecord
+
+
+class FinancialOutput(_Row):
+    financial_health: FinancialHealth
+
+
+class RecommendationOutput(_Row):
+    recommendations: List[Recommendation]
+
+
+class ActionOutput(_Row):
+    action_plan: ActionPlan
+
+
+class SavingsOutput(_Row):
+    savings_plan: SavingsPlan
+
+
+class BillOutput(_Row):
+    bill_analysis: BillAnalysis
+
+
+class GoalsOutput(_Row):
+    goals_plan: GoalsPlan
+
+
+class FusedOutput(_Row):
+    """Sections are validated individually when dispatched, so a bad or missing one doesn't sink the rest"""
+    income_patterns: Optional[Dict[str, Any]] = None
+    income_forecast: Optional[Dict[str, Any]] = None
+    budgets: Optional[List[Dict[str, Any]]] = None
+    risk_assessment: Optional[Dict[str, Any]] = None
+    cashflow_status: Optional[Dict[str, Any]] = None
+
+
+# Compiled once at import
+AGENT_SCHEMAS: Dict[str, TypeAdapter] = {
+    "pattern_agent": TypeAdapter(PatternOutput),
+    "volatility_agent": TypeAdapter(VolatilityOutput),
+    "budget_agent": TypeAdapter(BudgetOutput),
+    "risk_agent": TypeAdapter(RiskOutput),
+    "cashflow_agent": TypeAdapter(CashflowStatus),
+    "tax_agent": TypeAdapter(TaxOutput),
+    "financial_agent": TypeAdapter(FinancialOutput),
+    "recommendation_agent": TypeAdapter(RecommendationOutput),
+    "action_agent": TypeAdapter(ActionOutput),
+    "savings_investment_agent": TypeAdapter(SavingsOutput),
+    "bill_payment_agent": TypeAdapter(BillOutput),
+    "goals_agent": TypeAdapter(GoalsOutput),
+    "fused_agent": TypeAdapter(FusedOutput),
+}
+
+
+@dataclass
+class AgentOutputResult:
+    """Outcome of parsing one agent answer"""
+    ok: bool
+    data: Optional[Dict[str, Any]] = None
+    stage: Optional[str] = None          # "extract" or "validate" when not ok
+    errors: List[str] = field(default_factory=list)
+
+    def describe(self) -> str:
+        return "; ".join(self.errors) if self.errors else "ok"
+
+
+def _format_validation_error(error: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(p) for p in e['loc']) or '<root>'}: {e['msg']}"
+        for e in error.errors(include_url=False)
+    ]
+
+
+def parse_agent_output(agent_name: str, text: Optional[str]) -> AgentOutputResult:
+    """
+    Extract the agent's JSON object and validate/coerce it against the
+    agent's schema (agents without a schema only need valid JSON)
+    """
+    extractor = JSONObjectExtractor()
+    data = extractor.feed(text or "")
+    if not isinstance(data, dict):
+        reason = "no JSON object found" if not extractor.errors else extractor.errors[-1]
+        return AgentOutputResult(ok=False, stage="extract", errors=[reason])
+
+    schema = AGENT_SCHEMAS.get(agent_name)
+    if schema is None:
+        return AgentOutputResult(ok=True, data=data)
+
+    try:
+        model = schema.validate_python(data)
+    except ValidationError as e:
+        return AgentOutputResult(ok=False, data=data, stage="validate", errors=_format_validation_error(e))
+
+    dumped = schema.dump_python(model, mode="json")
+    return AgentOutputResult(ok=True, data=dumped)
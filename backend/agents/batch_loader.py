@@ -0,0 +1,218 @@
+"""
+StoreBuddy UAE - Batch Data Loader
+Fetches shop data for a chunk of users in one query per table
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+import httpx
+from dotenv import load_dotenv
+
+from structured_log import get_logger
+
+load_dotenv()
+
+log = get_logger("batch_loader")
+
+
+class BatchFetchError(Exception):
+    """A paged table read did not complete (non-200 response)"""
+
+    def __init__(self, table: str, status_code: int, detail: str = ''):
+        super().__init__(f"{table}: HTTP {status_code} {detail[:200]}".rstrip())
+        self.table = table
+        self.status_code = status_code
+
+
+class BatchDataLoader:
+    """
+    Loads transactions, customers and inventory items for many shops at once:
+    - One `user_id=in.(...)` query per table per chunk instead of one per user
+    - Keyset paging on `id` so large chunks never rely on OFFSET
+    - Results are split per user in memory and primed into the prefetch cache
+    """
+
+    # Tables loaded for every scheduled cycle and their select/filter params
+    TABLES = {
+        'transactions': {
+            'select': '*',
+            'filters': {}
+        },
+        'customers': {
+            'select': '*',
+            'filters': {}
+        },
+        'inventory_items': {
+            'select': '*,suppliers(name)',
+            'filters': {'is_active': 'eq.true'}
+        }
+    }
+
+    DEFAULT_CHUNK_SIZE = 50
+    PAGE_SIZE = 1000
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, page_size: int = PAGE_SIZE,
+                 supabase_url: Optional[str] = None, supabase_key: Optional[str] = None):
+        self.supabase_url = supabase_url or os.getenv('SUPABASE_URL')
+        self.supabase_key = supabase_key or os.getenv('SUPABASE_SERVICE_KEY') or os.getenv('SUPABASE_ANON_KEY')
+        self.chunk_size = chunk_size
+        self.page_size = page_size
+
+    def chunks(self, user_ids: List[str]) -> List[List[str]]:
+        """Split user ids into chunks of `chunk_size`"""
+        return [user_ids[i:i + self.chunk_size] for i in range(0, len(user_ids), self.chunk_size)]
+
+    async def load_chunk(self, user_ids: List[str], days: int = 180) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        Load all scheduled-cycle tables for a chunk of users
+
+        Args:
+            user_ids: Shop owner UUIDs in this chunk
+            days: Transaction window to load (covers the longest analyzer window)
+
+        Returns:
+            {user_id: {table_name: [rows]}} with an entry for every requested user.
+            A table whose read failed is absent, so it is not primed and agents
+            fall back to their own queries.
+        """
+        per_user = {user_id: {table: [] for table in self.TABLES} for user_id in user_ids}
+        if not user_ids:
+            return per_user
+
+        start_date = datetime.now() - timedelta(days=days)
+
+        async with httpx.AsyncClient() as client:
+            for table, config in self.TABLES.items():
+                filters = dict(config['filters'])
+                if table == 'transactions':
+                    filters.update(transaction_window_filter(start_date))
+
+                try:
+                    rows = await self.fetch_keyset(client, table, user_ids, config['select'], filters)
+                except (BatchFetchError, httpx.HTTPError) as e:
+                    log.warning("%s not prefetched for %d users: %s", table, len(user_ids), e)
+                    for tables in per_user.values():
+                        del tables[table]
+                    continue
+                for row in rows:
+                    bucket = per_user.get(row.get('user_id'))
+                    if bucket is not None:
+                        bucket[table].append(row)
+
+        for tables in per_user.values():
+            for item in tables.get('inventory_items', []):
+                if item.get('suppliers'):
+                    item['supplier_name'] = item['suppliers'].get('name', '')
+
+        prefetch_cache.prime(per_user, days)
+        return per_user
+
+    async def fetch_keyset(self, client: httpx.AsyncClient, table: str, user_ids: List[str],
+                            select: str, filters: Dict[str, str], key: str = 'id') -> List[Dict]:
+        """
+        Page through a table for a set of users using its primary key `key`
+        (which `select` must include) as the keyset cursor.
+        Raises BatchFetchError when a page fails, so a partial read is never
+        mistaken for the complete table.
+        """
+        rows: List[Dict] = []
+        last_id: Optional[str] = None
+
+        while True:
+            params = {
+                'user_id': f"in.({','.join(user_ids)})",
+                'select': select,
+                'order': f'{key}.asc',
+                'limit': self.page_size,
+                **filters
+            }
+            if last_id is not None:
+                params[key] = f'gt.{last_id}'
+
+            response = await client.get(
+                f"{self.supabase_url}/rest/v1/{table}",
+                headers={
+                    'apikey': self.supabase_key,
+                    'Authorization': f'Bearer {self.supabase_key}'
+                },
+                params=params
+            )
+            if response.status_code != 200:
+                raise BatchFetchError(table, response.status_code, response.text)
+
+            page = response.json()
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            last_id = page[-1][key]
+
+        return rows
+
+
+class PrefetchCache:
+    """
+    Per-user rows primed by BatchDataLoader for the duration of a cycle.
+    Agents consult it before issuing their own per-user queries.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, List[Dict]]] = {}
+        self._window_days: Dict[str, int] = {}
+
+    def prime(self, per_user: Dict[str, Dict[str, List[Dict]]], days: int):
+        for user_id, tables in per_user.items():
+            self._data[user_id] = tables
+            self._window_days[user_id] = days
+
+    def get(self, user_id: str, table: str, days: Optional[int] = None) -> Optional[List[Dict]]:
+        """
+        Return primed rows for a user, or None when the agent must query itself.
+        A transaction request for a longer window than was loaded is a miss.
+        """
+        tables = self._data.get(user_id)
+        if tables is None or table not in tables:
+            return None
+        if days is not None and days > self._window_days.get(user_id, 0):
+            return None
+        return tables[table]
+
+    def clear(self, user_ids: Optional[List[str]] = None):
+        if user_ids is None:
+            self._data.clear()
+            self._window_days.clear()
+            return
+        for user_id in user_ids:
+            self._data.pop(user_id, None)
+            self._window_days.pop(user_id, None)
+
+
+def transaction_window_filter(since: datetime) -> Dict[str, str]:
+    """
+    PostgREST filter for transactions on or after the day of `since`, on the
+    schema's transaction_date column. Finer windows are applied client-side
+    by filter_transactions / the transaction frame.
+    """
+    return {'transaction_date': f'gte.{since.date().isoformat()}'}
+
+
+def filter_transactions(rows: List[Dict], transaction_type: Optional[str] = None,
+                        since: Optional[datetime] = None) -> List[Dict]:
+    """Apply the type/date filters an agent would have sent to PostgREST"""
+    since_str = since.isoformat() if since else None
+    result = []
+    for t in rows:
+        if transaction_type and t.get('transaction_type') != transaction_type:
+            continue
+        if since_str:
+            date_str = t.get('date') or t.get('transaction_date') or ''
+            if date_str < since_str[:len(date_str)]:
+                continue
+        result.append(t)
+    result.sort(key=lambda t: t.get('date') or t.get('transaction_date') or '', reverse=True)
+    return result
+
+
+# Singleton instances
+prefetch_cache = PrefetchCache()
+batch_loader = BatchDataLoader()
@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class BillPaymentAgent:
@@ -238,6 +239,9 @@ Please analyze and create a comprehensive bill payment plan."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Bill Payment Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class BudgetAnalysisAgent:
@@ -159,6 +160,9 @@ Please execute this analysis and report the budgets created."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Budget Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -9,6 +9,9 @@ from typing import Dict, Any, List, Optional
 import httpx
 from dotenv import load_dotenv
 
+from transaction_frame import load_frame
+from sales_rollups import rollup_total, day_start
+
 load_dotenv()
 
 class BusinessHealthAgent:
@@ -522,62 +525,28 @@ class BusinessHealthAgent:
                 return data[0] if data else {}
         return {}
 
+    async def _get_transaction_total(self, user_id: str, transaction_type: str,
+                                     start: datetime, end: datetime) -> float:
+        # Whole days, as the rollups store them. Windows ending today stay
+        # open-ended so entries stamped later today still count
+        start = day_start(start)
+        until = day_start(end) if end.date() < datetime.now().date() else None
+        # Day-aligned rollup buckets when they cover the window
+        total = rollup_total(user_id, transaction_type, start, until)
+        if total is not None:
+            return total
+        # Every dimension reads the same cached frame; only the first call loads it
+        frame = await load_frame(user_id, start)
+        return frame.sum('amount_aed', frame.mask(transaction_type, start, until))
+
     async def _get_total_sales(self, user_id: str, start: datetime, end: datetime) -> float:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.sale',
-                    'date': f'gte.{start.isoformat()}',
-                    'select': 'amount_aed'
-                }
-            )
-            if response.status_code == 200:
-                return sum(t.get('amount_aed', 0) for t in response.json())
-        return 0
+        return await self._get_transaction_total(user_id, 'sale', start, end)
 
     async def _get_cogs(self, user_id: str, start: datetime, end: datetime) -> float:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.purchase',
-                    'date': f'gte.{start.isoformat()}',
-                    'select': 'amount_aed'
-                }
-            )
-            if response.status_code == 200:
-                return sum(t.get('amount_aed', 0) for t in response.json())
-        return 0
+        return await self._get_transaction_total(user_id, 'purchase', start, end)
 
     async def _get_expenses(self, user_id: str, start: datetime, end: datetime) -> float:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.expense',
-                    'date': f'gte.{start.isoformat()}',
-                    'select': 'amount_aed'
-                }
-            )
-            if response.status_code == 200:
-                return sum(t.get('amount_aed', 0) for t in response.json())
-        return 0
+        return await self._get_transaction_total(user_id, 'expense', start, end)
 
     async def _get_average_monthly_expenses(self, user_id: str) -> float:
         now = datetime.now()
@@ -18,6 +18,9 @@ load_dotenv()
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
+from llm_cache import digest_payload
+from financial_context import build_financial_context, render_context
 
 
 class CashFlowMonitorAgent:
@@ -37,10 +40,10 @@ Your task is to provide a DAILY CASH FLOW STATUS that answers the critical quest
 "Am I on track to meet my monthly expenses?"
 
 ANALYSIS STEPS:
-1. Get today's date and calculate days remaining in the month
-2. Query the user's transactions for this month
-3. Calculate: total income this month, total expenses this month
-4. Query upcoming bills from the bills table
+1. Get today's date and days remaining in the month from the task
+2. Read month-to-date income and expenses from the DATA CONTEXT block
+3. Read upcoming bills (due by month end) from the DATA CONTEXT block
+4. Use the daily income statistics to judge what the user can still earn
 5. Estimate if the user will have enough to cover remaining bills
 
 OUTPUT FORMAT (JSON):
@@ -98,6 +101,8 @@ Be direct, practical, and focused on what the user needs to do TODAY."""
             days_remaining = days_in_month - today.day
             month_start = today.replace(day=1).strftime('%Y-%m-%d')
 
+            context = await build_financial_context(user_id, days=60, bill_horizon_days=days_remaining)
+
             # Create the analysis prompt
             prompt = f"""Perform a daily cash flow check for user {user_id}.
 
@@ -105,14 +110,14 @@ TODAY: {today.strftime('%Y-%m-%d')}
 DAYS REMAINING IN MONTH: {days_remaining}
 MONTH START: {month_start}
 
+DATA CONTEXT:
+{render_context(context)}
+
 STEPS:
-1. Query transactions table for this user from {month_start} to today
-   - Calculate total income (transaction_type = 'income')
-   - Calculate total expenses (transaction_type = 'expense')
+1. Take month-to-date income and expenses from transactions.month_to_date
 
-2. Query bills table for this user
-   - Get bills with due_date >= today AND due_date <= end of month
-   - Sum up all pending bill amounts
+2. Take pending bills due by end of month from upcoming_bills
+   - total_due is the sum of all pending bill amounts
 
 3. Calculate:
    - Net position = Income - Expenses
@@ -140,7 +145,8 @@ Execute this analysis and provide the cash flow status."""
                 system_prompt=self.system_prompt,
                 task=prompt,
                 user_id=user_id,
-                use_azure=True
+                use_azure=True,
+                data_digest=digest_payload(context)
             )
 
             print(f"[CashFlow Agent] Daily check complete for user {user_id}")
@@ -153,6 +159,9 @@ Execute this analysis and provide the cash flow status."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[CashFlow Agent] Error checking user {user_id}: {str(e)}")
             return {
@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class ContextIntelligenceAgent:
@@ -105,6 +106,9 @@ Please execute this analysis and report what context you added."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Context Agent] Error analyzing user {user_id}: {str(e)}")
             return {
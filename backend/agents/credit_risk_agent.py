@@ -7,8 +7,11 @@ import os
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 import httpx
+import numpy as np
 from dotenv import load_dotenv
 
+from batch_loader import batch_loader, prefetch_cache
+
 load_dotenv()
 
 class CreditRiskAgent:
@@ -36,6 +39,9 @@ class CreditRiskAgent:
         'NORMAL': {'min_days': 7, 'action': 'Send WhatsApp/SMS reminder'},
         'LOW': {'min_days': 0, 'action': 'Monitor'}
     }
+    
+    # Customer ids per `customer_id=in.(...)` request (keeps the URL short)
+    CUSTOMER_ID_CHUNK = 200
 
     def __init__(self):
         self.supabase_url = os.getenv('SUPABASE_URL')
@@ -58,53 +64,18 @@ class CreditRiskAgent:
             if not customer:
                 return {'status': 'error', 'message': 'Customer not found'}
             
-            # Fetch payment history
-            history = await self._get_payment_history(customer_id)
-            
             # Calculate scoring factors
-            base_score = 50
-            
-            # Factor 1: Payment punctuality (+/- 25 points)
+            factors = self._score_factors([customer])
             on_time_ratio = customer.get('on_time_payment_ratio', 0)
-            if on_time_ratio >= 0.9:
-                punctuality_score = 25
-            elif on_time_ratio >= 0.7:
-                punctuality_score = 15
-            elif on_time_ratio >= 0.5:
-                punctuality_score = 5
-            else:
-                punctuality_score = -15
-            
-            # Factor 2: Average days to pay (+/- 15 points)
             avg_days = customer.get('average_payment_days', 30)
-            if avg_days <= 7:
-                speed_score = 15
-            elif avg_days <= 15:
-                speed_score = 10
-            elif avg_days <= 30:
-                speed_score = 0
-            else:
-                speed_score = -10
-            
-            # Factor 3: Bounced cheques (-20 points each, max -40)
             bounced = customer.get('bounced_cheques', 0)
-            bounced_score = -min(bounced * 20, 40)
-            
-            # Factor 4: Relationship duration (+10 max)
-            created_at = customer.get('created_at')
-            if created_at:
-                months = (datetime.now() - datetime.fromisoformat(created_at.replace('Z', '+00:00'))).days // 30
-                relationship_score = min(months // 6, 10)
-            else:
-                relationship_score = 0
-            
-            # Factor 5: Total business volume bonus (+5 for high volume)
-            total_business = customer.get('total_credit_given', 0) + customer.get('total_payments_received', 0)
-            volume_score = 5 if total_business > 50000 else 0
-            
-            # Calculate final score
-            final_score = base_score + punctuality_score + speed_score + bounced_score + relationship_score + volume_score
-            final_score = max(0, min(100, final_score))
+            punctuality_score = int(factors['punctuality'][0])
+            speed_score = int(factors['speed'][0])
+            bounced_score = int(factors['bounced'][0])
+            relationship_score = int(factors['relationship'][0])
+            volume_score = int(factors['volume'][0])
+            total_business = float(factors['total_business'][0])
+            final_score = int(factors['score'][0])
             
             # Determine risk level
             risk_level = self._get_risk_level(final_score)
@@ -154,6 +125,41 @@ class CreditRiskAgent:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    async def recompute_trust_scores(self, user_id: str) -> Dict[str, Any]:
+        """
+        Recompute the trust score of every customer of a shop and persist the
+        changed ones with one bulk update (run by the scheduled cycle, so
+        collection priority reads fresh scores)
+        
+        Returns:
+            Counts of scored and updated customers
+        """
+        try:
+            customers = await self._get_all_customers(user_id)
+            if not customers:
+                return {'status': 'success', 'customers_scored': 0, 'customers_updated': 0}
+            
+            scores = self._score_factors(customers)['score']
+            changed = []
+            for customer, score in zip(customers, scores.tolist()):
+                if customer.get('trust_score') != score:
+                    # Later readers in this cycle share the prefetched rows
+                    customer['trust_score'] = score
+                    changed.append(customer)
+            
+            if changed and not await self._update_trust_scores(changed):
+                return {'status': 'error', 'message': 'Failed to save trust scores'}
+            
+            return {
+                'status': 'success',
+                'customers_scored': len(customers),
+                'customers_updated': len(changed),
+                'average_trust_score': round(float(scores.mean()), 1)
+            }
+            
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
     async def get_collection_priority(self, user_id: str) -> Dict[str, Any]:
         """
         Get prioritized list of customers for credit collection
@@ -165,7 +171,8 @@ class CreditRiskAgent:
             # Fetch all customers with outstanding credit
             customers = await self._get_customers_with_credit(user_id)
             
-            # Fetch overdue credit transactions
+            # Fetch the oldest overdue credit transaction of every customer at once
+            oldest_overdue = await self._get_oldest_overdue_bulk(user_id, [c['id'] for c in customers])
             prioritized = []
             
             for customer in customers:
@@ -173,9 +180,8 @@ class CreditRiskAgent:
                 if outstanding <= 0:
                     continue
                 
-                # Get oldest overdue transaction
-                oldest_overdue = await self._get_oldest_overdue(customer['id'])
-                days_overdue = oldest_overdue.get('days_overdue', 0) if oldest_overdue else 0
+                oldest = oldest_overdue.get(customer['id'])
+                days_overdue = oldest.get('days_overdue', 0) if oldest else 0
                 
                 # Determine priority
                 priority = self._get_collection_priority(days_overdue)
@@ -235,12 +241,14 @@ class CreditRiskAgent:
                 'overdue_90': {'amount': 0, 'count': 0, 'label': '90+ days'}
             }
             
+            oldest_overdue = await self._get_oldest_overdue_bulk(user_id, [c['id'] for c in customers])
+            
             for customer in customers:
                 outstanding = customer.get('total_credit_outstanding', 0)
                 if outstanding <= 0:
                     continue
                 
-                oldest = await self._get_oldest_overdue(customer['id'])
+                oldest = oldest_overdue.get(customer['id'])
                 days = oldest.get('days_overdue', 0) if oldest else 0
                 
                 if days <= 30:
@@ -274,6 +282,48 @@ class CreditRiskAgent:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    def _score_factors(self, customers: List[Dict]) -> Dict[str, np.ndarray]:
+        """
+        Trust score factors for many customers at once:
+        1. Payment punctuality (+/- 25 points)
+        2. Average days to pay (+/- 15 points)
+        3. Bounced cheques (-20 points each, max -40)
+        4. Relationship duration (+1 per 6 months, max +10)
+        5. Total business volume (+5 above AED 50,000)
+        Base score is 50, clipped to 0-100.
+        """
+        def column(key: str, default: float) -> np.ndarray:
+            return np.array([float(c.get(key, default) or 0) for c in customers])
+        
+        on_time_ratio = column('on_time_payment_ratio', 0)
+        punctuality = np.select(
+            [on_time_ratio >= 0.9, on_time_ratio >= 0.7, on_time_ratio >= 0.5], [25, 15, 5], -15
+        )
+        
+        avg_days = column('average_payment_days', 30)
+        speed = np.select([avg_days <= 7, avg_days <= 15, avg_days <= 30], [15, 10, 0], -10)
+        
+        bounced = -np.minimum(column('bounced_cheques', 0) * 20, 40)
+        
+        created = np.array([(c.get('created_at') or '')[:10] or 'NaT' for c in customers], dtype='datetime64[D]')
+        days = (np.datetime64(datetime.now().date(), 'D') - created).astype(np.int64)
+        months = np.where(np.isnat(created), 0, days // 30)
+        relationship = np.minimum(months // 6, 10)
+        
+        total_business = column('total_credit_given', 0) + column('total_payments_received', 0)
+        volume = np.where(total_business > 50000, 5, 0)
+        
+        score = np.clip(50 + punctuality + speed + bounced + relationship + volume, 0, 100).astype(np.int64)
+        return {
+            'punctuality': punctuality,
+            'speed': speed,
+            'bounced': bounced,
+            'relationship': relationship,
+            'volume': volume,
+            'total_business': total_business,
+            'score': score
+        }
+
     def _get_risk_level(self, score: int) -> Dict[str, str]:
         """Determine risk level from score"""
         if score >= 80:
@@ -350,6 +400,10 @@ class CreditRiskAgent:
 
     async def _get_customers_with_credit(self, user_id: str) -> List[Dict]:
         """Fetch all customers with outstanding credit"""
+        prefetched = prefetch_cache.get(user_id, 'customers')
+        if prefetched is not None:
+            return [c for c in prefetched if (c.get('total_credit_outstanding') or 0) > 0]
+        
         async with httpx.AsyncClient() as client:
             response = await client.get(
                 f"{self.supabase_url}/rest/v1/customers",
@@ -367,47 +421,62 @@ class CreditRiskAgent:
                 return response.json()
         return []
 
-    async def _get_payment_history(self, customer_id: str) -> List[Dict]:
-        """Fetch payment history for customer"""
+    async def _get_all_customers(self, user_id: str) -> List[Dict]:
+        """Fetch every customer of a shop (one paged query)"""
+        prefetched = prefetch_cache.get(user_id, 'customers')
+        if prefetched is not None:
+            return prefetched
+        
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/credit_transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'customer_id': f'eq.{customer_id}',
-                    'select': '*',
-                    'order': 'created_at.desc'
-                }
-            )
-            if response.status_code == 200:
-                return response.json()
-        return []
+            return await batch_loader.fetch_keyset(client, 'customers', [user_id], '*', {})
 
-    async def _get_oldest_overdue(self, customer_id: str) -> Optional[Dict]:
-        """Get oldest overdue transaction"""
+    async def _update_trust_scores(self, customers: List[Dict]) -> bool:
+        """
+        Write trust scores back in one call to the update_trust_scores RPC,
+        which sets only trust_score so concurrent edits to other columns stand
+        """
+        payload = [{'id': c['id'], 'score': c['trust_score']} for c in customers]
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/credit_transactions",
+            response = await client.post(
+                f"{self.supabase_url}/rest/v1/rpc/update_trust_scores",
                 headers={
                     'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
+                    'Authorization': f'Bearer {self.supabase_key}',
+                    'Content-Type': 'application/json'
                 },
-                params={
-                    'customer_id': f'eq.{customer_id}',
-                    'credit_type': 'eq.credit_given',
-                    'days_overdue': 'gt.0',
-                    'select': 'days_overdue,due_date,amount_aed',
-                    'order': 'days_overdue.desc',
-                    'limit': 1
-                }
+                json={'scores': payload}
             )
-            if response.status_code == 200:
-                data = response.json()
-                return data[0] if data else None
-        return None
+            return response.status_code in [200, 204]
+
+    async def _get_oldest_overdue_bulk(self, user_id: str, customer_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Oldest overdue credit transaction per customer, for many customers in
+        one paged query per CUSTOMER_ID_CHUNK ids instead of one per customer
+        
+        Returns:
+            {customer_id: credit transaction}; customers with nothing overdue are absent
+        """
+        oldest: Dict[str, Dict] = {}
+        if not customer_ids:
+            return oldest
+        
+        async with httpx.AsyncClient() as client:
+            for i in range(0, len(customer_ids), self.CUSTOMER_ID_CHUNK):
+                chunk = customer_ids[i:i + self.CUSTOMER_ID_CHUNK]
+                rows = await batch_loader.fetch_keyset(
+                    client, 'credit_transactions', [user_id],
+                    'id,customer_id,days_overdue,due_date,amount_aed',
+                    {
+                        'customer_id': f"in.({','.join(chunk)})",
+                        'credit_type': 'eq.credit_given',
+                        'days_overdue': 'gt.0'
+                    }
+                )
+                for row in rows:
+                    current = oldest.get(row.get('customer_id'))
+                    if current is None or (row.get('days_overdue') or 0) > (current.get('days_overdue') or 0):
+                        oldest[row.get('customer_id')] = row
+        return oldest
 
 
 # Singleton instance
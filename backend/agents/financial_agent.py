@@ -12,6 +12,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class FinancialHealthAgent:
@@ -154,6 +155,9 @@ Please execute this analysis and report the financial health assessment."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Financial Health Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -0,0 +1,244 @@
+"""
+Financial Context Builder
+Computes the statistics legacy agents need in Python and renders them as a
+compact JSON block for the task prompt, so the model doesn't have to query
+and read raw transaction rows through tool calls
+"""
+
+import json
+import math
+from datetime import datetime, timedelta, date
+from typing import Dict, Any, List, Optional
+import os
+import sys
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from autogen_runtime import SUPABASE_URL, SUPABASE_ANON_KEY
+from structured_log import get_logger
+from batch_loader import BatchDataLoader, BatchFetchError
+
+
+log = get_logger("financial_context")
+
+# Pages through the same project the tools query
+_loader = BatchDataLoader(supabase_url=SUPABASE_URL, supabase_key=SUPABASE_ANON_KEY)
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+async def _fetch_rows(client: httpx.AsyncClient, table: str, params: Dict[str, str]) -> List[Dict]:
+    """
+    Rows of one table. Raises on a failed read: an empty table would give an
+    all-zero context that is then cached under a valid data digest.
+    """
+    response = await client.get(
+        f"{SUPABASE_URL}/rest/v1/{table}",
+        headers={
+            "apikey": SUPABASE_ANON_KEY,
+            "Authorization": f"Bearer {SUPABASE_ANON_KEY}"
+        },
+        params=params
+    )
+    if response.status_code != 200:
+        log.warning("Failed to read %s: HTTP %d", table, response.status_code)
+        response.raise_for_status()
+    return response.json()
+
+
+def _to_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def _round(value: float) -> float:
+    return round(value, 2)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def summarize_transactions(transactions: List[Dict], today: date, days: int) -> Dict[str, Any]:
+    """
+    Income/expense statistics over the last `days` days
+
+    Daily figures include zero-income days, so the weekday means and
+    volatility reflect days the user didn't earn anything.
+    """
+    start = today - timedelta(days=days - 1)
+    daily_income = [0.0] * days
+    total_income = total_expense = 0.0
+    income_count = expense_count = 0
+    month_income = month_expense = 0.0
+    expense_by_category: Dict[str, float] = {}
+
+    for t in transactions:
+        d = _to_date(t.get("transaction_date"))
+        if d is None or d < start or d > today:
+            continue
+        amount = float(t.get("amount") or 0)
+        in_month = d.year == today.year and d.month == today.month
+        if t.get("transaction_type") == "income":
+            daily_income[(d - start).days] += amount
+            total_income += amount
+            income_count += 1
+            if in_month:
+                month_income += amount
+        else:
+            total_expense += amount
+            expense_count += 1
+            category = t.get("category") or "Other"
+            expense_by_category[category] = expense_by_category.get(category, 0.0) + amount
+            if in_month:
+                month_expense += amount
+
+    mean = total_income / days
+    variance = sum((x - mean) ** 2 for x in daily_income) / days
+    std = math.sqrt(variance)
+
+    weekday_totals = [0.0] * 7
+    weekday_counts = [0] * 7
+    for offset, amount in enumerate(daily_income):
+        weekday = (start + timedelta(days=offset)).weekday()
+        weekday_totals[weekday] += amount
+        weekday_counts[weekday] += 1
+
+    # Complete 7-day blocks ending today, oldest first
+    weekly = [sum(daily_income[i:i + 7]) for i in range(days % 7, days, 7)]
+    sorted_weekly = sorted(weekly)
+    half = len(weekly) // 2
+    trend_pct = 0.0
+    if half and sum(weekly[:half]) > 0:
+        trend_pct = (sum(weekly[-half:]) - sum(weekly[:half])) / sum(weekly[:half])
+
+    top_expenses = sorted(expense_by_category.items(), key=lambda kv: kv[1], reverse=True)[:5]
+
+    return {
+        "window_days": days,
+        "from": start.isoformat(),
+        "to": today.isoformat(),
+        "income_total": _round(total_income),
+        "expense_total": _round(total_expense),
+        "net": _round(total_income - total_expense),
+        "income_txn_count": income_count,
+        "expense_txn_count": expense_count,
+        "active_income_days": sum(1 for x in daily_income if x > 0),
+        "daily_income_mean": _round(mean),
+        "daily_income_std": _round(std),
+        "income_cv": _round(std / mean) if mean else None,
+        "weekday_income_mean": {
+            WEEKDAYS[i]: _round(weekday_totals[i] / weekday_counts[i]) if weekday_counts[i] else 0.0
+            for i in range(7)
+        },
+        "weekly_income": [_round(x) for x in weekly],
+        "weekly_income_p10_p50_p90": [
+            _round(_percentile(sorted_weekly, q)) for q in (0.1, 0.5, 0.9)
+        ],
+        "trend_pct": _round(trend_pct),
+        "month_to_date": {
+            "income": _round(month_income),
+            "expenses": _round(month_expense),
+            "net": _round(month_income - month_expense)
+        },
+        "top_expense_categories": {k: _round(v) for k, v in top_expenses}
+    }
+
+
+def summarize_bills(bills: List[Dict], today: date, horizon_days: int) -> Dict[str, Any]:
+    """Pending bills due between today and today + horizon_days"""
+    until = today + timedelta(days=horizon_days)
+    upcoming = []
+    for b in bills:
+        due = _to_date(b.get("due_date"))
+        if due is None or due < today or due > until:
+            continue
+        upcoming.append({
+            "name": b.get("bill_name"),
+            "amount": _round(float(b.get("amount") or 0)),
+            "due": due.isoformat(),
+            "priority": b.get("priority")
+        })
+    upcoming.sort(key=lambda b: b["due"])
+    return {
+        "horizon_days": horizon_days,
+        "count": len(upcoming),
+        "total_due": _round(sum(b["amount"] for b in upcoming)),
+        "items": upcoming
+    }
+
+
+PROFILE_FIELDS = (
+    "monthly_income_min,monthly_income_max,monthly_expenses_avg,emergency_fund_target,"
+    "current_emergency_fund,risk_tolerance,debt_obligations,dependents"
+)
+
+
+async def build_financial_context(user_id: str, days: int = 60,
+                                  bill_horizon_days: int = 30,
+                                  today: Optional[date] = None,
+                                  include_profile: bool = False) -> Dict[str, Any]:
+    """
+    Fetch a user's transactions and pending bills and reduce them to the
+    statistics the pattern, volatility and cash flow agents reason over.
+    include_profile adds the user_profiles row (fixed costs, debt, emergency
+    fund) that budget and risk analysis need.
+
+    Raises httpx.HTTPError (BatchFetchError for a failed transactions page)
+    when a table can't be read, so no context (and no cache entry keyed on
+    it) is built from partial data.
+    """
+    today = today or datetime.now().date()
+    # Reach back to the start of the month so month-to-date is complete
+    since = min(today - timedelta(days=days - 1), today.replace(day=1))
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        # Paged: a busy user has more rows than one PostgREST response returns
+        try:
+            transactions = await _loader.fetch_keyset(
+                client, "transactions", [user_id],
+                "transaction_id,transaction_date,amount,transaction_type,category",
+                {"transaction_date": f"gte.{since.isoformat()}"},
+                key="transaction_id"
+            )
+        except BatchFetchError as e:
+            log.warning("Failed to read transactions: %s", e)
+            raise
+        bills = await _fetch_rows(client, "bills", {
+            "user_id": f"eq.{user_id}",
+            "status": "eq.pending",
+            "select": "bill_name,amount,due_date,priority"
+        })
+        profiles = []
+        if include_profile:
+            profiles = await _fetch_rows(client, "user_profiles", {
+                "user_id": f"eq.{user_id}",
+                "select": PROFILE_FIELDS,
+                "limit": "1"
+            })
+
+    context = {
+        "user_id": user_id,
+        "today": today.isoformat(),
+        "transactions": summarize_transactions(transactions, today, days),
+        "upcoming_bills": summarize_bills(bills, today, bill_horizon_days)
+    }
+    if include_profile:
+        context["profile"] = profiles[0] if profiles else None
+    return context
+
+
+def render_context(context: Dict[str, Any]) -> str:
+    """Compact JSON block for embedding in a task prompt"""
+    return json.dumps(context, separators=(",", ":"))
@@ -0,0 +1,211 @@
+"""
+Fused Core Analysis Agent
+Runs pattern, volatility, budget, risk and cash flow analysis as one LLM request
+Writes to: income_patterns, income_forecasts, budgets, risk_assessments tables
+(each section is dispatched to write_agent_output_to_db under its agent name)
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+import os
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from autogen_runtime import run_autogen_mcp_task, parse_agent_json, FUSED_AGENT_NAME, FUSED_SECTIONS
+from llm_gateway import GatewayOverloaded
+from llm_cache import digest_payload
+from financial_context import build_financial_context, render_context
+
+
+# Orchestrator key for each fused section
+SECTION_AGENT_KEYS = {
+    "pattern_agent": "pattern",
+    "volatility_agent": "volatility",
+    "budget_agent": "budget",
+    "risk_agent": "risk",
+    "cashflow_agent": "cashflow",
+}
+
+
+class FusedCoreAnalysisAgent:
+    """Single-request replacement for the five core legacy agents"""
+
+    def __init__(self, mcp_servers=None):
+        self.agent_name = FUSED_AGENT_NAME
+        self.mcp_servers = mcp_servers
+        self.system_prompt = self._create_system_prompt()
+
+    def _create_system_prompt(self) -> str:
+        return """You are the core financial analysis engine for gig workers in India.
+
+In ONE response you produce five analyses for a user from the DATA CONTEXT
+in the task: income patterns, a 30-day income forecast, feast/famine budgets,
+a risk assessment and today's cash flow status.
+
+**CRITICAL: Output ONLY one valid JSON object with exactly these sections:**
+
+```json
+{
+  "income_patterns": {
+    "average_weekly_income": 10500.00,
+    "income_volatility": 0.35,
+    "seasonal_factors": "Weekend peaks; slower mid-week",
+    "confidence_score": 0.8
+  },
+  "income_forecast": {
+    "forecast_period_days": 30,
+    "pessimistic_scenario": {"expected_income": 35000.00, "confidence": 0.15, "daily_average": 1166.67, "risk_factors": ["..."]},
+    "realistic_scenario": {"expected_income": 45000.00, "confidence": 0.65, "daily_average": 1500.00, "risk_factors": ["..."]},
+    "optimistic_scenario": {"expected_income": 55000.00, "confidence": 0.20, "daily_average": 1833.33, "risk_factors": ["..."]},
+    "volatility_score": 0.42,
+    "volatility_category": "low" | "moderate" | "high",
+    "trend_direction": "increasing" | "stable" | "decreasing",
+    "forecast_confidence": 0.68,
+    "recommendation": "..."
+  },
+  "budgets": [
+    {
+      "budget_type": "feast_week" | "famine_week" | "monthly",
+      "valid_from": "YYYY-MM-DD",
+      "valid_until": "YYYY-MM-DD",
+      "total_income_expected": 45000.00,
+      "fixed_costs": {"rent": 12000},
+      "variable_costs": {"food": 3000},
+      "savings_target": 15000.00,
+      "discretionary_budget": 6000.00,
+      "category_limits": {"food": 3500},
+      "confidence_score": 0.85
+    }
+  ],
+  "risk_assessment": {
+    "overall_risk_level": "low" | "medium" | "high" | "critical",
+    "risk_score": 4.9,
+    "risk_factors": [{"factor": "...", "impact": "..."}],
+    "debt_to_income_ratio": 0.19,
+    "emergency_fund_coverage": 3.5,
+    "escalation_needed": false,
+    "recommended_actions": [{"action": "...", "description": "..."}],
+    "ai_risk_analysis": "..."
+  },
+  "cashflow_status": {
+    "status": "on_track" | "at_risk" | "critical",
+    "days_remaining_in_month": 12,
+    "month_to_date": {"income": 0, "expenses": 0, "net": 0},
+    "upcoming_bills": {"total_due": 0, "count": 0, "next_due_date": "YYYY-MM-DD", "next_due_amount": 0},
+    "projected_gap": 0,
+    "daily_earning_target": 0,
+    "message": "...",
+    "recommendations": ["..."],
+    "confidence_score": 0.8
+  }
+}
+```
+
+**Rules:**
+- Base every number on the DATA CONTEXT; keep sections consistent with each other
+  (the forecast drives the budgets, the budgets and profile drive the risk score)
+- Budgets: at least feast_week and famine_week
+- Cash flow: on_track if projected gap > 20% of upcoming bills, at_risk if 0-20%, critical if negative
+- Amounts in INR, realistic for Indian gig workers
+- Output ONLY the JSON object. No other text."""
+
+    async def analyze_user(self, user_id: str) -> dict:
+        """
+        Run the five core analyses for a user in one request
+
+        Args:
+            user_id: UUID of the user to analyze
+
+        Returns:
+            dict with per-section results (keyed by orchestrator agent key)
+        """
+        print(f"[Fused Agent] Starting core analysis for user {user_id}")
+
+        try:
+            today = datetime.now()
+            days_in_month = (today.replace(month=today.month % 12 + 1, day=1) - timedelta(days=1)).day
+            days_remaining = days_in_month - today.day
+
+            context = await build_financial_context(
+                user_id, days=90, bill_horizon_days=days_remaining, include_profile=True
+            )
+
+            prompt = f"""Run the core financial analysis for user {user_id}.
+
+TODAY: {today.strftime('%Y-%m-%d')}
+DAYS REMAINING IN MONTH: {days_remaining}
+
+DATA CONTEXT:
+{render_context(context)}
+
+Return the five sections as one JSON object."""
+
+            result = await run_autogen_mcp_task(
+                agent_name=FUSED_AGENT_NAME,
+                system_prompt=self.system_prompt,
+                task=prompt,
+                user_id=user_id,
+                use_azure=True,
+                data_digest=digest_payload(context)
+            )
+
+            data = parse_agent_json(result)
+            sections = {}
+            for section_agent, key in FUSED_SECTIONS.items():
+                section = data.get(key) if isinstance(data, dict) else None
+                sections[SECTION_AGENT_KEYS[section_agent]] = {
+                    "success": section is not None,
+                    "user_id": user_id,
+                    "agent": section_agent,
+                    "result": json.dumps({key: section}) if section is not None else None,
+                    "error": None if section is not None else f"Section '{key}' missing from fused response",
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            print(f"[Fused Agent] Core analysis complete for user {user_id}")
+
+            return {
+                "success": isinstance(data, dict),
+                "user_id": user_id,
+                "agent": self.agent_name,
+                "result": result,
+                "sections": sections,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except GatewayOverloaded:
+            raise
+
+        except Exception as e:
+            print(f"[Fused Agent] Error analyzing user {user_id}: {str(e)}")
+            return {
+                "success": False,
+                "user_id": user_id,
+                "agent": self.agent_name,
+                "error": str(e),
+                "sections": {},
+                "timestamp": datetime.now().isoformat()
+            }
+
+
+async def main():
+    """Test the fused core analysis agent"""
+    agent = FusedCoreAnalysisAgent()
+
+    test_user_id = "153735c8-b1e3-4fc6-aa4e-7deb6454990b"
+
+    print(f"Testing Fused Core Analysis Agent with user {test_user_id}")
+    result = await agent.analyze_user(test_user_id)
+
+    print("\nResult:")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class FinancialGoalsAgent:
@@ -303,6 +304,9 @@ Please create a comprehensive goal-based financial plan with clear explanations.
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Goals Agent] Error analyzing user {user_id}: {str(e)}")
             return {
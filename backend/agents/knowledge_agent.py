@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class KnowledgeIntegrationAgent:
@@ -121,26 +122,11 @@ Store in user_schemes table with fields:
 - match_confidence (0-1)
 - missing_requirements (JSON array)
 - application_status (eligible/not_eligible/applied)
-- matched_at"""
+- matched_at
 
-    async def analyze_user(self, user_id: str) -> dict:
-        """
-        Match government schemes for a specific user
-
-        Args:
-            user_id: UUID of the user to analyze
-
-        Returns:
-            dict with analysis results and success status
-        """
-        print(f"[Knowledge Agent] Starting analysis for user {user_id}")
-
-        try:
-            prompt = f"""Match government schemes for user {user_id} based on their occupation and profile.
-
-Steps:
-1. Read users table for user {user_id} to get occupation field
-2. Read user_profiles for user {user_id} to understand eligibility (income, location, etc.)
+**Steps:**
+1. Read users table for the user to get occupation field
+2. Read user_profiles for the user to understand eligibility (income, location, etc.)
 3. Read government_schemes table to see available schemes
 4. **CRITICALLY IMPORTANT**: Filter and prioritize schemes based on user's occupation:
    - For "Auto Driver" or "Rickshaw Driver" → Show vehicle loans, fuel subsidy, driver welfare schemes
@@ -159,10 +145,26 @@ Steps:
 8. Include match_confidence (higher for occupation-relevant schemes) and any missing_requirements
 9. Log to agent_logs table
 
-User ID: {user_id}
-
 **IMPORTANT**: Prioritize occupation-specific schemes first, then show general schemes. The occupation field should be the PRIMARY matching criterion."""
 
+    async def analyze_user(self, user_id: str) -> dict:
+        """
+        Match government schemes for a specific user
+
+        Args:
+            user_id: UUID of the user to analyze
+
+        Returns:
+            dict with analysis results and success status
+        """
+        print(f"[Knowledge Agent] Starting analysis for user {user_id}")
+
+        try:
+            # Instructions live in the (static, cacheable) system prompt
+            prompt = f"""Match government schemes for user {user_id} based on their occupation and profile.
+
+User ID: {user_id}"""
+
             result = await run_autogen_mcp_task(
                 agent_name="knowledge_agent",
                 system_prompt=self.system_prompt,
@@ -181,6 +183,9 @@ User ID: {user_id}
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Knowledge Agent] Error analyzing user {user_id}: {str(e)}")
             return {
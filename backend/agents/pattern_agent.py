@@ -18,6 +18,9 @@ load_dotenv()
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
+from llm_cache import digest_payload
+from financial_context import build_financial_context, render_context
 
 
 class PatternRecognitionAgent:
@@ -47,7 +50,10 @@ You must output your analysis in JSON format with:
 - confidence_score
 - last_updated
 
-Use the postgrestRequest tool to query the transactions table for income transactions."""
+The task includes a DATA CONTEXT JSON block with precomputed statistics for the
+last 60 days (daily/weekday income means, volatility, weekly totals, trend).
+Base your analysis on it; only use the postgrestRequest tool if something you
+need is missing from the context."""
 
     async def analyze_user(self, user_id: str) -> dict:
         """
@@ -62,12 +68,17 @@ Use the postgrestRequest tool to query the transactions table for income transac
         print(f"[Pattern Agent] Starting analysis for user {user_id}")
 
         try:
+            context = await build_financial_context(user_id, days=60)
+
             # Create the analysis prompt
             prompt = f"""Analyze income patterns for user {user_id}.
 
+DATA CONTEXT:
+{render_context(context)}
+
 Steps:
-1. Query transactions table for this user (last 60 days)
-2. Calculate income statistics  
+1. Read the transaction statistics in the data context (last 60 days)
+2. Interpret income statistics
 3. Identify weekday patterns
 4. Detect trends
 5. Write results to income_patterns table
@@ -82,7 +93,8 @@ Please execute this analysis and report what you found."""
                 system_prompt=self.system_prompt,
                 task=prompt,
                 user_id=user_id,
-                use_azure=True
+                use_azure=True,
+                data_digest=digest_payload(context)
             )
 
             print(f"[Pattern Agent] Analysis complete for user {user_id}")
@@ -95,6 +107,9 @@ Please execute this analysis and report what you found."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Pattern Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -9,6 +9,8 @@ from typing import Dict, Any, List, Optional
 import httpx
 from dotenv import load_dotenv
 
+from transaction_frame import TransactionFrame, load_frame
+
 load_dotenv()
 
 class ProfitAnalysisAgent:
@@ -71,10 +73,11 @@ class ProfitAnalysisAgent:
             # Get date range based on period
             start_date, end_date = self._get_date_range(period)
             
-            # Fetch financial data
-            sales_data = await self._get_sales(user_id, start_date, end_date)
-            purchase_data = await self._get_purchases(user_id, start_date, end_date)
-            expense_data = await self._get_expenses(user_id, start_date, end_date)
+            # Fetch financial data (one columnar load, shared with the other agents)
+            frame = await load_frame(user_id, start_date)
+            sales_data = self._summarize_sales(frame, start_date, end_date)
+            purchase_data = self._summarize_purchases(frame, start_date, end_date)
+            expense_data = self._summarize_expenses(frame, start_date, end_date)
             business_profile = await self._get_business_profile(user_id)
             
             # Calculate profit metrics
@@ -174,110 +177,43 @@ class ProfitAnalysisAgent:
             start = today.replace(day=1)
             return start, today
     
-    async def _get_sales(self, user_id: str, start_date, end_date) -> Dict[str, Any]:
-        """Fetch sales data from database"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.sale',
-                    'transaction_date': f'gte.{start_date}&transaction_date=lte.{end_date}',
-                    'select': 'amount_aed,vat_amount,total_amount,payment_method,vat_category'
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                total = sum(t.get('amount_aed', 0) for t in data)
-                output_vat = sum(t.get('vat_amount', 0) for t in data)
-                
-                # Breakdown by payment method
-                cash = sum(t.get('total_amount', 0) for t in data if t.get('payment_method') == 'cash')
-                card = sum(t.get('total_amount', 0) for t in data if t.get('payment_method') in ['card', 'apple_pay', 'samsung_pay'])
-                bank = sum(t.get('total_amount', 0) for t in data if t.get('payment_method') == 'bank_transfer')
-                
-                # Breakdown by VAT category
-                standard = sum(t.get('amount_aed', 0) for t in data if t.get('vat_category') == 'standard')
-                zero_rated = sum(t.get('amount_aed', 0) for t in data if t.get('vat_category') == 'zero_rated')
-                exempt = sum(t.get('amount_aed', 0) for t in data if t.get('vat_category') == 'exempt')
-                
-                return {
-                    'total': total,
-                    'output_vat': output_vat,
-                    'cash_sales': cash,
-                    'card_sales': card,
-                    'bank_sales': bank,
-                    'standard_rated': standard,
-                    'zero_rated': zero_rated,
-                    'exempt': exempt,
-                    'count': len(data)
-                }
+    def _summarize_sales(self, frame: TransactionFrame, start_date, end_date) -> Dict[str, Any]:
+        """Sales totals for the period, by payment method and VAT category"""
+        sales = frame.mask('sale', start_date, end_date + timedelta(days=1))
+        if not sales.any():
             return {'total': 0, 'output_vat': 0, 'count': 0}
+
+        card_methods = frame.is_in('payment_method', 'card', 'apple_pay', 'samsung_pay')
+        return {
+            'total': frame.sum('amount_aed', sales),
+            'output_vat': frame.sum('vat_amount', sales),
+            'cash_sales': frame.sum('total_amount', sales & frame.is_in('payment_method', 'cash')),
+            'card_sales': frame.sum('total_amount', sales & card_methods),
+            'bank_sales': frame.sum('total_amount', sales & frame.is_in('payment_method', 'bank_transfer')),
+            'standard_rated': frame.sum('amount_aed', sales & frame.is_in('vat_category', 'standard')),
+            'zero_rated': frame.sum('amount_aed', sales & frame.is_in('vat_category', 'zero_rated')),
+            'exempt': frame.sum('amount_aed', sales & frame.is_in('vat_category', 'exempt')),
+            'count': frame.count(sales)
+        }
     
-    async def _get_purchases(self, user_id: str, start_date, end_date) -> Dict[str, Any]:
-        """Fetch purchase data from database"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.purchase',
-                    'transaction_date': f'gte.{start_date}&transaction_date=lte.{end_date}',
-                    'select': 'amount_aed,vat_amount,total_amount'
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                total = sum(t.get('amount_aed', 0) for t in data)
-                input_vat = sum(t.get('vat_amount', 0) for t in data)
-                
-                return {
-                    'total': total,
-                    'input_vat': input_vat,
-                    'count': len(data)
-                }
-            return {'total': 0, 'input_vat': 0, 'count': 0}
+    def _summarize_purchases(self, frame: TransactionFrame, start_date, end_date) -> Dict[str, Any]:
+        """Purchase totals for the period"""
+        purchases = frame.mask('purchase', start_date, end_date + timedelta(days=1))
+        return {
+            'total': frame.sum('amount_aed', purchases),
+            'input_vat': frame.sum('vat_amount', purchases),
+            'count': frame.count(purchases)
+        }
     
-    async def _get_expenses(self, user_id: str, start_date, end_date) -> Dict[str, Any]:
-        """Fetch expense data categorized by UAE expense types"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.expense',
-                    'transaction_date': f'gte.{start_date}&transaction_date=lte.{end_date}',
-                    'select': 'amount_aed,vat_amount,category_name'
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Categorize expenses
-                expenses = {}
-                for t in data:
-                    category = t.get('category_name', 'other').lower().replace(' ', '_')
-                    if category not in expenses:
-                        expenses[category] = 0
-                    expenses[category] += t.get('amount_aed', 0)
-                
-                return expenses
-            return {}
+    def _summarize_expenses(self, frame: TransactionFrame, start_date, end_date) -> Dict[str, Any]:
+        """Expenses for the period categorized by UAE expense types"""
+        expenses_mask = frame.mask('expense', start_date, end_date + timedelta(days=1))
+        
+        expenses = {}
+        for label, (_, amount) in frame.group_totals('category', expenses_mask).items():
+            category = ('other' if label == 'uncategorized' else label).lower().replace(' ', '_')
+            expenses[category] = expenses.get(category, 0) + amount
+        return expenses
     
     async def _get_business_profile(self, user_id: str) -> Dict[str, Any]:
         """Fetch business profile"""
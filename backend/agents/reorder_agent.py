@@ -4,13 +4,21 @@ Smart inventory reorder predictions with UAE seasonality
 """
 
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from datetime import datetime, date, timedelta
+from typing import Dict, Any, List, Optional, Tuple
 import httpx
+import numpy as np
 from dotenv import load_dotenv
 
+from batch_loader import batch_loader, prefetch_cache, transaction_window_filter, BatchFetchError
+from transaction_frame import row_timestamp_text
+from reorder_engine import reorder_kernel, service_level_z, URGENCY_LEVELS, URGENCY_COLORS
+from structured_log import get_logger
+
 load_dotenv()
 
+log = get_logger("reorder")
+
 class ReorderAgent:
     """
     Smart inventory reorder agent with UAE-specific seasonality:
@@ -44,16 +52,26 @@ class ReorderAgent:
         'general': 5
     }
     
-    # Safety stock multiplier by category
-    SAFETY_STOCK = {
-        'perishable': 1.2,    # Minimal - avoid spoilage
-        'grocery': 1.5,
-        'electronics': 1.3,
-        'pharmacy': 2.0,      # High - avoid stockouts
-        'textile': 1.5,
-        'auto_parts': 1.5,
-        'general': 1.5
+    # Cycle service level (chance of no stockout while an order is in transit) by category
+    SERVICE_LEVELS = {
+        'perishable': 0.90,   # Lower - avoid spoilage
+        'grocery': 0.95,
+        'electronics': 0.95,
+        'pharmacy': 0.99,     # High - avoid stockouts
+        'textile': 0.95,
+        'auto_parts': 0.95,
+        'general': 0.95
     }
+    
+    # Most days of demand a single order should cover
+    MAX_COVER_DAYS = {
+        'perishable': 7,      # 1 week
+        'pharmacy': 30,       # 1 month for critical items
+        'general': 21         # 3 weeks
+    }
+    
+    # Days of sales history behind demand predictions
+    HISTORY_DAYS = 90
 
     def __init__(self):
         self.supabase_url = os.getenv('SUPABASE_URL')
@@ -77,62 +95,73 @@ class ReorderAgent:
             season = self._get_current_season()
             seasonal_factor = self.SEASONAL_FACTORS.get(season, 1.0)
             
-            alerts = []
-            for item in items:
-                # Calculate days until stockout
-                avg_daily_sales = item.get('average_daily_sales', 0)
-                current_stock = item.get('current_stock', 0)
-                reorder_point = item.get('reorder_point', 0)
-                category = item.get('category', 'general')
-                
-                # Adjust for seasonality
-                adjusted_daily_sales = avg_daily_sales * seasonal_factor
-                
-                if adjusted_daily_sales > 0:
-                    days_until_stockout = current_stock / adjusted_daily_sales
-                else:
-                    days_until_stockout = 999
-                
-                lead_time = self.LEAD_TIMES.get(category, 5)
-                safety_multiplier = self.SAFETY_STOCK.get(category, 1.5)
-                
-                # Calculate dynamic reorder point
-                dynamic_reorder_point = (adjusted_daily_sales * lead_time * safety_multiplier)
-                
-                # Check if reorder needed
-                if current_stock <= dynamic_reorder_point or current_stock <= reorder_point:
-                    # Calculate recommended order quantity (EOQ-based)
-                    recommended_qty = self._calculate_order_quantity(
-                        item, adjusted_daily_sales, lead_time
-                    )
-                    
-                    urgency = self._calculate_urgency(days_until_stockout, lead_time)
-                    
-                    alerts.append({
-                        'item_id': item['id'],
-                        'item_name': item.get('name', ''),
-                        'item_name_arabic': item.get('name_arabic', ''),
-                        'sku': item.get('sku', ''),
-                        'category': category,
-                        'current_stock': current_stock,
-                        'reorder_point': reorder_point,
-                        'dynamic_reorder_point': round(dynamic_reorder_point, 0),
-                        'recommended_order_qty': recommended_qty,
-                        'days_until_stockout': round(days_until_stockout, 1),
-                        'lead_time_days': lead_time,
-                        'urgency': urgency['level'],
-                        'urgency_color': urgency['color'],
-                        'supplier_id': item.get('supplier_id'),
-                        'supplier_name': item.get('supplier_name', ''),
-                        'unit_cost': item.get('unit_cost', 0),
-                        'estimated_order_value': round(recommended_qty * item.get('unit_cost', 0), 2),
-                        'seasonal_adjustment': f'{seasonal_factor:.0%}',
-                        'season': season
-                    })
+            # Daily demand and its variability from sales history, seasonally adjusted;
+            # without history every item falls back to its recorded average_daily_sales
+            history = []
+            if items:
+                try:
+                    history = await self._get_sales_history_bulk(user_id, days=self.HISTORY_DAYS)
+                except (BatchFetchError, httpx.HTTPError) as e:
+                    log.warning("Sales history unavailable, using recorded demand: %s", e,
+                                extra={"user_id": user_id})
+            quantities, sale_counts = self._daily_quantities(history, {item.get('id'): i for i, item in enumerate(items)})
+            recorded = self._item_array(items, 'average_daily_sales', 0)
+            demand = self._base_demand(quantities, sale_counts, recorded) * seasonal_factor
+            # Without enough history assume Poisson demand (variance = mean)
+            demand_std = np.where(sale_counts >= 7, quantities.std(axis=1, ddof=1), np.sqrt(recorded)) * seasonal_factor
+            
+            categories = [item.get('category', 'general') for item in items]
+            z_by_category = dict(zip(self.SERVICE_LEVELS, service_level_z(list(self.SERVICE_LEVELS.values()))))
+            lead_time = np.array([float(self.LEAD_TIMES.get(c, 5)) for c in categories])
+            unit_cost = self._item_array(items, 'unit_cost', 0)
+            
+            result = reorder_kernel(
+                stock=self._item_array(items, 'current_stock', 0),
+                demand=demand,
+                demand_std=demand_std,
+                lead_time=lead_time,
+                service_z=np.array([z_by_category.get(c, z_by_category['general']) for c in categories]),
+                pack_size=self._item_array(items, 'pack_size', 1),
+                min_order_qty=self._item_array(items, 'min_order_quantity', 1),
+                unit_cost=unit_cost,
+                max_cover_days=np.array([
+                    float(self.MAX_COVER_DAYS.get(c, self.MAX_COVER_DAYS['general'])) for c in categories
+                ]),
+                static_reorder_point=self._item_array(items, 'reorder_point', 0)
+            )
             
             # Sort by urgency and days until stockout
-            urgency_order = {'CRITICAL': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
-            alerts.sort(key=lambda x: (urgency_order.get(x['urgency'], 4), x['days_until_stockout']))
+            rows = np.flatnonzero(result['needs_reorder'])
+            rows = rows[np.lexsort((result['days_until_stockout'][rows], result['urgency'][rows]))]
+            
+            alerts = []
+            for i in rows:
+                item = items[i]
+                recommended_qty = int(result['order_quantity'][i])
+                urgency = int(result['urgency'][i])
+                alerts.append({
+                    'item_id': item['id'],
+                    'item_name': item.get('name', ''),
+                    'item_name_arabic': item.get('name_arabic', ''),
+                    'sku': item.get('sku', ''),
+                    'category': categories[i],
+                    'current_stock': item.get('current_stock', 0),
+                    'reorder_point': item.get('reorder_point', 0),
+                    'dynamic_reorder_point': round(float(result['reorder_point'][i]), 0),
+                    'safety_stock': round(float(result['safety_stock'][i]), 1),
+                    'daily_demand': round(float(demand[i]), 2),
+                    'recommended_order_qty': recommended_qty,
+                    'days_until_stockout': round(float(result['days_until_stockout'][i]), 1),
+                    'lead_time_days': int(lead_time[i]),
+                    'urgency': URGENCY_LEVELS[urgency],
+                    'urgency_color': URGENCY_COLORS[urgency],
+                    'supplier_id': item.get('supplier_id'),
+                    'supplier_name': item.get('supplier_name', ''),
+                    'unit_cost': item.get('unit_cost', 0),
+                    'estimated_order_value': round(recommended_qty * float(unit_cost[i]), 2),
+                    'seasonal_adjustment': f'{seasonal_factor:.0%}',
+                    'season': season
+                })
             
             # Calculate summary
             total_order_value = sum(a['estimated_order_value'] for a in alerts)
@@ -171,42 +200,27 @@ class ReorderAgent:
                 return {'status': 'error', 'message': 'Item not found'}
             
             # Get historical sales
-            history = await self._get_sales_history(user_id, item_id, days=90)
+            history = await self._get_sales_history(user_id, item_id, days=self.HISTORY_DAYS)
+            quantities, sale_counts = self._daily_quantities(history, {item_id: 0})
+            base_demand = float(self._base_demand(
+                quantities, sale_counts, np.array([float(item.get('average_daily_sales', 1) or 0)])
+            )[0])
             
-            # Calculate base daily demand
-            if len(history) >= 7:
-                recent_avg = sum(h['quantity'] for h in history[:7]) / 7
-                historical_avg = sum(h['quantity'] for h in history) / len(history)
-                # Weight recent data more heavily
-                base_demand = recent_avg * 0.7 + historical_avg * 0.3
-            else:
-                base_demand = item.get('average_daily_sales', 1)
+            # Generate daily predictions with seasonal and day of week adjustments
+            dates, seasons, seasonal, dow = self._demand_factors(days_ahead)
+            daily_demand = base_demand * seasonal * dow
+            total_predicted = float(daily_demand.sum())
             
-            # Generate daily predictions with seasonal adjustments
-            predictions = []
-            total_predicted = 0
-            
-            for i in range(days_ahead):
-                date = datetime.now() + timedelta(days=i)
-                season = self._get_season_for_date(date)
-                factor = self.SEASONAL_FACTORS.get(season, 1.0)
-                
-                # Day of week adjustment
-                dow_factor = self._get_day_of_week_factor(date.weekday())
-                
-                daily_demand = base_demand * factor * dow_factor
-                total_predicted += daily_demand
-                
-                predictions.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'day_of_week': date.strftime('%A'),
-                    'predicted_demand': round(daily_demand, 1),
-                    'season': season,
-                    'seasonal_factor': factor
-                })
+            predictions = [{
+                'date': day.strftime('%Y-%m-%d'),
+                'day_of_week': day.strftime('%A'),
+                'predicted_demand': round(float(daily_demand[i]), 1),
+                'season': seasons[i],
+                'seasonal_factor': float(seasonal[i])
+            } for i, day in enumerate(dates)]
             
             # Calculate confidence based on data quality
-            confidence = min(95, 50 + len(history) * 0.5)
+            confidence = min(95, 50 + int(sale_counts[0]) * 0.5)
             
             return {
                 'status': 'success',
@@ -226,6 +240,64 @@ class ReorderAgent:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    async def predict_demand_bulk(self, user_id: str, days_ahead: int = 30) -> Dict[str, Any]:
+        """
+        Predict demand for every active inventory item at once.
+        All item sales come from one paged query and are pivoted into an
+        items x days matrix; seasonal and day of week factors are applied as
+        vectors across every item.
+        
+        Args:
+            user_id: Shop owner's UUID
+            days_ahead: Number of days to predict
+        
+        Returns:
+            Per-item demand predictions (daily values follow `dates`)
+        """
+        try:
+            items = await self._get_inventory_items(user_id)
+            if not items:
+                return {'status': 'success', 'message': 'No inventory items found', 'items': []}
+            
+            history = await self._get_sales_history_bulk(user_id, days=self.HISTORY_DAYS)
+            item_index = {item.get('id'): i for i, item in enumerate(items)}
+            quantities, sale_counts = self._daily_quantities(history, item_index)
+            fallback = np.array([float(item.get('average_daily_sales', 1) or 0) for item in items])
+            base_demand = self._base_demand(quantities, sale_counts, fallback)
+            
+            dates, seasons, seasonal, dow = self._demand_factors(days_ahead)
+            daily_demand = base_demand[:, None] * (seasonal * dow)[None, :]
+            totals = daily_demand.sum(axis=1)
+            confidence = np.minimum(95, 50 + sale_counts * 0.5)
+            
+            forecasts = []
+            for i, item in enumerate(items):
+                total = float(totals[i])
+                forecasts.append({
+                    'item_id': item.get('id'),
+                    'item_name': item.get('name', ''),
+                    'current_stock': item.get('current_stock', 0),
+                    'total_predicted_demand': round(total, 0),
+                    'average_daily_demand': round(total / days_ahead, 1),
+                    'confidence_percent': round(float(confidence[i]), 0),
+                    'predicted_demand': np.round(daily_demand[i], 1).tolist(),
+                    'recommendation': self._generate_demand_recommendation(item, total, days_ahead)
+                })
+            
+            return {
+                'status': 'success',
+                'prediction_days': days_ahead,
+                'item_count': len(forecasts),
+                'dates': [day.strftime('%Y-%m-%d') for day in dates],
+                'seasons': seasons,
+                'seasonal_factors': seasonal.tolist(),
+                'day_of_week_factors': dow.tolist(),
+                'items': forecasts
+            }
+            
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
     async def get_supplier_order_summary(self, user_id: str) -> Dict[str, Any]:
         """
         Group reorder alerts by supplier for efficient ordering
@@ -329,43 +401,56 @@ class ReorderAgent:
         }
         return factors.get(weekday, 1.0)
 
-    def _calculate_urgency(self, days_until_stockout: float, lead_time: int) -> Dict:
-        """Calculate reorder urgency"""
-        if days_until_stockout <= lead_time:
-            return {'level': 'CRITICAL', 'color': 'red'}
-        elif days_until_stockout <= lead_time * 1.5:
-            return {'level': 'HIGH', 'color': 'orange'}
-        elif days_until_stockout <= lead_time * 2:
-            return {'level': 'MEDIUM', 'color': 'yellow'}
-        else:
-            return {'level': 'LOW', 'color': 'blue'}
+    def _demand_factors(self, days_ahead: int) -> Tuple[List[datetime], List[str], np.ndarray, np.ndarray]:
+        """Dates, seasons, seasonal factors and day of week factors for the coming days"""
+        dates = [datetime.now() + timedelta(days=i) for i in range(days_ahead)]
+        seasons = [self._get_season_for_date(day) for day in dates]
+        seasonal = np.array([self.SEASONAL_FACTORS.get(season, 1.0) for season in seasons])
+        dow = np.array([self._get_day_of_week_factor(day.weekday()) for day in dates])
+        return dates, seasons, seasonal, dow
 
-    def _calculate_order_quantity(self, item: Dict, daily_demand: float, lead_time: int) -> int:
+    def _daily_quantities(self, rows: List[Dict], item_index: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Calculate optimal order quantity
-        Uses simplified EOQ with practical constraints
+        Pivot sale rows into an items x days quantity matrix over the last
+        HISTORY_DAYS whole days (oldest first), plus each item's sale count.
+        Rows without a parseable date are skipped.
         """
-        # Target 2-4 weeks of stock depending on category
-        category = item.get('category', 'general')
+        start = date.today() - timedelta(days=self.HISTORY_DAYS)
+        items, days, quantities = [], [], []
+        for row in rows:
+            index = item_index.get(row.get('item_id'))
+            text = row_timestamp_text(row)
+            if index is None or not text:
+                continue
+            try:
+                day = date.fromisoformat(text[:10])
+            except ValueError:
+                continue
+            items.append(index)
+            days.append(day)
+            quantities.append(float(row.get('quantity') or 0))
         
-        if category == 'perishable':
-            days_of_stock = 7  # 1 week
-        elif category == 'pharmacy':
-            days_of_stock = 30  # 1 month for critical items
-        else:
-            days_of_stock = 21  # 3 weeks
-        
-        # Calculate quantity
-        base_qty = daily_demand * days_of_stock
-        
-        # Round up to case/pack quantity if applicable
-        min_order_qty = item.get('min_order_quantity', 1)
-        pack_size = item.get('pack_size', 1)
-        
-        if pack_size > 1:
-            base_qty = ((base_qty // pack_size) + 1) * pack_size
-        
-        return max(min_order_qty, int(base_qty))
+        items = np.array(items, dtype=np.int64)
+        offsets = (np.array(days, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+        keep = (offsets >= 0) & (offsets < self.HISTORY_DAYS)
+        cells = items[keep] * self.HISTORY_DAYS + offsets[keep]
+        matrix = np.bincount(cells, weights=np.array(quantities)[keep],
+                             minlength=len(item_index) * self.HISTORY_DAYS)
+        counts = np.bincount(items[keep], minlength=len(item_index))
+        return matrix.reshape(len(item_index), self.HISTORY_DAYS), counts
+
+    def _base_demand(self, quantities: np.ndarray, sale_counts: np.ndarray, fallback: np.ndarray) -> np.ndarray:
+        """
+        Base daily demand per item: the last week weighted 0.7 against the
+        full window average. Items with fewer than 7 sales use the fallback.
+        """
+        recent_avg = quantities[:, -7:].mean(axis=1)
+        historical_avg = quantities.mean(axis=1)
+        return np.where(sale_counts >= 7, recent_avg * 0.7 + historical_avg * 0.3, fallback)
+
+    def _item_array(self, items: List[Dict], key: str, default: float) -> np.ndarray:
+        """One numeric inventory field across items (missing -> default, null -> 0)"""
+        return np.array([float(item.get(key, default) or 0) for item in items])
 
     def _generate_demand_recommendation(self, item: Dict, total_demand: float, days: int) -> Dict:
         """Generate recommendation based on demand prediction"""
@@ -397,28 +482,20 @@ class ReorderAgent:
             }
 
     async def _get_inventory_items(self, user_id: str) -> List[Dict]:
-        """Fetch inventory items"""
+        """Fetch all active inventory items (one paged query)"""
+        prefetched = prefetch_cache.get(user_id, 'inventory_items')
+        if prefetched is not None:
+            return prefetched
+        
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/inventory_items",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'is_active': 'eq.true',
-                    'select': '*,suppliers(name)'
-                }
+            items = await batch_loader.fetch_keyset(
+                client, 'inventory_items', [user_id], '*,suppliers(name)', {'is_active': 'eq.true'}
             )
-            if response.status_code == 200:
-                items = response.json()
-                # Flatten supplier name
-                for item in items:
-                    if item.get('suppliers'):
-                        item['supplier_name'] = item['suppliers'].get('name', '')
-                return items
-        return []
+        # Flatten supplier name
+        for item in items:
+            if item.get('suppliers'):
+                item['supplier_name'] = item['suppliers'].get('name', '')
+        return items
 
     async def _get_item(self, item_id: str) -> Optional[Dict]:
         """Fetch single item"""
@@ -451,15 +528,34 @@ class ReorderAgent:
                     'user_id': f'eq.{user_id}',
                     'item_id': f'eq.{item_id}',
                     'transaction_type': 'eq.sale',
-                    'date': f'gte.{start_date.isoformat()}',
-                    'select': 'date,quantity,amount_aed',
-                    'order': 'date.desc'
+                    **transaction_window_filter(start_date),
+                    'select': 'item_id,transaction_date,transaction_time,quantity,amount_aed',
+                    'order': 'transaction_date.desc'
                 }
             )
             if response.status_code == 200:
                 return response.json()
         return []
 
+    async def _get_sales_history_bulk(self, user_id: str, days: int = 90) -> List[Dict]:
+        """Fetch item sales of all items in one paged query"""
+        start_date = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+        
+        # The scheduled cycle may already have loaded the user's transactions
+        prefetched = prefetch_cache.get(user_id, 'transactions', days=days)
+        if prefetched is not None:
+            return [t for t in prefetched if t.get('transaction_type') == 'sale' and t.get('item_id')]
+        
+        async with httpx.AsyncClient() as client:
+            return await batch_loader.fetch_keyset(
+                client, 'transactions', [user_id], 'id,item_id,transaction_date,transaction_time,quantity',
+                {
+                    'transaction_type': 'eq.sale',
+                    'item_id': 'not.is.null',
+                    **transaction_window_filter(start_date)
+                }
+            )
+
 
 # Singleton instance
 reorder_agent = ReorderAgent()
@@ -0,0 +1,85 @@
+"""
+StoreBuddy UAE - Reorder Engine
+Array kernel for reorder points and order quantities across all SKUs
+"""
+
+from statistics import NormalDist
+from typing import Dict, Sequence
+
+import numpy as np
+
+# Days until stockout reported for items without demand
+NO_DEMAND_DAYS = 999.0
+
+# Fixed cost of placing one order (AED) and annual holding cost as a share of unit cost
+DEFAULT_ORDER_COST_AED = 50.0
+ANNUAL_HOLDING_RATE = 0.25
+
+# Urgency by days until stockout, in multiples of the lead time
+URGENCY_LEVELS = ('CRITICAL', 'HIGH', 'MEDIUM', 'LOW')
+URGENCY_COLORS = ('red', 'orange', 'yellow', 'blue')
+URGENCY_LEAD_TIME_MULTIPLES = (1.0, 1.5, 2.0)
+
+
+def service_level_z(levels: Sequence[float]) -> np.ndarray:
+    """Standard normal quantile for each cycle service level (e.g. 0.95 -> 1.645)"""
+    normal = NormalDist()
+    return np.array([normal.inv_cdf(level) for level in levels])
+
+
+def reorder_kernel(stock: np.ndarray, demand: np.ndarray, demand_std: np.ndarray,
+                   lead_time: np.ndarray, service_z: np.ndarray, pack_size: np.ndarray,
+                   min_order_qty: np.ndarray, unit_cost: np.ndarray, max_cover_days: np.ndarray,
+                   static_reorder_point: np.ndarray,
+                   order_cost: float = DEFAULT_ORDER_COST_AED,
+                   holding_rate: float = ANNUAL_HOLDING_RATE) -> Dict[str, np.ndarray]:
+    """
+    Reorder decisions for every SKU in one pass. All inputs are per-SKU
+    float arrays of the same length; demand and its standard deviation are
+    daily.
+
+    - safety stock: z * sigma_daily * sqrt(lead time) for the SKU's service level
+    - reorder point: demand over the lead time plus safety stock
+    - order quantity: EOQ, capped at max_cover_days of demand and at least
+      enough to get back above the reorder point, raised to the supplier
+      minimum and then rounded up to whole packs; SKUs without cost data
+      order max_cover_days
+    - urgency index into URGENCY_LEVELS from days until stockout
+
+    Returns a dict of arrays; `needs_reorder` marks stock at or below either
+    the computed or the item's own reorder point.
+    """
+    safety_stock = service_z * demand_std * np.sqrt(lead_time)
+    reorder_point = demand * lead_time + safety_stock
+    needs_reorder = (stock <= reorder_point) | (stock <= static_reorder_point)
+
+    has_demand = demand > 0
+    days_until_stockout = np.full(stock.shape, NO_DEMAND_DAYS)
+    np.divide(stock, demand, out=days_until_stockout, where=has_demand)
+
+    # EOQ = sqrt(2 * annual demand * order cost / annual holding cost per unit)
+    holding = unit_cost * holding_rate
+    priced = has_demand & (holding > 0)
+    eoq = np.zeros(stock.shape)
+    np.divide(2 * demand * 365 * order_cost, holding, out=eoq, where=priced)
+    eoq = np.sqrt(eoq)
+    cover = demand * max_cover_days
+    quantity = np.where(priced, np.minimum(eoq, cover), cover)
+    quantity = np.maximum(quantity, reorder_point - stock)
+
+    # Supplier minimum first, so the final quantity is still whole packs
+    quantity = np.maximum(np.maximum(quantity, 0), min_order_qty)
+    packs = np.maximum(pack_size, 1)
+    quantity = np.ceil(quantity / packs) * packs
+
+    thresholds = lead_time[:, None] * np.asarray(URGENCY_LEAD_TIME_MULTIPLES)
+    urgency = (days_until_stockout[:, None] > thresholds).sum(axis=1)
+
+    return {
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'needs_reorder': needs_reorder,
+        'days_until_stockout': days_until_stockout,
+        'order_quantity': quantity.astype(np.int64),
+        'urgency': urgency,
+    }
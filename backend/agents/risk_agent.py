@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class RiskAssessmentAgent:
@@ -185,6 +186,9 @@ Please execute this assessment and report the risk level."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Risk Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -0,0 +1,183 @@
+"""
+StoreBuddy UAE - Sales Forecasting
+Daily sales forecasts for many shops at once with NumPy
+"""
+
+import os
+import time
+from datetime import date
+from statistics import NormalDist
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+SEASON = 7  # weekly seasonality of daily sales
+BACKTEST_DAYS = 14
+# Per-call budget for model fitting; models are tried cheapest first
+FORECAST_BUDGET_MS = float(os.getenv('FORECAST_BUDGET_MS', 250))
+
+EWMA_ALPHAS = (0.1, 0.2, 0.3, 0.5)
+# (alpha, beta, gamma) candidates for Holt-Winters; gamma <= 1 - alpha keeps them admissible
+HOLT_WINTERS_GRID = tuple(
+    (alpha, beta, gamma)
+    for alpha in (0.1, 0.3, 0.5)
+    for beta in (0.01, 0.1)
+    for gamma in (0.05, 0.2, 0.4)
+)
+
+# Cheapest first, so a tight budget still leaves a baseline
+MODELS = ('seasonal_naive', 'ewma', 'holt_winters')
+
+
+def daily_series(daily_totals: Dict[str, float], start: date, end: date) -> np.ndarray:
+    """Dense daily totals for [start, end] ('YYYY-MM-DD' keys); days without sales are 0"""
+    days = (end - start).days + 1
+    series = np.zeros(max(days, 0))
+    for day, total in daily_totals.items():
+        offset = (date.fromisoformat(day) - start).days
+        if 0 <= offset < days:
+            series[offset] = total
+    return series
+
+
+def _min_length(model: str) -> int:
+    return {'seasonal_naive': SEASON + 1, 'ewma': 2, 'holt_winters': 3 * SEASON}[model]
+
+
+# Days with sales a shop needs before it is forecast: enough for every model
+MIN_SALES_DAYS = _min_length('holt_winters')
+
+
+# ----------------------------------------------------------------------------
+# Models. Each takes history (shops, T) and a horizon and returns
+# (forecast (shops, horizon), one-step residuals (shops, n), variance factors
+# (shops, horizon)), where the k-step forecast variance is sigma^2 * factor[k].
+# Parameter grids are fitted for all shops together and the in-sample best
+# parameters are picked per shop.
+# ----------------------------------------------------------------------------
+
+def _seasonal_naive(y: np.ndarray, horizon: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    steps = np.arange(horizon)
+    forecast = y[:, y.shape[1] - SEASON + steps % SEASON]
+    residuals = y[:, SEASON:] - y[:, :-SEASON]
+    factors = np.broadcast_to(1.0 + steps // SEASON, forecast.shape)
+    return forecast, residuals, factors
+
+
+def _ewma(y: np.ndarray, horizon: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    alphas = np.asarray(EWMA_ALPHAS)[:, None]
+    shops, length = y.shape
+    level = np.repeat(y[None, :, 0], len(EWMA_ALPHAS), axis=0)
+    errors = np.empty((len(EWMA_ALPHAS), shops, length - 1))
+    for t in range(1, length):
+        errors[:, :, t - 1] = y[:, t] - level
+        level = level + alphas * errors[:, :, t - 1]
+
+    best = np.argmin(np.square(errors).sum(axis=2), axis=0)
+    shop = np.arange(shops)
+    forecast = np.repeat(level[best, shop][:, None], horizon, axis=1)
+    alpha = np.asarray(EWMA_ALPHAS)[best][:, None]
+    factors = 1.0 + np.arange(horizon) * alpha ** 2
+    return forecast, errors[best, shop], factors
+
+
+def _holt_winters(y: np.ndarray, horizon: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Additive trend and weekly seasonality, error-correction form"""
+    grid = np.asarray(HOLT_WINTERS_GRID)
+    alpha, beta, gamma = (grid[:, i][:, None] for i in range(3))
+    shops, length = y.shape
+
+    # Initial state from the first two weeks
+    first = y[:, :SEASON].mean(axis=1)
+    level = np.repeat(first[None], len(grid), axis=0)
+    trend = np.repeat(((y[:, SEASON:2 * SEASON].mean(axis=1) - first) / SEASON)[None], len(grid), axis=0)
+    seasonal = np.repeat((y[:, :SEASON] - first[:, None])[None], len(grid), axis=0)
+
+    errors = np.empty((len(grid), shops, length - SEASON))
+    for t in range(SEASON, length):
+        slot = t % SEASON
+        error = y[:, t] - (level + trend + seasonal[:, :, slot])
+        errors[:, :, t - SEASON] = error
+        level = level + trend + alpha * error
+        trend = trend + alpha * beta * error
+        seasonal[:, :, slot] += gamma * error
+
+    best = np.argmin(np.square(errors).sum(axis=2), axis=0)
+    shop = np.arange(shops)
+    steps = np.arange(1, horizon + 1)
+    slots = (length + steps - 1) % SEASON
+    forecast = (level[best, shop][:, None] + steps * trend[best, shop][:, None]
+                + seasonal[best, shop][:, slots])
+
+    # Var of the k-step error: sigma^2 * (1 + sum_{j<k} (alpha (1 + j beta) + gamma [j % m == 0])^2)
+    a, b, g = alpha[best], beta[best], gamma[best]
+    j = np.arange(1, horizon)
+    psi = a * (1 + j * b) + g * (j % SEASON == 0)
+    factors = 1.0 + np.concatenate([np.zeros((shops, 1)), np.cumsum(psi ** 2, axis=1)], axis=1)
+    return forecast, errors[best, shop], factors
+
+
+_FITTERS = {
+    'seasonal_naive': _seasonal_naive,
+    'ewma': _ewma,
+    'holt_winters': _holt_winters,
+}
+
+
+def forecast_many(history: np.ndarray, horizon: int, interval: float = 0.9,
+                  budget_ms: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Forecast the next `horizon` days for every row of `history` (shops x days,
+    oldest first, equal lengths).
+
+    Each model is backtested on the last BACKTEST_DAYS days and the one with
+    the lowest MAE is chosen per shop, then refitted on the full history.
+    Models are tried cheapest first and no new model is started once
+    `budget_ms` has elapsed; seasonal naive is always evaluated.
+
+    Returns:
+        model: chosen model name per shop
+        forecast, lower, upper: (shops, horizon), clipped at zero
+        backtest_mae: {model: (shops,)} for the evaluated models
+    """
+    y = np.atleast_2d(np.asarray(history, dtype=np.float64))
+    shops, length = y.shape
+    budget = FORECAST_BUDGET_MS if budget_ms is None else budget_ms
+    deadline = time.perf_counter() + budget / 1000
+
+    backtest = min(BACKTEST_DAYS, max(horizon, 1))
+    train, held_out = y[:, :length - backtest], y[:, length - backtest:]
+    candidates = [m for m in MODELS if train.shape[1] >= _min_length(m)]
+    if not candidates:
+        raise ValueError(f"need at least {_min_length(MODELS[0]) + backtest} days of history")
+
+    backtest_mae = {}
+    for model in candidates:
+        if backtest_mae and time.perf_counter() > deadline:
+            break
+        predicted, _, _ = _FITTERS[model](train, backtest)
+        backtest_mae[model] = np.abs(predicted - held_out).mean(axis=1)
+
+    evaluated = list(backtest_mae)
+    choice = np.argmin(np.stack([backtest_mae[m] for m in evaluated]), axis=0)
+
+    forecast = np.empty((shops, horizon))
+    spread = np.empty((shops, horizon))
+    z = NormalDist().inv_cdf(0.5 + interval / 2)
+    for index, model in enumerate(evaluated):
+        rows = np.flatnonzero(choice == index)
+        if not len(rows):
+            continue
+        predicted, residuals, factors = _FITTERS[model](y[rows], horizon)
+        sigma = np.sqrt(np.mean(np.square(residuals), axis=1))[:, None]
+        forecast[rows] = predicted
+        spread[rows] = z * sigma * np.sqrt(factors)
+
+    return {
+        'model': [evaluated[i] for i in choice],
+        'forecast': np.clip(forecast, 0, None),
+        'lower': np.clip(forecast - spread, 0, None),
+        'upper': np.clip(forecast + spread, 0, None),
+        'backtest_mae': backtest_mae,
+        'models_evaluated': evaluated,
+    }
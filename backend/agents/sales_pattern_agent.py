@@ -4,12 +4,18 @@ Analyzes sales patterns with UAE-specific factors
 """
 
 import os
+import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from collections import defaultdict
 import httpx
+import numpy as np
 from dotenv import load_dotenv
 
+from transaction_frame import load_frame, weekly_heatmaps, extreme_slots
+from sales_rollups import rollup_aggregate, day_start
+from sales_forecasting import forecast_many, daily_series, MIN_SALES_DAYS
+
 load_dotenv()
 
 class SalesPatternAgent:
@@ -48,6 +54,18 @@ class SalesPatternAgent:
         'private': [28, 1, 2, 3],  # Private sector end of month
         'construction': [1, 5, 10, 15]  # Construction often mid-month
     }
+    
+    # Relative sales level by season/event (see _get_season)
+    SEASONAL_FACTORS = {
+        'ramadan': 1.3,
+        'eid': 1.5,
+        'summer': 0.7,
+        'dsf': 1.2,
+        'normal': 1.0
+    }
+    
+    # Groupings computed together in one aggregation pass by analyze_patterns
+    PATTERN_GROUPINGS = ('hour', 'weekday', 'week', 'day_of_month', 'category', 'payment_method')
 
     def __init__(self):
         self.supabase_url = os.getenv('SUPABASE_URL')
@@ -65,10 +83,17 @@ class SalesPatternAgent:
             Pattern analysis with actionable insights
         """
         try:
-            # Fetch sales data
-            transactions = await self._get_sales_transactions(user_id, days)
-            
-            if not transactions:
+            # Fetch sales data (whole days, as the rollups store them)
+            start_date = day_start(datetime.now() - timedelta(days=days))
+            # Maintained rollups when they cover the window, else one pass over the frame
+            groups = rollup_aggregate(user_id, self.PATTERN_GROUPINGS, start_date)
+            if groups is None:
+                frame = await load_frame(user_id, start_date)
+                groups = frame.aggregate(self.PATTERN_GROUPINGS, frame.mask('sale', start_date))
+            total_transactions = sum(count for count, _ in groups['weekday'].values())
+            total_revenue = sum(total for _, total in groups['weekday'].values())
+            
+            if not total_transactions:
                 return {
                     'status': 'success',
                     'message': 'No sales data available for analysis',
@@ -76,12 +101,12 @@ class SalesPatternAgent:
                 }
             
             # Analyze various patterns
-            hourly = self._analyze_hourly_pattern(transactions)
-            daily = self._analyze_daily_pattern(transactions)
-            weekly = self._analyze_weekly_pattern(transactions)
-            monthly = self._analyze_monthly_pattern(transactions)
-            category = self._analyze_category_pattern(transactions)
-            payment = self._analyze_payment_pattern(transactions)
+            hourly = self._analyze_hourly_pattern(groups['hour'])
+            daily = self._analyze_daily_pattern(groups['weekday'])
+            weekly = self._analyze_weekly_pattern(groups['week'])
+            monthly = self._analyze_monthly_pattern(groups['day_of_month'])
+            category = self._analyze_category_pattern(groups['category'])
+            payment = self._analyze_payment_pattern(groups['payment_method'])
             
             # Generate insights
             insights = self._generate_insights(hourly, daily, weekly, monthly)
@@ -93,8 +118,8 @@ class SalesPatternAgent:
                     'start_date': (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d'),
                     'end_date': datetime.now().strftime('%Y-%m-%d')
                 },
-                'total_transactions': len(transactions),
-                'total_revenue': sum(t.get('amount_aed', 0) for t in transactions),
+                'total_transactions': total_transactions,
+                'total_revenue': total_revenue,
                 'patterns': {
                     'hourly': hourly,
                     'daily': daily,
@@ -110,62 +135,84 @@ class SalesPatternAgent:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
-    async def get_peak_times(self, user_id: str) -> Dict[str, Any]:
+    async def get_peak_times(self, user_id: str, days: int = 30) -> Dict[str, Any]:
         """
         Identify peak selling times for staffing and inventory
         """
+        results = await self.get_peak_times_bulk([user_id], days)
+        return results[user_id]
+
+    async def get_peak_times_bulk(self, user_ids: List[str], days: int = 30) -> Dict[str, Dict[str, Any]]:
+        """
+        Peak and slow times for several shops, computed in one heatmap pass
+        
+        Returns:
+            {user_id: peak time result (with a 7x24 heatmap)}
+        """
         try:
-            transactions = await self._get_sales_transactions(user_id, 30)
-            
-            if not transactions:
-                return {'status': 'success', 'message': 'Insufficient data', 'peak_times': []}
-            
-            # Aggregate by hour and day
-            hour_day_sales = defaultdict(lambda: {'count': 0, 'revenue': 0})
-            
-            for txn in transactions:
-                date_str = txn.get('date', '')
-                if not date_str:
-                    continue
-                    
-                try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    key = (dt.weekday(), dt.hour)
-                    hour_day_sales[key]['count'] += 1
-                    hour_day_sales[key]['revenue'] += txn.get('amount_aed', 0)
-                except:
+            start_date = day_start(datetime.now() - timedelta(days=days))
+            counts = np.zeros((len(user_ids), 7, 24), dtype=np.int64)
+            revenue = np.zeros((len(user_ids), 7, 24))
+            
+            # Shops with covering rollups read their 168 buckets directly
+            uncovered = []
+            for i, user_id in enumerate(user_ids):
+                groups = rollup_aggregate(user_id, ('weekday_hour',), start_date)
+                if groups is None:
+                    uncovered.append(i)
                     continue
-            
-            # Find top 10 peak slots
-            slots = []
-            for (day, hour), data in hour_day_sales.items():
-                slots.append({
-                    'day': day,
-                    'day_name': self.DAY_NAMES[day]['en'],
-                    'day_name_arabic': self.DAY_NAMES[day]['ar'],
-                    'hour': hour,
-                    'time_range': f"{hour:02d}:00 - {hour+1:02d}:00",
-                    'transaction_count': data['count'],
-                    'revenue': data['revenue'],
-                    'avg_transaction': data['revenue'] / data['count'] if data['count'] > 0 else 0
-                })
-            
-            # Sort by revenue
-            slots.sort(key=lambda x: -x['revenue'])
-            peak_slots = slots[:10]
-            
-            # Identify slow times
-            slow_slots = sorted(slots, key=lambda x: x['revenue'])[:5]
-            
+                for slot, (count, total) in groups['weekday_hour'].items():
+                    counts[i].flat[slot] = count
+                    revenue[i].flat[slot] = total
+            
+            if uncovered:
+                frames = await asyncio.gather(*(load_frame(user_ids[i], start_date) for i in uncovered))
+                masks = [frame.mask('sale', start_date) for frame in frames]
+                counts[uncovered], revenue[uncovered] = weekly_heatmaps(frames, masks)
+        except Exception as e:
+            return {user_id: {'status': 'error', 'message': str(e)} for user_id in user_ids}
+        
+        return {
+            user_id: self._peak_times_from_heatmap(counts[i], revenue[i], days)
+            for i, user_id in enumerate(user_ids)
+        }
+
+    def _peak_times_from_heatmap(self, counts, revenue, days: int) -> Dict[str, Any]:
+        """Top 10 / bottom 5 slots and a compact heatmap for one shop"""
+        if not counts.any():
+            return {'status': 'success', 'message': 'Insufficient data', 'peak_times': []}
+        
+        def slot(index: int) -> Dict[str, Any]:
+            day, hour = divmod(index, 24)
+            count = int(counts[day, hour])
+            slot_revenue = float(revenue[day, hour])
             return {
-                'status': 'success',
-                'peak_times': peak_slots,
-                'slow_times': slow_slots,
-                'recommendations': self._generate_staffing_recommendations(peak_slots, slow_slots)
+                'day': day,
+                'day_name': self.DAY_NAMES[day]['en'],
+                'day_name_arabic': self.DAY_NAMES[day]['ar'],
+                'hour': hour,
+                'time_range': f"{hour:02d}:00 - {hour+1:02d}:00",
+                'transaction_count': count,
+                'revenue': slot_revenue,
+                'avg_transaction': slot_revenue / count if count > 0 else 0
             }
-            
-        except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+        
+        peak_slots = [slot(i) for i in extreme_slots(revenue, counts, 10, largest=True)]
+        slow_slots = [slot(i) for i in extreme_slots(revenue, counts, 5, largest=False)]
+        
+        return {
+            'status': 'success',
+            'days': days,
+            'peak_times': peak_slots,
+            'slow_times': slow_slots,
+            # Rows are weekdays (Monday first), columns are hours 0-23
+            'heatmap': {
+                'days': [self.DAY_NAMES[d]['en'] for d in range(7)],
+                'revenue': np.round(revenue, 2).tolist(),
+                'count': counts.tolist()
+            },
+            'recommendations': self._generate_staffing_recommendations(peak_slots, slow_slots)
+        }
 
     async def get_customer_segments(self, user_id: str) -> Dict[str, Any]:
         """
@@ -254,130 +301,122 @@ class SalesPatternAgent:
 
     async def forecast_sales(self, user_id: str, days_ahead: int = 7) -> Dict[str, Any]:
         """
-        Simple sales forecast based on historical patterns
+        Daily sales forecast with prediction intervals
+        """
+        results = await self.forecast_sales_bulk([user_id], days_ahead)
+        return results[user_id]
+
+    async def forecast_sales_bulk(self, user_ids: List[str], days_ahead: int = 7) -> Dict[str, Dict[str, Any]]:
+        """
+        Sales forecasts for several shops, fitted together.
+        Seasonal naive, EWMA and Holt-Winters (weekly seasonality) are
+        backtested per shop and the best one forecasts; see sales_forecasting.
+        
+        Returns:
+            {user_id: forecast result}
         """
+        if days_ahead < 1:
+            return {user_id: {'status': 'error', 'message': 'days_ahead must be at least 1'}
+                    for user_id in user_ids}
+        
+        now = datetime.now()
+        # Whole days only: the window's first day and today are partial
+        first_day = (now - timedelta(days=89)).date()
+        last_day = now.date() - timedelta(days=1)
+        
         try:
-            # Get historical data
-            transactions = await self._get_sales_transactions(user_id, 90)
-            
-            if len(transactions) < 30:
-                return {'status': 'success', 'message': 'Insufficient data for forecast'}
-            
-            # Calculate daily averages by day of week
-            daily_totals = defaultdict(list)
-            
-            for txn in transactions:
-                date_str = txn.get('date', '')
-                if date_str:
-                    try:
-                        dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                        day_key = dt.strftime('%Y-%m-%d')
-                        daily_totals[day_key].append(txn.get('amount_aed', 0))
-                    except:
-                        continue
-            
-            # Calculate day-of-week averages
-            dow_averages = defaultdict(list)
-            for day_str, amounts in daily_totals.items():
-                dt = datetime.fromisoformat(day_str)
-                dow_averages[dt.weekday()].append(sum(amounts))
-            
-            dow_avg = {
-                dow: sum(amounts) / len(amounts) if amounts else 0
-                for dow, amounts in dow_averages.items()
-            }
-            
-            # Overall daily average
-            all_daily = [sum(amounts) for amounts in daily_totals.values()]
-            overall_avg = sum(all_daily) / len(all_daily) if all_daily else 0
-            
-            # Generate forecast
-            forecasts = []
-            total_forecast = 0
-            
-            for i in range(days_ahead):
-                date = datetime.now() + timedelta(days=i+1)
-                dow = date.weekday()
-                
-                # Use day-of-week average if available, otherwise overall
-                predicted = dow_avg.get(dow, overall_avg)
-                
-                # Apply seasonal adjustment
-                season = self._get_season(date)
-                seasonal_factor = {
-                    'ramadan': 1.3,
-                    'eid': 1.5,
-                    'summer': 0.7,
-                    'dsf': 1.2,
-                    'normal': 1.0
-                }.get(season, 1.0)
-                
-                adjusted_prediction = predicted * seasonal_factor
-                total_forecast += adjusted_prediction
-                
-                forecasts.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'day': self.DAY_NAMES[dow]['en'],
-                    'day_arabic': self.DAY_NAMES[dow]['ar'],
-                    'predicted_sales': round(adjusted_prediction, 2),
-                    'season': season,
-                    'seasonal_factor': seasonal_factor
-                })
-            
-            # Calculate confidence based on data consistency
-            variance = sum((x - overall_avg) ** 2 for x in all_daily) / len(all_daily) if all_daily else 0
-            cv = (variance ** 0.5) / overall_avg if overall_avg > 0 else 1
-            confidence = max(0, min(95, 80 - cv * 30))
-            
-            return {
-                'status': 'success',
-                'forecast_period': f'{days_ahead} days',
-                'total_predicted': round(total_forecast, 2),
-                'daily_average_predicted': round(total_forecast / days_ahead, 2),
-                'confidence_percent': round(confidence, 0),
-                'forecasts': forecasts,
-                'currency': 'AED'
-            }
-            
+            daily = await asyncio.gather(*(self._get_daily_sales(user_id, day_start(now - timedelta(days=90)))
+                                           for user_id in user_ids))
+            # A few busy days are not a history; count the days with sales revenue
+            eligible = [i for i, totals in enumerate(daily)
+                        if sum(1 for _, total in totals.values() if total > 0) >= MIN_SALES_DAYS]
+            results = {user_id: {'status': 'success', 'message': 'Insufficient data for forecast'}
+                       for user_id in user_ids}
+            if not eligible:
+                return results
+            
+            history = np.stack([
+                daily_series({day: total for day, (_, total) in daily[i].items()}, first_day, last_day)
+                for i in eligible
+            ])
+            # Step 1 is today, so forecast one extra day
+            fitted = await asyncio.to_thread(forecast_many, history, days_ahead + 1)
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return {user_id: {'status': 'error', 'message': str(e)} for user_id in user_ids}
+        
+        for row, i in enumerate(eligible):
+            results[user_ids[i]] = self._forecast_result(fitted, row, history[row], days_ahead, now)
+        return results
+
+    async def _get_daily_sales(self, user_id: str, start_date: datetime) -> Dict[str, Tuple[int, float]]:
+        groups = rollup_aggregate(user_id, ('date',), start_date)
+        if groups is None:
+            frame = await load_frame(user_id, start_date)
+            groups = frame.aggregate(('date',), frame.mask('sale', start_date))
+        return groups['date']
+
+    def _forecast_result(self, fitted: Dict[str, Any], row: int, history, days_ahead: int,
+                         now: datetime) -> Dict[str, Any]:
+        """One shop's forecast with UAE seasonal adjustment"""
+        # History already reflects the current season, so scale by the change from it
+        current_factor = self.SEASONAL_FACTORS.get(self._get_season(now), 1.0)
+        
+        forecasts = []
+        for k in range(1, days_ahead + 1):
+            date = now + timedelta(days=k)
+            dow = date.weekday()
+            season = self._get_season(date)
+            seasonal_factor = self.SEASONAL_FACTORS.get(season, 1.0) / current_factor
+            
+            forecasts.append({
+                'date': date.strftime('%Y-%m-%d'),
+                'day': self.DAY_NAMES[dow]['en'],
+                'day_arabic': self.DAY_NAMES[dow]['ar'],
+                'predicted_sales': round(float(fitted['forecast'][row, k]) * seasonal_factor, 2),
+                'lower_bound': round(float(fitted['lower'][row, k]) * seasonal_factor, 2),
+                'upper_bound': round(float(fitted['upper'][row, k]) * seasonal_factor, 2),
+                'season': season,
+                'seasonal_factor': round(seasonal_factor, 2)
+            })
+        total_forecast = sum(f['predicted_sales'] for f in forecasts)
+        
+        # Confidence from the chosen model's backtest error relative to typical daily sales
+        model = fitted['model'][row]
+        mae = float(fitted['backtest_mae'][model][row])
+        daily_mean = float(history.mean())
+        confidence = max(0, min(95, 100 * (1 - mae / daily_mean))) if daily_mean > 0 else 0
+        
+        return {
+            'status': 'success',
+            'forecast_period': f'{days_ahead} days',
+            'total_predicted': round(total_forecast, 2),
+            'daily_average_predicted': round(total_forecast / days_ahead, 2),
+            'confidence_percent': round(confidence, 0),
+            'model': model,
+            'backtest_mae': round(mae, 2),
+            'prediction_interval_percent': 90,
+            'forecasts': forecasts,
+            'currency': 'AED'
+        }
 
-    def _analyze_hourly_pattern(self, transactions: List[Dict]) -> Dict:
+    def _analyze_hourly_pattern(self, totals: Dict[int, Tuple[int, float]]) -> Dict:
         """Analyze sales by hour"""
-        hourly = defaultdict(lambda: {'count': 0, 'revenue': 0})
-        
-        for txn in transactions:
-            date_str = txn.get('date', '')
-            if date_str:
-                try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    hourly[dt.hour]['count'] += 1
-                    hourly[dt.hour]['revenue'] += txn.get('amount_aed', 0)
-                except:
-                    continue
+        hourly = {hour: {'count': count, 'revenue': revenue} for hour, (count, revenue) in totals.items()}
         
         # Find peak hour
         peak_hour = max(hourly.keys(), key=lambda h: hourly[h]['revenue']) if hourly else 12
         
         return {
-            'distribution': dict(hourly),
+            'distribution': hourly,
             'peak_hour': peak_hour,
             'peak_revenue': hourly[peak_hour]['revenue'] if hourly else 0
         }
 
-    def _analyze_daily_pattern(self, transactions: List[Dict]) -> Dict:
+    def _analyze_daily_pattern(self, totals: Dict[int, Tuple[int, float]]) -> Dict:
         """Analyze sales by day of week"""
         daily = {i: {'count': 0, 'revenue': 0} for i in range(7)}
-        
-        for txn in transactions:
-            date_str = txn.get('date', '')
-            if date_str:
-                try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    daily[dt.weekday()]['count'] += 1
-                    daily[dt.weekday()]['revenue'] += txn.get('amount_aed', 0)
-                except:
-                    continue
+        for dow, (count, revenue) in totals.items():
+            daily[dow] = {'count': count, 'revenue': revenue}
         
         # Format with day names
         formatted = {}
@@ -396,20 +435,9 @@ class SalesPatternAgent:
             'weekend_note': 'UAE weekend is Saturday-Sunday since 2022'
         }
 
-    def _analyze_weekly_pattern(self, transactions: List[Dict]) -> Dict:
+    def _analyze_weekly_pattern(self, totals: Dict[str, Tuple[int, float]]) -> Dict:
         """Analyze sales by week"""
-        weekly = defaultdict(lambda: {'count': 0, 'revenue': 0})
-        
-        for txn in transactions:
-            date_str = txn.get('date', '')
-            if date_str:
-                try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    week_key = dt.strftime('%Y-W%W')
-                    weekly[week_key]['count'] += 1
-                    weekly[week_key]['revenue'] += txn.get('amount_aed', 0)
-                except:
-                    continue
+        weekly = {week: {'count': count, 'revenue': revenue} for week, (count, revenue) in totals.items()}
         
         weeks = sorted(weekly.keys())
         if len(weeks) >= 2:
@@ -420,74 +448,53 @@ class SalesPatternAgent:
             trend_direction = 'insufficient_data'
         
         return {
-            'weeks': dict(weekly),
+            'weeks': weekly,
             'trend': round(trend, 2),
             'trend_direction': trend_direction
         }
 
-    def _analyze_monthly_pattern(self, transactions: List[Dict]) -> Dict:
+    def _analyze_monthly_pattern(self, totals: Dict[int, Tuple[int, float]]) -> Dict:
         """Analyze by day of month (salary cycle patterns)"""
-        day_of_month = defaultdict(lambda: {'count': 0, 'revenue': 0})
-        
-        for txn in transactions:
-            date_str = txn.get('date', '')
-            if date_str:
-                try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    day_of_month[dt.day]['count'] += 1
-                    day_of_month[dt.day]['revenue'] += txn.get('amount_aed', 0)
-                except:
-                    continue
+        day_of_month = {day: {'count': count, 'revenue': revenue} for day, (count, revenue) in totals.items()}
         
         # Check for salary cycle patterns
         salary_days = list(range(25, 32)) + list(range(1, 6))
-        salary_revenue = sum(day_of_month.get(d, {}).get('revenue', 0) for d in salary_days if d in day_of_month)
+        salary_revenue = sum(day_of_month[d]['revenue'] for d in salary_days if d in day_of_month)
         total_revenue = sum(d['revenue'] for d in day_of_month.values())
         
         salary_pattern_strength = (salary_revenue / total_revenue) if total_revenue > 0 else 0
         
         return {
-            'distribution': dict(day_of_month),
+            'distribution': day_of_month,
             'salary_cycle_impact': f"{salary_pattern_strength*100:.0f}% of sales near salary days",
             'salary_days': salary_days
         }
 
-    def _analyze_category_pattern(self, transactions: List[Dict]) -> Dict:
+    def _analyze_category_pattern(self, totals: Dict[str, Tuple[int, float]]) -> Dict:
         """Analyze sales by category"""
-        categories = defaultdict(lambda: {'count': 0, 'revenue': 0})
-        
-        for txn in transactions:
-            cat = txn.get('category', 'uncategorized')
-            categories[cat]['count'] += 1
-            categories[cat]['revenue'] += txn.get('amount_aed', 0)
+        categories = {cat: {'count': count, 'revenue': revenue} for cat, (count, revenue) in totals.items()}
         
         # Sort by revenue
         sorted_cats = sorted(categories.items(), key=lambda x: -x[1]['revenue'])
         
         return {
-            'distribution': dict(categories),
+            'distribution': categories,
             'top_category': sorted_cats[0][0] if sorted_cats else None,
             'top_category_revenue': sorted_cats[0][1]['revenue'] if sorted_cats else 0
         }
 
-    def _analyze_payment_pattern(self, transactions: List[Dict]) -> Dict:
+    def _analyze_payment_pattern(self, methods: Dict[str, Tuple[int, float]]) -> Dict:
         """Analyze by payment method"""
-        methods = defaultdict(lambda: {'count': 0, 'revenue': 0})
-        
-        for txn in transactions:
-            method = txn.get('payment_method', 'cash')
-            methods[method]['count'] += 1
-            methods[method]['revenue'] += txn.get('amount_aed', 0)
-        
-        total = sum(m['revenue'] for m in methods.values())
+        total = sum(revenue for _, revenue in methods.values())
         
         return {
             'distribution': {
                 method: {
-                    **data,
-                    'percentage': round(data['revenue'] / total * 100, 1) if total > 0 else 0
+                    'count': count,
+                    'revenue': revenue,
+                    'percentage': round(revenue / total * 100, 1) if total > 0 else 0
                 }
-                for method, data in methods.items()
+                for method, (count, revenue) in methods.items()
             }
         }
 
@@ -562,30 +569,6 @@ class SalesPatternAgent:
             return 'dsf'
         return 'normal'
 
-    async def _get_sales_transactions(self, user_id: str, days: int) -> List[Dict]:
-        """Fetch sales transactions"""
-        start_date = datetime.now() - timedelta(days=days)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.sale',
-                    'date': f'gte.{start_date.isoformat()}',
-                    'select': '*',
-                    'order': 'date.desc'
-                }
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-        return []
-
     async def _get_customer_transactions(self, user_id: str) -> Dict:
         """Fetch and aggregate customer transactions"""
         async with httpx.AsyncClient() as client:
@@ -0,0 +1,459 @@
+"""
+StoreBuddy UAE - Sales Rollups
+Incrementally maintained hourly and daily transaction buckets per shop
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import calendar
+import threading
+from pathlib import Path
+from collections import defaultdict
+from datetime import datetime, date
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from transaction_frame import CATEGORICAL_COLUMNS, row_timestamp_text
+from structured_log import get_logger
+
+log = get_logger("sales_rollups")
+
+DEFAULT_DB_PATH = Path(__file__).parent.parent / ".cache" / "sales_rollups.sqlite3"
+
+# Rebuilt coverage older than this is a miss (reads fall back to raw transactions)
+DEFAULT_MAX_AGE_SECONDS = 26 * 3600
+# How long applied webhook events are remembered to drop redelivered duplicates
+EVENT_RETENTION_SECONDS = 24 * 3600
+
+DateLike = Union[datetime, date]
+
+# Buckets are keyed by wall-clock epoch hour / epoch day, as the shop recorded them.
+# Daily rows carry a dimension: 'total' (key ''), 'category' or 'payment_method'.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS rollup_hourly (
+        user_id TEXT NOT NULL,
+        transaction_type TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        revenue REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, transaction_type, hour))""",
+    """CREATE TABLE IF NOT EXISTS rollup_daily (
+        user_id TEXT NOT NULL,
+        transaction_type TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        revenue REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, transaction_type, dimension, day, key))""",
+    # Rollups for a user are complete from since_day onwards
+    """CREATE TABLE IF NOT EXISTS rollup_coverage (
+        user_id TEXT PRIMARY KEY,
+        since_day INTEGER NOT NULL,
+        built_at REAL NOT NULL)""",
+    # Webhook events already applied, keyed on a digest of the event
+    """CREATE TABLE IF NOT EXISTS rollup_events (
+        event_key TEXT PRIMARY KEY,
+        received_at REAL NOT NULL)""",
+]
+
+_HOURLY_CONFLICT = (
+    " ON CONFLICT (user_id, transaction_type, hour)"
+    " DO UPDATE SET revenue = revenue + excluded.revenue, count = count + excluded.count"
+)
+_DAILY_CONFLICT = (
+    " ON CONFLICT (user_id, transaction_type, dimension, day, key)"
+    " DO UPDATE SET revenue = revenue + excluded.revenue, count = count + excluded.count"
+)
+UPSERT_HOURLY = (
+    "INSERT INTO rollup_hourly (user_id, transaction_type, hour, revenue, count)"
+    " VALUES (?, ?, ?, ?, ?)" + _HOURLY_CONFLICT
+)
+UPSERT_DAILY = (
+    "INSERT INTO rollup_daily (user_id, transaction_type, dimension, day, key, revenue, count)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?)" + _DAILY_CONFLICT
+)
+
+DAILY_DIMENSIONS = ('category', 'payment_method')
+
+# Groupings answered from the buckets: (table, dimension, SQL key expression).
+# Keys match TransactionFrame.group_totals.
+GROUPINGS = {
+    'hour': ('rollup_hourly', None, 'hour % 24'),
+    'weekday_hour': ('rollup_hourly', None, '((hour / 24 + 3) % 7) * 24 + hour % 24'),
+    'weekday': ('rollup_daily', 'total', '(day + 3) % 7'),
+    'day_of_month': ('rollup_daily', 'total', "CAST(strftime('%d', day * 86400, 'unixepoch') AS INTEGER)"),
+    'week': ('rollup_daily', 'total', "strftime('%Y-W%W', day * 86400, 'unixepoch')"),
+    'date': ('rollup_daily', 'total', "date(day * 86400, 'unixepoch')"),
+    'category': ('rollup_daily', 'category', 'key'),
+    'payment_method': ('rollup_daily', 'payment_method', 'key'),
+}
+
+
+# ----------------------------------------------------------------------------
+# SQLite stand-in: a local `transactions` table whose triggers keep the
+# rollups current, for development and offline runs without Supabase.
+# ----------------------------------------------------------------------------
+
+STANDIN_TABLE = """CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    amount_aed REAL,
+    vat_amount REAL,
+    total_amount REAL,
+    category_name TEXT,
+    category TEXT,
+    payment_method TEXT,
+    vat_category TEXT,
+    date TEXT,
+    transaction_date TEXT,
+    transaction_time TEXT)"""
+
+# Same wall-clock timestamp as transaction_frame.row_timestamp_text
+_STANDIN_TS = (
+    "substr(CASE WHEN length(COALESCE(NULLIF({r}.date, ''), {r}.transaction_date)) = 10"
+    " AND {r}.transaction_time IS NOT NULL"
+    " THEN COALESCE(NULLIF({r}.date, ''), {r}.transaction_date) || 'T' || {r}.transaction_time"
+    " ELSE COALESCE(NULLIF({r}.date, ''), {r}.transaction_date) END, 1, 19)"
+)
+
+
+def _standin_upserts(r: str, sign: int) -> str:
+    seconds = f"CAST(strftime('%s', {_STANDIN_TS.format(r=r)}) AS INTEGER)"
+    ttype = f"COALESCE({r}.transaction_type, '')"
+    amount = f"{sign} * COALESCE({r}.amount_aed, 0)"
+    keys = {
+        'total': "''",
+        'category': f"COALESCE(NULLIF({r}.category_name, ''), NULLIF({r}.category, ''), 'uncategorized')",
+        'payment_method': f"COALESCE(NULLIF({r}.payment_method, ''), 'cash')",
+    }
+    statements = [
+        "INSERT INTO rollup_hourly (user_id, transaction_type, hour, revenue, count)"
+        f" VALUES ({r}.user_id, {ttype}, {seconds} / 3600, {amount}, {sign}){_HOURLY_CONFLICT};"
+    ]
+    for dimension, key in keys.items():
+        statements.append(
+            "INSERT INTO rollup_daily (user_id, transaction_type, dimension, day, key, revenue, count)"
+            f" VALUES ({r}.user_id, {ttype}, '{dimension}', {seconds} / 86400, {key}, {amount}, {sign})"
+            f"{_DAILY_CONFLICT};"
+        )
+    return "\n    ".join(statements)
+
+
+def standin_triggers() -> List[str]:
+    """Trigger DDL that maintains the rollups from the stand-in table"""
+    valid = "strftime('%s', " + _STANDIN_TS + ") IS NOT NULL"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS rollup_after_insert AFTER INSERT ON transactions
+WHEN {valid.format(r='NEW')}
+BEGIN
+    {_standin_upserts('NEW', 1)}
+    INSERT OR IGNORE INTO rollup_coverage (user_id, since_day, built_at)
+        VALUES (NEW.user_id, 0, strftime('%s', 'now'));
+END""",
+        f"""CREATE TRIGGER IF NOT EXISTS rollup_after_delete AFTER DELETE ON transactions
+WHEN {valid.format(r='OLD')}
+BEGIN
+    {_standin_upserts('OLD', -1)}
+END""",
+        f"""CREATE TRIGGER IF NOT EXISTS rollup_update_old AFTER UPDATE ON transactions
+WHEN {valid.format(r='OLD')}
+BEGIN
+    {_standin_upserts('OLD', -1)}
+END""",
+        f"""CREATE TRIGGER IF NOT EXISTS rollup_update_new AFTER UPDATE ON transactions
+WHEN {valid.format(r='NEW')}
+BEGIN
+    {_standin_upserts('NEW', 1)}
+END""",
+    ]
+
+
+def _epoch_seconds(row: Dict) -> Optional[int]:
+    text = row_timestamp_text(row)
+    if not text:
+        return None
+    try:
+        return calendar.timegm(datetime.fromisoformat(text).timetuple())
+    except ValueError:
+        return None
+
+
+def _label(row: Dict, column: str) -> str:
+    keys, default = CATEGORICAL_COLUMNS[column]
+    for key in keys:
+        if row.get(key):
+            return str(row[key])
+    return default
+
+
+def event_key(event: Dict[str, Any]) -> str:
+    """Digest identifying a row-change event, the same for every delivery of it"""
+    payload = [(event.get('type') or '').upper(), event.get('record'), event.get('old_record')]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def day_start(value: DateLike) -> datetime:
+    """
+    Midnight of the day of `value`. Rollup reads are aligned to whole days,
+    so callers truncate window bounds with this before reading either the
+    rollups or the transaction frame, and both paths agree.
+    """
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _epoch_day(value: DateLike) -> int:
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - date(1970, 1, 1)).days
+
+
+def _epoch_hour(value: DateLike) -> int:
+    if not isinstance(value, datetime):
+        return _epoch_day(value) * 24
+    return calendar.timegm(value.replace(tzinfo=None).timetuple()) // 3600
+
+
+class SalesRollupStore:
+    """
+    Per-user hourly and daily buckets (revenue and count by transaction
+    type, plus daily category and payment method breakdowns) kept current as
+    transactions arrive:
+    - record()/remove()/apply_event(): Python ingest hook (webhooks, writers)
+    - standin_triggers(): SQLite triggers on a local stand-in table
+    - rebuild(): reseeds a user from raw rows (nightly batch cycle)
+    Analyzers read O(days) bucket rows instead of O(transactions).
+
+    Coverage from rebuild() expires after `max_age` seconds (None: never),
+    so missed webhook events cannot keep stale buckets in use.
+    """
+
+    def __init__(self, db_path: Union[str, Path] = DEFAULT_DB_PATH, standin: bool = False,
+                 max_age: Optional[float] = DEFAULT_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        if str(db_path) != ':memory:':
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+            if standin:
+                self._db.execute(STANDIN_TABLE)
+                for trigger in standin_triggers():
+                    self._db.execute(trigger)
+            self._db.commit()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self._db
+
+    # ----- ingest -----
+
+    def _bucket_params(self, user_id: str, row: Dict, sign: int) -> Optional[Tuple[tuple, List[tuple]]]:
+        seconds = _epoch_seconds(row)
+        if seconds is None:
+            return None
+        ttype = str(row.get('transaction_type') or '')
+        amount = sign * float(row.get('amount_aed') or 0)
+        day = seconds // 86400
+        hourly = (user_id, ttype, seconds // 3600, amount, sign)
+        daily = [(user_id, ttype, 'total', day, '', amount, sign)]
+        for dimension in DAILY_DIMENSIONS:
+            daily.append((user_id, ttype, dimension, day, _label(row, dimension), amount, sign))
+        return hourly, daily
+
+    def _upsert(self, row: Dict, sign: int) -> bool:
+        """Caller holds the lock and commits"""
+        user_id = row.get('user_id')
+        params = self._bucket_params(user_id, row, sign) if user_id else None
+        if params is None:
+            return False
+        hourly, daily = params
+        self._db.execute(UPSERT_HOURLY, hourly)
+        self._db.executemany(UPSERT_DAILY, daily)
+        return True
+
+    def record(self, row: Dict, sign: int = 1) -> bool:
+        """Add one transaction to its buckets (sign=-1 takes it out again)"""
+        with self._lock:
+            applied = self._upsert(row, sign)
+            self._db.commit()
+        return applied
+
+    def remove(self, row: Dict) -> bool:
+        return self.record(row, sign=-1)
+
+    def apply_event(self, event: Dict[str, Any]) -> bool:
+        """
+        Apply a row-change event shaped like a Supabase database webhook:
+        {"type": "INSERT" | "UPDATE" | "DELETE", "record": {...}, "old_record": {...}}
+
+        Redeliveries of an event already applied (webhook retries) are
+        ignored and return False.
+        """
+        kind = (event.get('type') or '').upper()
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM rollup_events WHERE received_at < ?",
+                                 (now - EVENT_RETENTION_SECONDS,))
+                inserted = self._db.execute(
+                    "INSERT OR IGNORE INTO rollup_events (event_key, received_at) VALUES (?, ?)",
+                    (event_key(event), now)
+                ).rowcount
+                applied = False
+                if inserted:
+                    if kind in ('UPDATE', 'DELETE') and event.get('old_record'):
+                        applied = self._upsert(event['old_record'], -1)
+                    if kind in ('INSERT', 'UPDATE') and event.get('record'):
+                        applied = self._upsert(event['record'], 1) or applied
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+        return applied
+
+    def rebuild(self, user_id: str, rows: List[Dict], since: DateLike):
+        """Replace a user's buckets with aggregates of `rows`, complete from `since`"""
+        hourly: Dict[tuple, List[float]] = defaultdict(lambda: [0.0, 0])
+        daily: Dict[tuple, List[float]] = defaultdict(lambda: [0.0, 0])
+        for row in rows:
+            params = self._bucket_params(user_id, row, 1)
+            if params is None:
+                continue
+            hour_params, day_params = params
+            bucket = hourly[hour_params[:3]]
+            bucket[0] += hour_params[3]
+            bucket[1] += 1
+            for day_row in day_params:
+                bucket = daily[day_row[:5]]
+                bucket[0] += day_row[5]
+                bucket[1] += 1
+
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM rollup_hourly WHERE user_id = ?", (user_id,))
+                self._db.execute("DELETE FROM rollup_daily WHERE user_id = ?", (user_id,))
+                self._db.executemany(UPSERT_HOURLY, [(*k, v[0], v[1]) for k, v in hourly.items()])
+                self._db.executemany(UPSERT_DAILY, [(*k, v[0], v[1]) for k, v in daily.items()])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rollup_coverage (user_id, since_day, built_at) VALUES (?, ?, ?)",
+                    (user_id, _epoch_day(since), time.time())
+                )
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+
+    # ----- reads -----
+
+    def covers(self, user_id: str, since: DateLike) -> bool:
+        """True when the user's buckets are complete from `since` and not expired"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT since_day, built_at FROM rollup_coverage WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None or row[0] > _epoch_day(since):
+            return False
+        return self.max_age is None or time.time() - row[1] <= self.max_age
+
+    def _window(self, table: str, since: Optional[DateLike], until: Optional[DateLike]) -> Tuple[str, list]:
+        column, to_key = ('hour', _epoch_hour) if table == 'rollup_hourly' else ('day', _epoch_day)
+        clauses, params = [], []
+        if since is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(to_key(since))
+        if until is not None:
+            clauses.append(f"{column} < ?")
+            params.append(to_key(until))
+        return ''.join(f" AND {c}" for c in clauses), params
+
+    def group_totals(self, user_id: str, by: str, transaction_type: str = 'sale',
+                     since: Optional[DateLike] = None,
+                     until: Optional[DateLike] = None) -> Dict[Any, Tuple[int, float]]:
+        """
+        {key: (count, revenue)} with the same keys as TransactionFrame.group_totals.
+        Windows are aligned to whole days (hours for hourly groupings).
+        """
+        table, dimension, expression = GROUPINGS[by]
+        window, params = self._window(table, since, until)
+        dimension_clause = " AND dimension = ?" if dimension else ""
+        query = (
+            f"SELECT {expression} AS k, SUM(count), SUM(revenue) FROM {table}"
+            f" WHERE user_id = ? AND transaction_type = ?{dimension_clause}{window}"
+            " GROUP BY k HAVING SUM(count) > 0 ORDER BY k"
+        )
+        args = [user_id, transaction_type] + ([dimension] if dimension else []) + params
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return {key: (int(count), float(revenue)) for key, count, revenue in rows}
+
+    def aggregate(self, user_id: str, groupings: Tuple[str, ...], transaction_type: str = 'sale',
+                  since: Optional[DateLike] = None,
+                  until: Optional[DateLike] = None) -> Dict[str, Dict[Any, Tuple[int, float]]]:
+        return {by: self.group_totals(user_id, by, transaction_type, since, until) for by in groupings}
+
+    def total(self, user_id: str, transaction_type: str, since: Optional[DateLike] = None,
+              until: Optional[DateLike] = None) -> float:
+        window, params = self._window('rollup_daily', since, until)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(revenue), 0) FROM rollup_daily"
+                f" WHERE user_id = ? AND transaction_type = ? AND dimension = 'total'{window}",
+                [user_id, transaction_type] + params
+            ).fetchone()
+        return float(row[0])
+
+    def clear(self, user_ids: Optional[List[str]] = None):
+        with self._lock:
+            if user_ids is None:
+                self._db.execute("DELETE FROM rollup_events")
+            for table in ('rollup_hourly', 'rollup_daily', 'rollup_coverage'):
+                if user_ids is None:
+                    self._db.execute(f"DELETE FROM {table}")
+                else:
+                    self._db.executemany(f"DELETE FROM {table} WHERE user_id = ?", [(u,) for u in user_ids])
+            self._db.commit()
+
+
+def rollup_aggregate(user_id: str, groupings: Tuple[str, ...], since: DateLike,
+                     transaction_type: str = 'sale') -> Optional[Dict[str, Dict[Any, Tuple[int, float]]]]:
+    """Groupings from the rollups, or None when they are disabled or don't cover `since`"""
+    if sales_rollups is None or not sales_rollups.covers(user_id, since):
+        return None
+    return sales_rollups.aggregate(user_id, groupings, transaction_type, since)
+
+
+def rollup_total(user_id: str, transaction_type: str, since: DateLike,
+                 until: Optional[DateLike] = None) -> Optional[float]:
+    """Summed amount from the rollups, or None when they don't cover `since`"""
+    if sales_rollups is None or not sales_rollups.covers(user_id, since):
+        return None
+    return sales_rollups.total(user_id, transaction_type, since, until)
+
+
+def _create_default_store() -> Optional[SalesRollupStore]:
+    if os.getenv('SALES_ROLLUPS_ENABLED', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    db_path = os.getenv('SALES_ROLLUP_PATH')
+    standin = os.getenv('SALES_ROLLUP_STANDIN', 'false').lower() in ('1', 'true', 'yes')
+    try:
+        return SalesRollupStore(
+            db_path=Path(db_path) if db_path else DEFAULT_DB_PATH,
+            standin=standin,
+            # Stand-in triggers see every write, so their coverage never goes stale
+            max_age=None if standin else float(os.getenv('SALES_ROLLUP_MAX_AGE_SECONDS', DEFAULT_MAX_AGE_SECONDS))
+        )
+    except sqlite3.Error as e:
+        log.warning("Sales rollups disabled: %s", e)
+        return None
+
+
+# Singleton instance (None when disabled)
+sales_rollups = _create_default_store()
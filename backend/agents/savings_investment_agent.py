@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class SavingsInvestmentAgent:
@@ -177,6 +178,9 @@ Please analyze and provide a complete savings and investment plan."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Savings Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -19,6 +19,11 @@ from tax_agent import TaxComplianceAgent
 from recommendation_agent import RecommendationAgent
 from risk_agent import RiskAssessmentAgent
 from action_agent import ActionExecutionAgent
+from autogen_runtime import llm_priority
+from llm_gateway import GatewayOverloaded
+
+# Attempts per agent while the LLM gateway is rejecting work
+MAX_OVERLOAD_ATTEMPTS = 4
 
 
 class AgentScheduler:
@@ -40,6 +45,23 @@ class AgentScheduler:
             "action": ActionExecutionAgent(mcp_config_path)
         }
 
+    async def _run_agent(self, agent_key: str, user_id: str) -> dict:
+        """
+        Run one agent, backing off and retrying while the LLM gateway is
+        overloaded; gives up with an error result so the cycle continues
+        """
+        for attempt in range(1, MAX_OVERLOAD_ATTEMPTS + 1):
+            try:
+                return await self.agents[agent_key].analyze_user(user_id)
+            except GatewayOverloaded as e:
+                if attempt == MAX_OVERLOAD_ATTEMPTS:
+                    print(f"[Scheduler] {agent_key} skipped, LLM gateway still overloaded: {e}")
+                    return {"success": False, "user_id": user_id, "error": str(e),
+                            "timestamp": datetime.now().isoformat()}
+                delay = e.retry_after * 2 ** (attempt - 1)
+                print(f"[Scheduler] LLM gateway overloaded, retrying {agent_key} in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
     async def run_all_agents(self, user_id: str) -> dict:
         """
         Run all 9 agents for a specific user in sequence
@@ -63,47 +85,47 @@ class AgentScheduler:
         # Run agents in order (some depend on others)
         # 1. Pattern Recognition (foundation)
         print("[1/9] Running Pattern Recognition Agent...")
-        results["agents"]["pattern"] = await self.agents["pattern"].analyze_user(user_id)
+        results["agents"]["pattern"] = await self._run_agent("pattern", user_id)
         await asyncio.sleep(2)  # Brief pause between agents
 
         # 2. Context Intelligence (enriches patterns)
         print("\n[2/9] Running Context Intelligence Agent...")
-        results["agents"]["context"] = await self.agents["context"].analyze_user(user_id)
+        results["agents"]["context"] = await self._run_agent("context", user_id)
         await asyncio.sleep(2)
 
         # 3. Volatility Forecaster (needs patterns)
         print("\n[3/9] Running Volatility Forecaster Agent...")
-        results["agents"]["volatility"] = await self.agents["volatility"].analyze_user(user_id)
+        results["agents"]["volatility"] = await self._run_agent("volatility", user_id)
         await asyncio.sleep(2)
 
         # 4. Budget Analysis (needs patterns and forecasts)
         print("\n[4/9] Running Budget Analysis Agent...")
-        results["agents"]["budget"] = await self.agents["budget"].analyze_user(user_id)
+        results["agents"]["budget"] = await self._run_agent("budget", user_id)
         await asyncio.sleep(2)
 
         # 5. Knowledge Integration (independent)
         print("\n[5/9] Running Knowledge Integration Agent...")
-        results["agents"]["knowledge"] = await self.agents["knowledge"].analyze_user(user_id)
+        results["agents"]["knowledge"] = await self._run_agent("knowledge", user_id)
         await asyncio.sleep(2)
 
         # 6. Tax & Compliance (needs income data)
         print("\n[6/9] Running Tax & Compliance Agent...")
-        results["agents"]["tax"] = await self.agents["tax"].analyze_user(user_id)
+        results["agents"]["tax"] = await self._run_agent("tax", user_id)
         await asyncio.sleep(2)
 
         # 7. Risk Assessment (needs all financial data)
         print("\n[7/9] Running Risk Assessment Agent...")
-        results["agents"]["risk"] = await self.agents["risk"].analyze_user(user_id)
+        results["agents"]["risk"] = await self._run_agent("risk", user_id)
         await asyncio.sleep(2)
 
         # 8. Recommendation Engine (needs everything)
         print("\n[8/9] Running Recommendation Engine Agent...")
-        results["agents"]["recommendation"] = await self.agents["recommendation"].analyze_user(user_id)
+        results["agents"]["recommendation"] = await self._run_agent("recommendation", user_id)
         await asyncio.sleep(2)
 
         # 9. Action Execution (needs recommendations)
         print("\n[9/9] Running Action Execution Agent...")
-        results["agents"]["action"] = await self.agents["action"].analyze_user(user_id)
+        results["agents"]["action"] = await self._run_agent("action", user_id)
 
         results["analysis_completed"] = datetime.now().isoformat()
 
@@ -149,8 +171,14 @@ class AgentScheduler:
             try:
                 print(f"\n[{datetime.now().isoformat()}] Starting scheduled analysis cycle...")
 
-                for user_id in active_users:
-                    await self.run_all_agents(user_id)
+                # Background work yields LLM capacity to interactive requests
+                with llm_priority("batch"):
+                    for user_id in active_users:
+                        try:
+                            await self.run_all_agents(user_id)
+                        except Exception as e:
+                            # One user's failure doesn't cost the rest their cycle
+                            print(f"\nAnalysis failed for user {user_id}: {str(e)}")
 
                 print(f"\n[{datetime.now().isoformat()}] Cycle complete. Sleeping for {interval_seconds}s...")
                 await asyncio.sleep(interval_seconds)
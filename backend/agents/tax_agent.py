@@ -13,6 +13,7 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
 
 
 class TaxComplianceAgent:
@@ -380,7 +381,18 @@ Store in tax_records table with fields:
 - regime_used (old/new)
 - itr_form_data (JSON with all ITR fields)
 - filing_status (not_filed/filed/verified)
-- created_at"""
+- created_at
+
+**Steps:**
+1. Read transactions to calculate annual gross income
+2. Read user_profiles for deduction information
+3. Calculate applicable deductions (80C, 80D, etc.)
+4. Calculate taxable income
+5. Compare old vs new tax regime - choose better option
+6. Calculate final tax liability
+7. Prepare ITR form data (ITR-3 or ITR-4)
+8. Write results to tax_records table
+9. Log to agent_logs table"""
 
     async def analyze_user(self, user_id: str) -> dict:
         """
@@ -395,19 +407,9 @@ Store in tax_records table with fields:
         print(f"[Tax Agent] Starting analysis for user {user_id}")
 
         try:
+            # Instructions live in the (static, cacheable) system prompt
             prompt = f"""Calculate taxes and prepare ITR for user {user_id}.
 
-Steps:
-1. Read transactions to calculate annual gross income
-2. Read user_profiles for deduction information
-3. Calculate applicable deductions (80C, 80D, etc.)
-4. Calculate taxable income
-5. Compare old vs new tax regime - choose better option
-6. Calculate final tax liability
-7. Prepare ITR form data (ITR-3 or ITR-4)
-8. Write results to tax_records table
-9. Log to agent_logs table
-
 User ID: {user_id}
 
 Please execute this analysis and report the tax calculations."""
@@ -430,6 +432,9 @@ Please execute this analysis and report the tax calculations."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Tax Agent] Error analyzing user {user_id}: {str(e)}")
             return {
@@ -0,0 +1,383 @@
+"""
+StoreBuddy UAE - Transaction Frame
+Columnar view of a shop's transactions shared by the analysis agents
+"""
+
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+
+from batch_loader import batch_loader, prefetch_cache, transaction_window_filter
+
+load_dotenv()
+
+# Numeric columns and the row keys they are read from (first present wins)
+NUMERIC_COLUMNS = {
+    'amount_aed': ('amount_aed',),
+    'vat_amount': ('vat_amount', 'vat_amount_aed'),
+    'total_amount': ('total_amount',),
+}
+
+# Categorical columns, their row keys and the label used when a row has none
+CATEGORICAL_COLUMNS = {
+    'transaction_type': (('transaction_type',), ''),
+    'category': (('category_name', 'category'), 'uncategorized'),
+    'payment_method': (('payment_method',), 'cash'),
+    'vat_category': (('vat_category',), 'standard'),
+}
+
+# Every frame covers at least this many days so one load serves all agents in a run
+FRAME_DAYS = 180
+FRAME_TTL_SECONDS = 300
+FRAME_CACHE_MAX_USERS = 256
+
+DateLike = Union[datetime, date]
+
+# Week heatmap: one slot per (weekday, hour)
+HEATMAP_SLOTS = 7 * 24
+
+
+def _column_values(rows: List[Dict], keys: Tuple[str, ...]):
+    """Values of the first present key of each row (None when none is)"""
+    if len(keys) == 1:
+        key = keys[0]
+        return (row.get(key) for row in rows)
+    primary, fallback = keys
+    return (row.get(primary) if row.get(primary) is not None else row.get(fallback) for row in rows)
+
+
+def row_timestamp_text(row: Dict) -> str:
+    """Wall-clock 'YYYY-MM-DDTHH:MM:SS' (or a bare date) for a row, '' when it has none"""
+    value = row.get('date') or row.get('transaction_date') or ''
+    text = str(value).replace(' ', 'T')
+    if len(text) == 10 and row.get('transaction_time'):
+        text = f"{text}T{row['transaction_time']}"
+    # Offsets and fractions are dropped: hours and days stay as the shop recorded them
+    return text[:19]
+
+
+def _parse_timestamps(texts: List[str]) -> np.ndarray:
+    """Parse ISO strings to datetime64[s] in one pass; unparseable values become NaT"""
+    try:
+        return np.array(texts, dtype='U19').astype('datetime64[s]')
+    except ValueError:
+        parsed = np.empty(len(texts), dtype='datetime64[s]')
+        for i, text in enumerate(texts):
+            try:
+                parsed[i] = np.datetime64(text, 's') if text else np.datetime64('NaT')
+            except ValueError:
+                parsed[i] = np.datetime64('NaT')
+        return parsed
+
+
+def _to_datetime64(value: DateLike) -> np.datetime64:
+    if isinstance(value, datetime):
+        value = value.replace(tzinfo=None)
+    return np.datetime64(value, 's')
+
+
+class TransactionFrame:
+    """
+    Transactions as NumPy columns, built once from fetched rows:
+    - amount_aed, vat_amount, total_amount as float arrays
+    - timestamps as datetime64[s] (NaT where a row has no usable date)
+    - transaction_type, category, payment_method and vat_category as integer
+      codes into a per-column label list
+    Agents select rows with boolean masks and aggregate with sum/group_totals
+    instead of walking lists of dicts.
+    """
+
+    def __init__(self, numeric: Dict[str, np.ndarray], codes: Dict[str, np.ndarray],
+                 labels: Dict[str, List[str]], timestamps: np.ndarray,
+                 since: Optional[datetime] = None):
+        self.numeric = numeric
+        self.codes = codes
+        self.labels = labels
+        self.timestamps = timestamps
+        self.has_timestamp = ~np.isnat(timestamps)
+        self.since = since
+        self.loaded_at = time.monotonic()
+
+        # Calendar fields derived once with integer arithmetic on the timestamps
+        seconds = np.where(self.has_timestamp, timestamps.astype('int64'), 0)
+        days = seconds // 86400
+        self.day_number = days
+        self.hour = (seconds % 86400) // 3600
+        self.weekday = (days + 3) % 7  # 1970-01-01 was a Thursday; Monday = 0
+        as_days = days.astype('datetime64[D]')
+        self.day_of_month = (as_days - as_days.astype('datetime64[M]')).astype('int64') + 1
+        self.year = as_days.astype('datetime64[Y]').astype('int64') + 1970
+        day_of_year = (as_days - as_days.astype('datetime64[Y]')).astype('int64')
+        # strftime('%W'): weeks start on Monday, days before the first Monday are week 0
+        self.week_of_year = (day_of_year + 7 - self.weekday) // 7
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], since: Optional[datetime] = None) -> 'TransactionFrame':
+        """Build the columns from PostgREST transaction rows"""
+        count = len(rows)
+        numeric = {}
+        for column, keys in NUMERIC_COLUMNS.items():
+            numeric[column] = np.fromiter(
+                (float(v or 0) for v in _column_values(rows, keys)), dtype=np.float64, count=count
+            )
+
+        # Codes are assigned in order of first appearance (a dict lookup per row, no sort)
+        codes, labels = {}, {}
+        for column, (keys, default) in CATEGORICAL_COLUMNS.items():
+            index: Dict[str, int] = {}
+            codes[column] = np.fromiter(
+                (index.setdefault(str(v or default), len(index)) for v in _column_values(rows, keys)),
+                dtype=np.int32, count=count
+            )
+            labels[column] = list(index)
+
+        timestamps = _parse_timestamps([row_timestamp_text(row) for row in rows])
+        return cls(numeric, codes, labels, timestamps, since)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def covers(self, since: DateLike) -> bool:
+        """True when the frame was loaded from at or before `since`"""
+        if self.since is None:
+            return True
+        return _to_datetime64(self.since) <= _to_datetime64(since)
+
+    def is_in(self, column: str, *values: str) -> np.ndarray:
+        """Mask of rows whose categorical `column` is one of `values`"""
+        labels = self.labels[column]
+        wanted = [labels.index(v) for v in values if v in labels]
+        return np.isin(self.codes[column], wanted)
+
+    def mask(self, transaction_type: Optional[str] = None, since: Optional[DateLike] = None,
+             until: Optional[DateLike] = None) -> np.ndarray:
+        """
+        Rows of a type inside [since, until). Rows without a date are excluded
+        whenever a date bound is given.
+        """
+        selected = np.ones(len(self), dtype=bool)
+        if transaction_type is not None:
+            selected &= self.is_in('transaction_type', transaction_type)
+        if since is not None or until is not None:
+            selected &= self.has_timestamp
+            if since is not None:
+                selected &= self.timestamps >= _to_datetime64(since)
+            if until is not None:
+                selected &= self.timestamps < _to_datetime64(until)
+        return selected
+
+    def sum(self, column: str = 'amount_aed', mask: Optional[np.ndarray] = None) -> float:
+        values = self.numeric[column]
+        return float(values[mask].sum() if mask is not None else values.sum())
+
+    def count(self, mask: Optional[np.ndarray] = None) -> int:
+        return int(mask.sum()) if mask is not None else len(self)
+
+    def group_keys(self, by: str) -> Tuple[np.ndarray, Optional[List[str]]]:
+        """Integer keys for a grouping, plus labels when the keys are categorical codes"""
+        if by in self.codes:
+            return self.codes[by], self.labels[by]
+        if by == 'hour':
+            return self.hour, None
+        if by == 'weekday':
+            return self.weekday, None
+        if by == 'weekday_hour':
+            return self.weekday * 24 + self.hour, None
+        if by == 'day_of_month':
+            return self.day_of_month, None
+        if by == 'date':
+            return self.day_number, None
+        if by == 'week':
+            return self.year * 100 + self.week_of_year, None
+        raise ValueError(f"Unknown grouping: {by}")
+
+    def group_totals(self, by: str, mask: Optional[np.ndarray] = None,
+                     column: str = 'amount_aed') -> Dict[Any, Tuple[int, float]]:
+        """
+        {key: (row count, column total)} over the masked rows.
+        Keys are labels for categorical columns, ints for hour/weekday/
+        day_of_month (weekday * 24 + hour for weekday_hour), 'YYYY-MM-DD' for
+        date and 'YYYY-Www' (strftime %W numbering) for week.
+        """
+        return self.aggregate((by,), mask, column)[by]
+
+    def aggregate(self, groupings: Tuple[str, ...], mask: Optional[np.ndarray] = None,
+                  column: str = 'amount_aed') -> Dict[str, Dict[Any, Tuple[int, float]]]:
+        """
+        group_totals for several groupings in one pass: the row selection and
+        value column are gathered once, and every grouping is a bincount over
+        its precomputed integer keys (no sorting).
+        """
+        base = np.ones(len(self), dtype=bool) if mask is None else mask
+        # Rows for categorical groupings, and rows with a date for calendar ones
+        gathered = {}
+        results = {}
+        for by in groupings:
+            keys, labels = self.group_keys(by)
+            dated = labels is None
+            if dated not in gathered:
+                rows = np.flatnonzero(base & self.has_timestamp if dated else base)
+                gathered[dated] = (rows, self.numeric[column][rows])
+            rows, values = gathered[dated]
+            results[by] = self._bincount_groups(by, keys[rows], values, labels)
+        return results
+
+    def _bincount_groups(self, by: str, keys: np.ndarray, values: np.ndarray,
+                         labels: Optional[List[str]]) -> Dict[Any, Tuple[int, float]]:
+        if not len(keys):
+            return {}
+        # Shift unbounded keys (dates, year-weeks) so the bins start at zero
+        offset = 0 if labels is not None else int(keys.min())
+        shifted = keys - offset if offset else keys
+        counts = np.bincount(shifted)
+        totals = np.bincount(shifted, weights=values, minlength=len(counts))
+        present = np.flatnonzero(counts)
+        found = present + offset
+
+        if labels is not None:
+            names = [labels[k] for k in found]
+        elif by == 'date':
+            names = [str(d) for d in found.astype('datetime64[D]')]
+        elif by == 'week':
+            names = [f"{k // 100}-W{k % 100:02d}" for k in found.tolist()]
+        else:
+            names = found.tolist()
+        return {
+            name: (int(c), float(t))
+            for name, c, t in zip(names, counts[present].tolist(), totals[present].tolist())
+        }
+
+
+def weekly_heatmaps(frames: Sequence[TransactionFrame], masks: Sequence[np.ndarray],
+                    column: str = 'amount_aed') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count and total matrices per (weekday, hour) for several shops at once.
+    Rows of all shops are keyed shop * 168 + weekday * 24 + hour and counted
+    with a single bincount. Returns (counts, totals), both shaped
+    (len(frames), 7, 24); weekday 0 is Monday.
+    """
+    keys, values = [], []
+    for shop, (frame, mask) in enumerate(zip(frames, masks)):
+        rows = np.flatnonzero(mask & frame.has_timestamp)
+        keys.append(shop * HEATMAP_SLOTS + frame.weekday[rows] * 24 + frame.hour[rows])
+        values.append(frame.numeric[column][rows])
+
+    size = len(frames) * HEATMAP_SLOTS
+    keys = np.concatenate(keys) if keys else np.array([], dtype=np.int64)
+    weights = np.concatenate(values) if values else np.array([], dtype=np.float64)
+    counts = np.bincount(keys, minlength=size)
+    totals = np.bincount(keys, weights=weights, minlength=size)
+    return counts.reshape(-1, 7, 24), totals.reshape(-1, 7, 24)
+
+
+def extreme_slots(totals: np.ndarray, counts: np.ndarray, k: int, largest: bool = True) -> List[int]:
+    """
+    Flat slot indices (weekday * 24 + hour) of the k highest (or lowest)
+    totals among slots with at least one row, best first. Uses a partial
+    selection, so only the k picked slots are sorted.
+    """
+    flat_totals = totals.ravel()
+    occupied = np.flatnonzero(counts.ravel())
+    if not len(occupied) or k <= 0:
+        return []
+    scores = flat_totals[occupied] if not largest else -flat_totals[occupied]
+    k = min(k, len(occupied))
+    picked = np.argpartition(scores, k - 1)[:k]
+    # Ties break toward the earlier slot, like a stable sort over the week
+    picked = picked[np.lexsort((occupied[picked], scores[picked]))]
+    return occupied[picked].tolist()
+
+
+class TransactionFrameCache:
+    """
+    One frame per user, reused by every agent of a frame_scope within
+    FRAME_TTL_SECONDS as long as it covers the window the agent asks for
+    """
+
+    def __init__(self, ttl: float = FRAME_TTL_SECONDS, max_users: int = FRAME_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._frames: 'OrderedDict[str, TransactionFrame]' = OrderedDict()
+
+    def get(self, user_id: str, since: DateLike) -> Optional[TransactionFrame]:
+        frame = self._frames.get(user_id)
+        if frame is None:
+            return None
+        if time.monotonic() - frame.loaded_at > self.ttl or not frame.covers(since):
+            return None
+        self._frames.move_to_end(user_id)
+        return frame
+
+    def put(self, user_id: str, frame: TransactionFrame):
+        self._frames[user_id] = frame
+        self._frames.move_to_end(user_id)
+        while len(self._frames) > self.max_users:
+            self._frames.popitem(last=False)
+
+    def clear(self, user_ids: Optional[List[str]] = None):
+        if user_ids is None:
+            self._frames.clear()
+            return
+        for user_id in user_ids:
+            self._frames.pop(user_id, None)
+
+
+# Frames loaded in the current frame_scope (None outside one: every load is fresh)
+_frame_scope: contextvars.ContextVar[Optional[TransactionFrameCache]] = contextvars.ContextVar(
+    "transaction_frame_scope", default=None
+)
+
+
+@contextmanager
+def frame_scope():
+    """
+    Share loaded frames between the agents run in the enclosed block (one
+    request, one analysis or one chunk of the scheduled cycle). Frames are
+    dropped when the outermost scope exits, so later reads see new rows.
+    """
+    if _frame_scope.get() is not None:
+        yield
+        return
+    token = _frame_scope.set(TransactionFrameCache(ttl=float(os.getenv('TRANSACTION_FRAME_TTL', FRAME_TTL_SECONDS))))
+    try:
+        yield
+    finally:
+        _frame_scope.reset(token)
+
+
+async def load_frame(user_id: str, since: DateLike) -> TransactionFrame:
+    """
+    Transaction frame for a user covering at least `since` until now:
+    from the current frame_scope, else from rows primed by the batch loader,
+    else from one keyset-paged query over all transaction types. A failed
+    query raises and nothing is cached.
+    """
+    frame_cache = _frame_scope.get()
+    frame = frame_cache.get(user_id, since) if frame_cache is not None else None
+    if frame is not None:
+        return frame
+
+    if not isinstance(since, datetime):
+        since = datetime.combine(since, datetime.min.time())
+    since = since.replace(tzinfo=None)
+    days = max(FRAME_DAYS, (datetime.now() - since).days + 1)
+    window_start = datetime.now() - timedelta(days=days)
+
+    rows = prefetch_cache.get(user_id, 'transactions', days)
+    if rows is None:
+        async with httpx.AsyncClient() as client:
+            rows = await batch_loader.fetch_keyset(
+                client, 'transactions', [user_id], '*', transaction_window_filter(window_start)
+            )
+
+    frame = TransactionFrame.from_rows(rows, since=window_start)
+    if frame_cache is not None:
+        frame_cache.put(user_id, frame)
+    return frame
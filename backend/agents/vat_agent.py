@@ -9,6 +9,8 @@ from typing import Dict, Any, List, Optional
 import httpx
 from dotenv import load_dotenv
 
+from transaction_frame import TransactionFrame, load_frame
+
 load_dotenv()
 
 class VATAgent:
@@ -78,11 +80,13 @@ class VATAgent:
             start_date = datetime(int(year), start_month, 1)
             end_date = start_date + timedelta(days=91)
             
+            frame = await load_frame(user_id, start_date)
+            
             # Get sales (output VAT)
-            sales_data = await self._get_sales(user_id, start_date, end_date)
+            sales_data = self._get_sales(frame, start_date, end_date)
             
             # Get purchases (input VAT)
-            purchases_data = await self._get_purchases(user_id, start_date, end_date)
+            purchases_data = self._get_purchases(frame, start_date, end_date)
             
             # Calculate output VAT (what you collected)
             output_vat = sales_data['total_vat']
@@ -174,7 +178,8 @@ class VATAgent:
             # Get last 12 months sales
             end_date = datetime.now()
             start_date = end_date - timedelta(days=365)
-            sales_data = await self._get_sales(user_id, start_date, end_date)
+            frame = await load_frame(user_id, start_date)
+            sales_data = self._get_sales(frame, start_date, end_date)
             
             annual_revenue = sales_data['total_amount']
             
@@ -242,13 +247,15 @@ class VATAgent:
         try:
             summaries = []
             now = datetime.now()
+            first_month = datetime(now.year, now.month, 1)
+            frame = await load_frame(user_id, first_month - timedelta(days=30 * (months - 1)))
             
             for i in range(months):
-                month_start = datetime(now.year, now.month, 1) - timedelta(days=30 * i)
+                month_start = first_month - timedelta(days=30 * i)
                 month_end = month_start + timedelta(days=30)
                 
-                sales = await self._get_sales(user_id, month_start, month_end)
-                purchases = await self._get_purchases(user_id, month_start, month_end)
+                sales = self._get_sales(frame, month_start, month_end)
+                purchases = self._get_purchases(frame, month_start, month_end)
                 
                 net_vat = sales['total_vat'] - purchases['total_vat']
                 
@@ -370,63 +377,28 @@ class VATAgent:
                 return data[0] if data else {}
         return {}
 
-    async def _get_sales(self, user_id: str, start_date: datetime, end_date: datetime) -> Dict:
-        """Fetch sales data"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.sale',
-                    'date': f'gte.{start_date.isoformat()}',
-                    'date': f'lt.{end_date.isoformat()}',
-                    'select': '*'
-                }
-            )
-            if response.status_code == 200:
-                transactions = response.json()
-                
-                standard = sum(t.get('amount_aed', 0) for t in transactions if t.get('vat_category') != 'zero_rated' and t.get('vat_category') != 'exempt')
-                zero_rated = sum(t.get('amount_aed', 0) for t in transactions if t.get('vat_category') == 'zero_rated')
-                exempt = sum(t.get('amount_aed', 0) for t in transactions if t.get('vat_category') == 'exempt')
-                
-                return {
-                    'total_amount': standard + zero_rated + exempt,
-                    'standard_rated': standard,
-                    'zero_rated': zero_rated,
-                    'exempt': exempt,
-                    'total_vat': sum(t.get('vat_amount_aed', 0) for t in transactions)
-                }
-        return {'total_amount': 0, 'standard_rated': 0, 'zero_rated': 0, 'exempt': 0, 'total_vat': 0}
+    def _get_sales(self, frame: TransactionFrame, start_date: datetime, end_date: datetime) -> Dict:
+        """Sales in [start_date, end_date) by VAT category"""
+        sales = frame.mask('sale', start_date, end_date)
+        zero_rated = frame.sum('amount_aed', sales & frame.is_in('vat_category', 'zero_rated'))
+        exempt = frame.sum('amount_aed', sales & frame.is_in('vat_category', 'exempt'))
+        total = frame.sum('amount_aed', sales)
+        
+        return {
+            'total_amount': total,
+            'standard_rated': total - zero_rated - exempt,
+            'zero_rated': zero_rated,
+            'exempt': exempt,
+            'total_vat': frame.sum('vat_amount', sales)
+        }
 
-    async def _get_purchases(self, user_id: str, start_date: datetime, end_date: datetime) -> Dict:
-        """Fetch purchase data"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/transactions",
-                headers={
-                    'apikey': self.supabase_key,
-                    'Authorization': f'Bearer {self.supabase_key}'
-                },
-                params={
-                    'user_id': f'eq.{user_id}',
-                    'transaction_type': 'eq.expense',
-                    'date': f'gte.{start_date.isoformat()}',
-                    'date': f'lt.{end_date.isoformat()}',
-                    'select': '*'
-                }
-            )
-            if response.status_code == 200:
-                transactions = response.json()
-                return {
-                    'total_amount': sum(t.get('amount_aed', 0) for t in transactions),
-                    'total_vat': sum(t.get('vat_amount_aed', 0) for t in transactions)
-                }
-        return {'total_amount': 0, 'total_vat': 0}
+    def _get_purchases(self, frame: TransactionFrame, start_date: datetime, end_date: datetime) -> Dict:
+        """Purchase expenses in [start_date, end_date)"""
+        purchases = frame.mask('expense', start_date, end_date)
+        return {
+            'total_amount': frame.sum('amount_aed', purchases),
+            'total_vat': frame.sum('vat_amount', purchases)
+        }
 
 
 # Singleton instance
@@ -13,6 +13,9 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from autogen_runtime import run_autogen_mcp_task
+from llm_gateway import GatewayOverloaded
+from llm_cache import digest_payload
+from financial_context import build_financial_context, render_context
 
 
 class VolatilityForecasterAgent:
@@ -63,7 +66,7 @@ Your task is to predict 30-day income scenarios and calculate volatility metrics
 ```
 
 **What you do:**
-1. Read income_patterns and transactions data
+1. Read the DATA CONTEXT block in the task (precomputed daily/weekly income statistics)
 2. Analyze historical volatility patterns
 3. Calculate 3 scenarios: pessimistic, realistic, optimistic
 4. Determine volatility_score (0-1) and category
@@ -140,11 +143,17 @@ Store in income_forecasts table with fields:
         print(f"[Volatility Agent] Starting analysis for user {user_id}")
 
         try:
+            context = await build_financial_context(user_id, days=90)
+
             prompt = f"""Create 30-day income forecast for user {user_id}.
 
+DATA CONTEXT (income_cv = daily income coefficient of variation;
+weekly_income_p10_p50_p90 = spread of weekly income):
+{render_context(context)}
+
 Steps:
-1. Read income_patterns and transactions for user {user_id}
-2. Calculate historical volatility
+1. Read the income statistics in the data context
+2. Derive historical volatility from income_cv and the weekly spread
 3. Create three scenarios (pessimistic, realistic, optimistic)
 4. Calculate volatility_index and forecast_confidence
 5. Write detailed reasoning for your forecast
@@ -160,7 +169,8 @@ Please execute this analysis and report your forecasts."""
                 system_prompt=self.system_prompt,
                 task=prompt,
                 user_id=user_id,
-                use_azure=True
+                use_azure=True,
+                data_digest=digest_payload(context)
             )
 
             print(f"[Volatility Agent] Analysis complete for user {user_id}")
@@ -173,6 +183,9 @@ Please execute this analysis and report your forecasts."""
                 "timestamp": datetime.now().isoformat()
             }
 
+        except GatewayOverloaded:
+            raise
+
         except Exception as e:
             print(f"[Volatility Agent] Error analyzing user {user_id}: {str(e)}")
             return {
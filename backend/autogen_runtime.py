@@ -1,10 +1,18 @@
 import os
 import sys
 import json
+import random
 import requests
 import asyncio
+import time
+import httpx
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator, Awaitable
 from dotenv import load_dotenv
 
 # Fix Windows console encoding for Unicode characters
@@ -15,10 +23,65 @@ if sys.platform == 'win32':
 # Load environment variables
 load_dotenv()
 
-# Rate limiting
-import time
-last_call_time = 0
-RATE_LIMIT_DELAY = 60  # 1 minute between calls
+# Rate limiting (per-deployment RPM/TPM token buckets)
+from llm_rate_limiter import get_rate_limiter, estimate_request_tokens, parse_retry_after
+
+# Response cache (content-addressed, memory LRU + SQLite)
+from llm_cache import response_cache, make_cache_key, digest_payload
+
+# Usage/latency metrics (exported via /metrics)
+import llm_metrics
+
+# Tolerant JSON extraction + per-agent schema validation
+from agent_output import parse_agent_output, extract_json_object
+
+# Static-prefix message layout + per-agent prompt token ceilings
+from prompt_budget import budgeter, build_messages
+
+# Per-agent deployment tier and output budget
+from model_router import router as model_router, RouteDecision
+
+# Global LLM concurrency limit with priorities (in-process or shared via socket)
+from llm_gateway import gateway as llm_gateway, GatewayOverloaded, PRIORITIES
+
+# Hedged requests to a secondary deployment after a p95-derived deadline
+from llm_hedging import policy as hedge_policy, hedged_call
+
+# Queue-based structured logging with per-run correlation IDs
+from structured_log import get_logger, correlation, new_run_id
+
+log = get_logger("llm")
+# Full prompts and responses; sampled per run (LOG_SAMPLE_RATES)
+payload_log = get_logger("payload")
+db_log = get_logger("db")
+
+# Azure OpenAI HTTP transport
+HTTP_CONNECT_TIMEOUT = float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("AZURE_OPENAI_READ_TIMEOUT", "180"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = 60
+MAX_LLM_RETRIES = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Fused mode: one request answers for several agents, one JSON section each
+FUSED_AGENT_NAME = "fused_agent"
+FUSED_SECTIONS = {
+    "pattern_agent": "income_patterns",
+    "volatility_agent": "income_forecast",
+    "budget_agent": "budgets",
+    "risk_agent": "risk_assessment",
+    "cashflow_agent": "cashflow_status",
+}
+# Agents whose own answer is the section object itself rather than {key: section}
+UNWRAPPED_SECTIONS = {"cashflow_agent"}
+
+
+def parse_agent_json(json_output: Optional[str]) -> Optional[Any]:
+    """First JSON object in an agent's answer, or None if there isn't one"""
+    return extract_json_object(json_output)
+
 
 # Helper function to write structured data to database
 async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: str):
@@ -28,19 +91,28 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
     from datetime import datetime, timedelta
     
     try:
-        # Clean up the JSON output - AutoGen sometimes returns markdown code blocks
-        cleaned_output = json_output.strip()
-        if cleaned_output.startswith("```json"):
-            cleaned_output = cleaned_output[7:]  # Remove ```json
-        if cleaned_output.startswith("```"):
-            cleaned_output = cleaned_output[3:]   # Remove ```
-        if cleaned_output.endswith("```"):
-            cleaned_output = cleaned_output[:-3]  # Remove trailing ```
-        cleaned_output = cleaned_output.strip()
+        db_log.debug("Parsing JSON output", extra={"output": json_output})
         
-        print(f"[{agent_name}] Parsing JSON output: {cleaned_output[:200]}...")
+        # Extract the first JSON object (ignoring fences/prose) and validate it
+        parsed = parse_agent_output(agent_name, json_output)
+        if not parsed.ok:
+            db_log.warning(f"Output rejected at {parsed.stage}: {parsed.describe()}", extra={"output": json_output})
+            llm_metrics.record_invalid_output(agent_name, parsed.stage)
+            return False
+        data = parsed.data
         
-        data = json.loads(cleaned_output)
+        # Fused response: dispatch each section under its own agent name
+        if agent_name == FUSED_AGENT_NAME:
+            all_written = True
+            for section_agent, key in FUSED_SECTIONS.items():
+                if data.get(key) is None:
+                    db_log.info(f"Section '{key}' missing, skipping {section_agent}")
+                    all_written = False
+                    continue
+                section = data[key] if section_agent in UNWRAPPED_SECTIONS else {key: data[key]}
+                written = await write_agent_output_to_db(user_id, section_agent, json.dumps(section))
+                all_written = all_written and written
+            return all_written
         
         # Write to budgets table if budget agent
         if agent_name == "budget_agent" and "budgets" in data:
@@ -60,9 +132,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=budget
                 )
                 if response.status_code == 201:
-                    print(f"[Budget Agent] Created budget: {budget['budget_type']}")
+                    db_log.info(f"Created budget: {budget['budget_type']}")
                 else:
-                    print(f"[Budget Agent] Error creating budget: {response.text}")
+                    db_log.warning(f"Error creating budget: {response.text}")
         
         # Write to recommendations table if recommendation agent
         elif agent_name == "recommendation_agent" and "recommendations" in data:
@@ -87,9 +159,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=rec
                 )
                 if response.status_code == 201:
-                    print(f"[Recommendation Agent] Created recommendation: {rec['title']}")
+                    db_log.info(f"Created recommendation: {rec['title']}")
                 else:
-                    print(f"[Recommendation Agent] Error creating recommendation: {response.text}")
+                    db_log.warning(f"Error creating recommendation: {response.text}")
         
         # Write to income_patterns table if pattern agent
         elif agent_name == "pattern_agent" and "income_patterns" in data:
@@ -110,9 +182,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                 json=pattern
             )
             if response.status_code == 201:
-                print(f"[Pattern Agent] Created income pattern: {pattern['pattern_type']}")
+                db_log.info(f"Created income pattern: {pattern.get('pattern_type', 'weekly')}")
             else:
-                print(f"[Pattern Agent] Error creating income pattern: {response.text}")
+                db_log.warning(f"Error creating income pattern: {response.text}")
         
         # Write to risk_assessments table if risk agent
         elif agent_name == "risk_agent" and "risk_assessment" in data:
@@ -132,9 +204,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                 json=assessment
             )
             if response.status_code == 201:
-                print(f"[Risk Agent] Created risk assessment: {assessment['overall_risk_level']}")
+                db_log.info(f"Created risk assessment: {assessment['overall_risk_level']}")
             else:
-                print(f"[Risk Agent] Error creating risk assessment: {response.text}")
+                db_log.warning(f"Error creating risk assessment: {response.text}")
         
         # Write to tax_records table if tax agent
         elif agent_name == "tax_agent" and "tax_record" in data:
@@ -153,9 +225,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                 json=tax_record
             )
             if response.status_code == 201:
-                print(f"[Tax Agent] Created tax record: {tax_record['financial_year']}")
+                db_log.info(f"Created tax record: {tax_record['financial_year']}")
             else:
-                print(f"[Tax Agent] Error creating tax record: {response.text}")
+                db_log.warning(f"Error creating tax record: {response.text}")
         
         # Write to income_forecasts table if volatility agent
         elif agent_name == "volatility_agent" and "income_forecast" in data:
@@ -175,9 +247,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                 json=forecast
             )
             if response.status_code == 201:
-                print(f"[Volatility Agent] Created income forecast: {forecast['volatility_category']}")
+                db_log.info(f"Created income forecast: {forecast['volatility_category']}")
             else:
-                print(f"[Volatility Agent] Error creating income forecast: {response.text}")
+                db_log.warning(f"Error creating income forecast: {response.text}")
         
         # Write to financial_health table if financial agent
         elif agent_name == "financial_agent" and "financial_health" in data:
@@ -197,9 +269,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                 json=health
             )
             if response.status_code == 201:
-                print(f"[Financial Agent] Created financial health: {health['health_category']}")
+                db_log.info(f"Created financial health: {health['health_category']}")
             else:
-                print(f"[Financial Agent] Error creating financial health: {response.text}")
+                db_log.warning(f"Error creating financial health: {response.text}")
         
         # Write to executed_actions table if action agent
         elif agent_name == "action_agent" and "action_plan" in data:
@@ -230,9 +302,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=action_data
                 )
                 if response.status_code == 201:
-                    print(f"[Action Agent] Created executed action: {action_data['action_description']}")
+                    db_log.info(f"Created executed action: {action_data['action_description']}")
                 else:
-                    print(f"[Action Agent] Error creating executed action: {response.text}")
+                    db_log.warning(f"Error creating executed action: {response.text}")
 
         # Write to savings_goals table if savings agent
         elif agent_name == "savings_investment_agent" and "savings_plan" in data:
@@ -265,9 +337,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=savings_goal
                 )
                 if response.status_code == 201:
-                    print(f"[Savings Agent] Created emergency fund goal")
+                    db_log.info(f"Created emergency fund goal")
                 else:
-                    print(f"[Savings Agent] Error: {response.text}")
+                    db_log.warning(f"Error: {response.text}")
 
             # Save investment recommendations
             for inv in plan.get("investment_recommendations", []):
@@ -294,7 +366,7 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=inv_rec
                 )
                 if response.status_code == 201:
-                    print(f"[Savings Agent] Created investment recommendation: {inv_rec['investment_type']}")
+                    db_log.info(f"Created investment recommendation: {inv_rec['investment_type']}")
 
         # Write to bills table if bill payment agent
         elif agent_name == "bill_payment_agent" and "bill_analysis" in data:
@@ -326,9 +398,9 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=bill_data
                 )
                 if response.status_code == 201:
-                    print(f"[Bill Agent] Created bill: {bill_data['bill_name']}")
+                    db_log.info(f"Created bill: {bill_data['bill_name']}")
                 else:
-                    print(f"[Bill Agent] Error: {response.text}")
+                    db_log.warning(f"Error: {response.text}")
 
         # Write to financial_goals table if goals agent
         elif agent_name == "goals_agent" and "goals_plan" in data:
@@ -364,23 +436,19 @@ async def write_agent_output_to_db(user_id: str, agent_name: str, json_output: s
                     json=goal_data
                 )
                 if response.status_code == 201:
-                    print(f"[Goals Agent] Created goal: {goal_data['goal_name']}")
+                    db_log.info(f"Created goal: {goal_data['goal_name']}")
                 else:
-                    print(f"[Goals Agent] Error: {response.text}")
+                    db_log.warning(f"Error: {response.text}")
 
         return True
         
     except json.JSONDecodeError as e:
-        print(f"[{agent_name}] JSON parsing error: {e}")
-        print(f"[{agent_name}] Raw output received: {repr(json_output[:500])}")
+        db_log.warning(f"JSON parsing error: {e}", extra={"output": json_output})
         return False
     except Exception as e:
-        print(f"[{agent_name}] Database write error: {e}")
+        db_log.warning(f"Database write error: {e}")
         return False
 
-from autogen_agentchat.agents import AssistantAgent
-from autogen_agentchat.messages import TextMessage
-from autogen_core import CancellationToken
 from autogen_core.models import ModelInfo
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from autogen_core.tools import Tool
@@ -468,6 +536,12 @@ class AzureFoundryClient:
         pass
 
 
+# Filter values already carrying one of these prefixes are passed through as-is
+POSTGREST_OPERATORS = {"eq", "neq", "gt", "gte", "lt", "lte", "like", "ilike", "in", "is", "not"}
+# Query parameters that are not column filters
+POSTGREST_QUERY_PARAMS = {"select", "order", "limit", "offset"}
+
+
 def postgrestRequest(table: str, method: str = "GET", data: Optional[Dict] = None, filters: Optional[Dict] = None) -> str:
     """
     Execute database queries on Supabase using REST API
@@ -495,7 +569,11 @@ def postgrestRequest(table: str, method: str = "GET", data: Optional[Dict] = Non
             if filters:
                 filter_params = []
                 for key, value in filters.items():
-                    if isinstance(value, str):
+                    if key in POSTGREST_QUERY_PARAMS or (
+                        isinstance(value, str) and value.split(".", 1)[0] in POSTGREST_OPERATORS
+                    ):
+                        filter_params.append(f"{key}={value}")
+                    elif isinstance(value, str):
                         filter_params.append(f"{key}=eq.{value}")
                     else:
                         filter_params.append(f"{key}={value}")
@@ -633,12 +711,19 @@ def create_openrouter_model_client(model: Optional[str] = None) -> OpenAIChatCom
 class AzureOpenAIClient:
     """Custom Azure OpenAI client that works with AutoGen"""
     
-    def __init__(self, api_key: str, endpoint: str, deployment: str, api_version: str):
+    def __init__(self, api_key: str, endpoint: str, deployment: str, api_version: str,
+                 send_agent_header: bool = False):
         self.api_key = api_key
         self.endpoint = endpoint
         self.deployment = deployment
         self.api_version = api_version
+        # The local stub picks its canned answer from the x-agent-name header
+        self.send_agent_header = send_agent_header
         self.base_url = f"{endpoint}/openai/deployments/{deployment}"
+        self.rate_limiter = get_rate_limiter(deployment)
+        # Pooled keep-alive connection, created lazily on the running event loop
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop = None
         # Add model_info attribute for AutoGen compatibility
         self.model_info = {
             "function_calling": True,
@@ -648,25 +733,258 @@ class AzureOpenAIClient:
             "family": "openai"
         }
     
-    async def create(self, messages, **kwargs):
-        """Create chat completion"""
-        import requests
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, recreating it if the event loop changed"""
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http.is_closed or self._http_loop is not loop:
+            self._http = httpx.AsyncClient(
+                headers={
+                    "api-key": self.api_key,
+                    "Content-Type": "application/json"
+                },
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+                ),
+                timeout=httpx.Timeout(
+                    connect=HTTP_CONNECT_TIMEOUT,
+                    read=HTTP_READ_TIMEOUT,
+                    write=HTTP_CONNECT_TIMEOUT,
+                    pool=HTTP_READ_TIMEOUT
+                ),
+            )
+            self._http_loop = loop
+        return self._http
+    
+    @asynccontextmanager
+    async def _post_with_retry(self, data: Dict[str, Any], estimated_tokens: int,
+                               stream: bool = False) -> AsyncIterator[httpx.Response]:
+        """
+        POST a completion request, retrying 429/5xx and transport errors
+        with full-jitter exponential backoff (Retry-After wins when larger).
         
-        # Rate limiting - wait 1 minute between calls
-        global last_call_time
-        current_time = time.time()
-        if current_time - last_call_time < RATE_LIMIT_DELAY:
-            wait_time = RATE_LIMIT_DELAY - (current_time - last_call_time)
-            print(f"[Azure Client] Rate limiting: waiting {wait_time:.1f} seconds...")
-            await asyncio.sleep(wait_time)
+        A gateway slot is held only while a request is in flight (and while
+        the caller reads the final response), never during rate-limiter
+        waits or backoff sleeps. With stream=True the yielded response body
+        is unread; the caller must close it.
+        """
+        url = f"{self.base_url}/chat/completions"
+        params = {"api-version": self.api_version}
         
-        last_call_time = time.time()
+        for attempt in range(MAX_LLM_RETRIES + 1):
+            waited = await self.rate_limiter.acquire(estimated_tokens)
+            if waited > 1:
+                log.info("Rate limiting: waited %.1fs for quota", waited, extra={"deployment": self.deployment})
+            
+            run = _current_run.get()
+            agent = run.agent_name if run is not None else "unknown"
+            async with self._gateway_slot():
+                sent_at = time.monotonic()
+                try:
+                    client = self._get_http_client()
+                    headers = {"x-agent-name": agent} if self.send_agent_header else None
+                    request = client.build_request("POST", url, params=params, json=data, headers=headers)
+                    response = await client.send(request, stream=stream)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    self._record_attempt(run, agent, type(e).__name__, waited, time.monotonic() - sent_at, attempt)
+                    if attempt == MAX_LLM_RETRIES:
+                        raise
+                    delay = _backoff_delay(attempt)
+                    log.warning("%s, retrying in %.1fs", type(e).__name__, delay, extra={"deployment": self.deployment})
+                else:
+                    self.rate_limiter.update_from_headers(response.headers)
+                    self._record_attempt(run, agent, str(response.status_code), waited,
+                                         time.monotonic() - sent_at, attempt)
+                    
+                    if response.status_code not in RETRYABLE_STATUS_CODES or attempt == MAX_LLM_RETRIES:
+                        yield response
+                        return
+                    
+                    if stream:
+                        await response.aclose()
+                    delay = max(parse_retry_after(response.headers) or 0.0, _backoff_delay(attempt))
+                    log.warning("HTTP %s, retrying in %.1fs", response.status_code, delay,
+                                extra={"deployment": self.deployment})
+            # Back off without holding a slot other requests could use
+            await asyncio.sleep(delay)
+    
+    def _record_attempt(self, run: Optional["RunStats"], agent: str, status: str,
+                        queue_seconds: float, network_seconds: float, attempt: int):
+        """Account one HTTP attempt to the current run and the metrics registry"""
+        llm_metrics.record_request(agent, self.deployment, status, queue_seconds, network_seconds, attempt > 0)
+        if status == "200":
+            model_router.record_latency(agent, self.deployment, network_seconds)
+        if run is not None:
+            run.llm_requests += 1
+            run.retries += 1 if attempt > 0 else 0
+            run.queue_seconds += queue_seconds
+            run.network_seconds += network_seconds
+    
+    @asynccontextmanager
+    async def _gateway_slot(self):
+        """Hold an LLM gateway slot (at the current run's priority) for one HTTP attempt"""
+        run = _current_run.get()
+        agent = run.agent_name if run is not None else "unknown"
+        async with llm_gateway.slot(_llm_priority.get(), agent) as waited:
+            if run is not None:
+                run.gateway_wait_seconds += waited
+            yield
+    
+    async def complete(self, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """
+        Send OpenAI-format messages and return the raw response JSON.
+        Pass `tools` (OpenAI function schemas) to let the model request tool calls.
+        Raises on a non-200 response.
         
-        headers = {
-            "api-key": self.api_key,
-            "Content-Type": "application/json"
+        With LLM_HEDGE_DEPLOYMENT set, a request still running after this
+        deployment's p95-derived deadline is duplicated to that deployment;
+        the first answer wins and the other request is cancelled.
+        """
+        hedge_policy.note_request()
+        secondary = hedge_policy.secondary_for(self.deployment)
+        if secondary is None:
+            return await self._complete_timed(messages, **kwargs)
+        
+        hedge_client = create_azure_openai_model_client(model=secondary)
+        run = _current_run.get()
+        hedged = False
+        
+        def may_hedge() -> bool:
+            nonlocal hedged
+            if not hedge_policy.try_hedge():
+                return False
+            log.info("%s slow, hedging to %s", self.deployment, secondary)
+            hedged = True
+            return True
+        
+        result, winner = await hedged_call(
+            lambda: self._complete_timed(messages, **kwargs),
+            lambda: hedge_client._complete_timed(messages, **kwargs),
+            deadline=hedge_policy.deadline(self.deployment),
+            may_hedge=may_hedge
+        )
+        if hedged:
+            hedge_policy.record_outcome(self.deployment, winner)
+            if run is not None:
+                run.hedges += 1
+                run.hedge_wins += 1 if winner == "secondary" else 0
+        return result
+    
+    async def _complete_timed(self, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """One un-hedged completion, feeding its latency to the hedge deadline"""
+        started = time.monotonic()
+        try:
+            result = await self._complete_once(messages, **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedge race: the elapsed time is still a (lower-bound) sample
+            hedge_policy.tracker.record(self.deployment, time.monotonic() - started)
+            raise
+        hedge_policy.tracker.record(self.deployment, time.monotonic() - started)
+        return result
+    
+    async def _complete_once(self, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        data, estimated_tokens = self._build_request(messages, **kwargs)
+        async with self._post_with_retry(data, estimated_tokens) as response:
+            if response.status_code != 200:
+                raise Exception(f"Azure OpenAI API error: {response.status_code} - {response.text}")
+        
+        result = response.json()
+        payload_log.debug("Raw response", extra={"response": result})
+        prompt_tokens = (result.get('usage') or {}).get('prompt_tokens')
+        if prompt_tokens is not None:
+            self.rate_limiter.reconcile(estimated_tokens, prompt_tokens + data["max_tokens"])
+        return result
+    
+    async def complete_stream(self, messages: List[Dict[str, Any]], **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of complete(). Parses server-sent chunks as they
+        arrive and yields:
+        - {"type": "delta", "text": ...} for each piece of answer text
+        - {"type": "completion", "result": ...} once, shaped like complete()'s
+          response (assembled content, tool_calls and usage)
+        """
+        data, estimated_tokens = self._build_request(messages, **kwargs)
+        data["stream"] = True
+        data["stream_options"] = {"include_usage": True}
+        
+        async with self._post_with_retry(data, estimated_tokens, stream=True) as response:
+            try:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    raise Exception(f"Azure OpenAI API error: {response.status_code} - {body}")
+            
+                content_parts: List[str] = []
+                tool_calls: Dict[int, Dict[str, Any]] = {}
+                usage: Dict[str, Any] = {}
+                finish_reason = None
+            
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    # Azure sends prompt_filter_results chunks with no choices
+                    for choice in chunk.get("choices") or []:
+                        finish_reason = choice.get("finish_reason") or finish_reason
+                        delta = choice.get("delta") or {}
+                        text = delta.get("content")
+                        if text:
+                            content_parts.append(text)
+                            yield {"type": "delta", "text": text}
+                        for call in delta.get("tool_calls") or []:
+                            slot = tool_calls.setdefault(call.get("index", 0), {
+                                "id": None,
+                                "type": "function",
+                                "function": {"name": "", "arguments": ""}
+                            })
+                            if call.get("id"):
+                                slot["id"] = call["id"]
+                            function = call.get("function") or {}
+                            slot["function"]["name"] += function.get("name") or ""
+                            slot["function"]["arguments"] += function.get("arguments") or ""
+            finally:
+                await response.aclose()
+        
+        prompt_tokens = usage.get('prompt_tokens')
+        if prompt_tokens is not None:
+            self.rate_limiter.reconcile(estimated_tokens, prompt_tokens + data["max_tokens"])
+        
+        message = {"role": "assistant", "content": "".join(content_parts) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        yield {
+            "type": "completion",
+            "result": {
+                "choices": [{"message": message, "finish_reason": finish_reason}],
+                "usage": usage
+            }
+        }
+    
+    def _build_request(self, messages: List[Dict[str, Any]], **kwargs):
+        """Request body plus the token reservation it needs"""
+        data = {
+            "messages": messages,
+            "max_tokens": kwargs.get('max_tokens', 8192),  # Increased to 8192 tokens
+            "temperature": kwargs.get('temperature', 0.7)
         }
+        tools = kwargs.get('tools')
+        if tools:
+            data["tools"] = tools
+            data["tool_choice"] = kwargs.get('tool_choice', "auto")
         
+        # Reserve quota for prompt + max_tokens (what Azure charges on admission)
+        estimated_tokens = estimate_request_tokens(messages, data["max_tokens"])
+        if tools:
+            estimated_tokens += len(json.dumps(tools)) // 4
+        return data, estimated_tokens
+    
+    async def create(self, messages, **kwargs):
+        """Create chat completion"""
         # Convert AutoGen messages to OpenAI format
         openai_messages = []
         for msg in messages:
@@ -690,24 +1008,8 @@ class AzureOpenAIClient:
         if not openai_messages:
             openai_messages = [{"role": "user", "content": "Please analyze the data."}]
         
-        data = {
-            "messages": openai_messages,
-            "max_tokens": kwargs.get('max_tokens', 8192),  # Increased to 8192 tokens
-            "temperature": kwargs.get('temperature', 0.7)
-        }
-        
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions?api-version={self.api_version}",
-                headers=headers,
-                json=data
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Azure OpenAI API error: {response.status_code} - {response.text}")
-            
-            result = response.json()
-            print(f"[Azure Client] Raw response: {str(result)[:500]}...")
+            result = await self.complete(openai_messages, **kwargs)
             
             # Create a proper model result that AutoGen expects
             try:
@@ -727,7 +1029,7 @@ class AzureOpenAIClient:
             message = choice.get('message', {})
             content = message.get('content', '')
             
-            print(f"[Azure Client] Extracted content: {content[:200]}...")
+            payload_log.debug("Extracted content", extra={"response": content})
             
             if content:
                 # Create a proper ChatCompletion object that AutoGen expects
@@ -740,7 +1042,7 @@ class AzureOpenAIClient:
                     usage=result.get('usage', {})
                 )
             else:
-                print(f"[Azure Client] No content in response")
+                log.warning("No content in response")
                 # Return a mock result with empty content
                 return ChatCompletion(
                     choices=[{"message": {"content": "No response generated", "role": "assistant"}}],
@@ -752,25 +1054,526 @@ class AzureOpenAIClient:
                 )
             
         except Exception as e:
-            print(f"[Azure Client] Error: {str(e)}")
-            return None
+            # Surface the failure instead of returning None, which made the
+            # agent silently produce nothing
+            log.error("Completion failed: %s", e)
+            raise
+    
+    async def close(self):
+        """Close the pooled HTTP connection (shared by every caller of this client)"""
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
+        self._http_loop = None
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+# One client (and connection pool) per deployment, shared by all agents
+_azure_clients: Dict[str, AzureOpenAIClient] = {}
+
+
+def llm_backend_configured() -> bool:
+    """True when either Azure credentials or the local stub backend are configured"""
+    return os.getenv("LLM_BACKEND", "azure").lower() == "stub" or bool(os.getenv("AZURE_OPENAI_API_KEY"))
 
 
 def create_azure_openai_model_client(model: Optional[str] = None) -> AzureOpenAIClient:
-    """Create Azure OpenAI model client that works with AutoGen"""
+    """
+    Create Azure OpenAI model client that works with AutoGen.
+    `model` selects a deployment other than AZURE_OPENAI_DEPLOYMENT.
+    LLM_BACKEND=stub points it at llm_stub_server.py (LLM_STUB_URL) instead.
+    """
     api_key = os.getenv("AZURE_OPENAI_API_KEY")
     endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
     api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
-    deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4.1")
+    deployment = model or os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4.1")
+    
+    stub = os.getenv("LLM_BACKEND", "azure").lower() == "stub"
+    if stub:
+        api_key = "stub"
+        endpoint = os.getenv("LLM_STUB_URL", "http://127.0.0.1:8765")
     
     if not api_key or not endpoint:
         raise RuntimeError("AZURE_OPENAI_API_KEY and AZURE_OPENAI_API_ENDPOINT environment variables must be set")
     
-    print(f"[Azure] Using endpoint: {endpoint}")
-    print(f"[Azure] Using deployment: {deployment}")
-    print(f"[Azure] Using API version: {api_version}")
+    cache_key = f"{endpoint}|{deployment}|{api_version}"
+    client = _azure_clients.get(cache_key)
+    if client is None:
+        log.info("Created model client", extra={"endpoint": endpoint, "deployment": deployment,
+                                                "api_version": api_version})
+        client = AzureOpenAIClient(api_key, endpoint, deployment, api_version, send_agent_header=stub)
+        _azure_clients[cache_key] = client
     
-    return AzureOpenAIClient(api_key, endpoint, deployment, api_version)
+    return client
+
+
+async def close_model_clients():
+    """Close every pooled model client (call on application shutdown)"""
+    for client in list(_azure_clients.values()):
+        await client.close()
+    _azure_clients.clear()
+
+
+# Agents whose JSON output is persisted by write_agent_output_to_db
+DB_WRITING_AGENTS = [
+    "budget_agent", "recommendation_agent", "pattern_agent", "risk_agent", "tax_agent",
+    "volatility_agent", "financial_agent", "action_agent", "savings_investment_agent",
+    "bill_payment_agent", "goals_agent", FUSED_AGENT_NAME
+]
+
+# Tables the agents read, with their primary key and the column that changes
+# when a row changes. Tables without such a column are fingerprinted by the
+# contents of their rows (they hold a handful of rows per user).
+DIGEST_TABLES = {
+    "transactions": {"key": "transaction_id", "changed": "updated_at"},
+    "user_profiles": {"key": "profile_id"},
+    "bills": {"key": "id"},
+    "financial_goals": {"key": "id"},
+    "savings_goals": {"key": "id"},
+    "income_patterns": {"key": "id"},
+}
+
+# Digests already computed in the current data_digest_scope, by user
+_digest_scope: contextvars.ContextVar[Optional[Dict[str, asyncio.Task]]] = contextvars.ContextVar(
+    "data_digest_scope", default=None
+)
+
+
+async def _table_fingerprint(client: httpx.AsyncClient, user_id: str, table: str,
+                             columns: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Row count plus the latest change (or a digest of the rows); None if unreadable"""
+    changed = columns.get("changed")
+    params = {"user_id": f"eq.{user_id}"}
+    if changed:
+        params.update({"select": changed, "order": f"{changed}.desc.nullslast", "limit": 1})
+    else:
+        params.update({"select": "*", "order": f"{columns['key']}.asc"})
+    response = await client.get(
+        f"{SUPABASE_URL}/rest/v1/{table}",
+        headers={
+            "apikey": SUPABASE_ANON_KEY,
+            "Authorization": f"Bearer {SUPABASE_ANON_KEY}",
+            "Prefer": "count=exact"
+        },
+        params=params
+    )
+    if response.status_code not in (200, 206):
+        return None
+    rows = response.json()
+    return {
+        "count": response.headers.get("content-range", "").split("/")[-1],
+        "latest": (rows[0].get(changed) if rows else None) if changed else digest_payload(rows)
+    }
+
+
+async def compute_user_data_digest(user_id: str) -> Optional[str]:
+    """
+    Digest of a user's input data: row count and latest change (or row
+    contents) per table, read concurrently.
+    Returns None if any table can't be read, so the caller skips the cache
+    rather than risk serving a stale answer.
+    """
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            fingerprints = await asyncio.gather(*(
+                _table_fingerprint(client, user_id, table, columns)
+                for table, columns in DIGEST_TABLES.items()
+            ))
+    except httpx.HTTPError as e:
+        log.warning("Could not compute data digest for %s: %s", user_id, e)
+        return None
+    if any(f is None for f in fingerprints):
+        return None
+    return digest_payload(dict(zip(DIGEST_TABLES, fingerprints)))
+
+
+@contextmanager
+def data_digest_scope():
+    """
+    Compute each user's data digest once for all agent runs in the enclosed
+    block (one orchestrated analysis) instead of once per agent
+    """
+    token = _digest_scope.set({})
+    try:
+        yield
+    finally:
+        _digest_scope.reset(token)
+
+
+async def user_data_digest(user_id: str) -> Optional[str]:
+    """compute_user_data_digest, shared within the current data_digest_scope"""
+    scope = _digest_scope.get()
+    if scope is None:
+        return await compute_user_data_digest(user_id)
+    if user_id not in scope:
+        scope[user_id] = asyncio.ensure_future(compute_user_data_digest(user_id))
+    return await asyncio.shield(scope[user_id])
+
+
+# Tool-calling loop
+MAX_TOOL_ITERATIONS = int(os.getenv("AGENT_MAX_TOOL_ITERATIONS", "6"))
+MAX_TOOL_RESULT_CHARS = 20000
+RUN_HISTORY_SIZE = 200
+
+# OpenAI function schemas for the Supabase tools. Reads only: agents return
+# their results as JSON and write_agent_output_to_db persists them.
+TOOL_SCHEMAS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "postgrestRequest",
+            "description": "Read rows from a Supabase table through the REST API",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "table": {"type": "string", "description": "Table name, e.g. transactions"},
+                    "method": {"type": "string", "enum": ["GET"]},
+                    "filters": {
+                        "type": "object",
+                        "description": "Column filters. Plain strings mean equality; "
+                                       "PostgREST operators are allowed, e.g. {\"transaction_date\": \"gte.2025-01-01\"}",
+                        "additionalProperties": True
+                    }
+                },
+                "required": ["table"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "sqlToRest",
+            "description": "Run a simple SELECT ... FROM table WHERE column = value query",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "sql": {"type": "string"}
+                },
+                "required": ["sql"]
+            }
+        }
+    }
+]
+
+TOOL_FUNCTIONS = {
+    "postgrestRequest": postgrestRequest,
+    "sqlToRest": sqlToRest,
+}
+
+
+@dataclass
+class RunStats:
+    """Accounting for one run_autogen_mcp_task call"""
+    agent_name: str
+    user_id: str
+    run_id: str = field(default_factory=new_run_id)
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    turns: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    prompt_trimmed_tokens: int = 0
+    tool_results_trimmed: int = 0
+    completion_tokens: int = 0
+    tool_calls: int = 0
+    tool_cache_hits: int = 0
+    tool_errors: int = 0
+    tool_seconds: float = 0.0
+    tool_wall_seconds: float = 0.0
+    llm_seconds: float = 0.0
+    llm_requests: int = 0
+    retries: int = 0
+    queue_seconds: float = 0.0
+    gateway_wait_seconds: float = 0.0
+    hedges: int = 0
+    hedge_wins: int = 0
+    network_seconds: float = 0.0
+    duration_seconds: float = 0.0
+    outcome: str = "success"
+    response_cached: bool = False
+    hit_iteration_cap: bool = False
+    tier: Optional[str] = None
+    deployment: Optional[str] = None
+    max_tokens: Optional[int] = None
+    escalated: bool = False
+    finish_reason: Optional[str] = None
+    answer_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["total_tokens"] = self.total_tokens
+        for key in ("tool_seconds", "tool_wall_seconds", "llm_seconds", "queue_seconds",
+                    "gateway_wait_seconds", "network_seconds", "duration_seconds"):
+            data[key] = round(data[key], 3)
+        return data
+
+
+_run_history: deque = deque(maxlen=RUN_HISTORY_SIZE)
+
+# The run the current task belongs to, so HTTP attempts can be attributed to it
+_current_run: contextvars.ContextVar[Optional[RunStats]] = contextvars.ContextVar("llm_current_run", default=None)
+
+# Gateway priority for LLM requests made from the current context
+_llm_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default="default")
+
+
+@contextmanager
+def llm_priority(priority: str):
+    """Run the enclosed agent calls at a gateway priority (interactive, default or batch)"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority '{priority}'. Available: {', '.join(PRIORITIES)}")
+    token = _llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        _llm_priority.reset(token)
+
+
+async def _finish_run(stats: RunStats, started: float):
+    """Record a finished run in history, the metrics registry and agent_logs"""
+    stats.duration_seconds = time.monotonic() - started
+    _run_history.append(stats)
+    llm_metrics.record_run(stats.agent_name, stats.outcome, stats.duration_seconds,
+                           stats.prompt_tokens, stats.completion_tokens, stats.tool_calls,
+                           cached_prompt_tokens=stats.cached_prompt_tokens)
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.post(
+                f"{SUPABASE_URL}/rest/v1/agent_logs",
+                headers={
+                    "apikey": SUPABASE_ANON_KEY,
+                    "Authorization": f"Bearer {SUPABASE_ANON_KEY}",
+                    "Content-Type": "application/json",
+                    "Prefer": "return=minimal"
+                },
+                json={
+                    "user_id": stats.user_id,
+                    "agent_name": stats.agent_name[:50],
+                    "action": "llm_run",
+                    "status": stats.outcome,
+                    "output": stats.to_dict(),
+                    "details": f"{stats.total_tokens} tokens, {stats.llm_requests} requests, "
+                               f"{stats.duration_seconds:.1f}s"
+                }
+            )
+            if response.status_code >= 300:
+                log.warning("Could not log run metrics: %s %s", response.status_code, response.text[:200])
+    except httpx.HTTPError as e:
+        log.warning("Could not log run metrics: %s", e)
+
+# Set by stream_task_events; when present, model turns are streamed and their
+# text is pushed here as it arrives
+_stream_sink: contextvars.ContextVar[Optional[asyncio.Queue]] = contextvars.ContextVar("llm_stream_sink", default=None)
+
+
+def get_run_stats(limit: int = 50) -> List[Dict[str, Any]]:
+    """Most recent runs, newest first"""
+    return [stats.to_dict() for stats in list(_run_history)[-limit:]][::-1]
+
+
+class ToolRunner:
+    """
+    Executes the tool calls of one run:
+    - All calls from a single model turn run concurrently (worker threads)
+    - Identical calls within the run share one result
+    """
+
+    def __init__(self, stats: RunStats):
+        self.stats = stats
+        self._memo: Dict[str, asyncio.Task] = {}
+
+    async def run_all(self, tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._run(call) for call in tool_calls))
+        self.stats.tool_wall_seconds += time.monotonic() - started
+        return list(results)
+
+    async def _run(self, call: Dict[str, Any]) -> Dict[str, Any]:
+        function = call.get("function") or {}
+        name = function.get("name", "")
+        self.stats.tool_calls += 1
+        try:
+            args = json.loads(function.get("arguments") or "{}")
+        except json.JSONDecodeError as e:
+            args = None
+            content = f"Error: invalid JSON arguments: {e}"
+
+        if args is not None:
+            if name not in TOOL_FUNCTIONS:
+                content = f"Error: unknown tool {name}"
+            elif name == "postgrestRequest" and str(args.get("method", "GET")).upper() != "GET":
+                content = "Error: only GET is allowed; return your results as JSON instead of writing them"
+            else:
+                content = await self._memoized(name, args)
+
+        if content.startswith("Error"):
+            self.stats.tool_errors += 1
+        if len(content) > MAX_TOOL_RESULT_CHARS:
+            content = content[:MAX_TOOL_RESULT_CHARS] + "\n...[truncated, narrow your filters]"
+        return {"role": "tool", "tool_call_id": call.get("id"), "content": content}
+
+    async def _memoized(self, name: str, args: Dict[str, Any]) -> str:
+        key = f"{name}:{json.dumps(args, sort_keys=True, default=str)}"
+        task = self._memo.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._invoke(name, args))
+            self._memo[key] = task
+        else:
+            self.stats.tool_cache_hits += 1
+        return await task
+
+    async def _invoke(self, name: str, args: Dict[str, Any]) -> str:
+        started = time.monotonic()
+        try:
+            return await asyncio.to_thread(TOOL_FUNCTIONS[name], **args)
+        except TypeError as e:
+            return f"Error: bad arguments for {name}: {e}"
+        finally:
+            self.stats.tool_seconds += time.monotonic() - started
+
+
+async def run_tool_loop(model_client: "AzureOpenAIClient", messages: List[Dict[str, Any]],
+                        stats: RunStats, max_tokens: Optional[int] = None) -> Optional[str]:
+    """
+    Alternate model turns and tool execution until the model answers.
+    After MAX_TOOL_ITERATIONS tool rounds the model must answer without tools.
+    """
+    runner = ToolRunner(stats)
+    limits = {"max_tokens": max_tokens} if max_tokens else {}
+    for iteration in range(MAX_TOOL_ITERATIONS + 1):
+        final_turn = iteration == MAX_TOOL_ITERATIONS
+        if final_turn:
+            stats.hit_iteration_cap = True
+
+        started = time.monotonic()
+        tool_choice = "none" if final_turn else "auto"
+        sink = _stream_sink.get()
+        if sink is None:
+            result = await model_client.complete(messages, tools=TOOL_SCHEMAS, tool_choice=tool_choice, **limits)
+        else:
+            result = {}
+            async for event in model_client.complete_stream(messages, tools=TOOL_SCHEMAS, tool_choice=tool_choice,
+                                                            **limits):
+                if event["type"] == "delta":
+                    sink.put_nowait({"event": "delta", "agent": stats.agent_name, "text": event["text"]})
+                else:
+                    result = event["result"]
+        stats.llm_seconds += time.monotonic() - started
+        stats.turns += 1
+        usage = result.get('usage') or {}
+        stats.prompt_tokens += usage.get('prompt_tokens') or 0
+        # Prompt-cache reuse of the static prefix, when the API reports it
+        stats.cached_prompt_tokens += (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        stats.completion_tokens += usage.get('completion_tokens') or 0
+
+        choice = (result.get('choices') or [{}])[0]
+        message = choice.get('message') or {}
+        tool_calls = message.get('tool_calls')
+        if not tool_calls or final_turn:
+            stats.finish_reason = choice.get('finish_reason')
+            stats.answer_tokens = usage.get('completion_tokens') or 0
+            return message.get('content')
+
+        log.info("Turn %d: running %d tool call(s)", stats.turns, len(tool_calls),
+                 extra={"tools": [c.get('function', {}).get('name', '?') for c in tool_calls]})
+        messages.append({"role": "assistant", "content": message.get('content'), "tool_calls": tool_calls})
+        if sink is not None:
+            sink.put_nowait({
+                "event": "tool_calls",
+                "agent": stats.agent_name,
+                "tools": [c.get('function', {}).get('name') for c in tool_calls]
+            })
+        results, trimmed, shrunk = budgeter.fit_tool_results(stats.agent_name, messages,
+                                                             await runner.run_all(tool_calls), TOOL_SCHEMAS)
+        if shrunk:
+            stats.prompt_trimmed_tokens += trimmed
+            stats.tool_results_trimmed += shrunk
+            llm_metrics.record_tool_results_trimmed(stats.agent_name, shrunk, trimmed)
+        messages.extend(results)
+
+    return None
+
+
+async def run_routed(agent_name: str, system_prompt: str, task: str, model_client: "AzureOpenAIClient",
+                     decision: Optional[RouteDecision], stats: RunStats) -> Optional[str]:
+    """
+    Run the tool loop on the routed deployment and feed the outcome back to
+    the router. An answer is valid when it is non-empty and, for agents with
+    an output schema, passes it; a schema failure is retried once on the
+    next larger tier.
+    """
+    max_tokens = decision.max_tokens if decision else None
+    content = await run_tool_loop(model_client, build_messages(system_prompt, task), stats, max_tokens=max_tokens)
+    if decision is None:
+        return content
+
+    has_schema = agent_name in DB_WRITING_AGENTS
+    valid = bool(content) and (not has_schema or parse_agent_output(agent_name, content).ok)
+    model_router.record_result(decision, valid, stats.answer_tokens, truncated=stats.finish_reason == "length")
+    if valid or not has_schema:
+        return content
+
+    bigger = model_router.escalate(decision)
+    if bigger is None:
+        return content
+    log.warning("Answer failed its schema on %s (%s), retrying on %s (%s)",
+                decision.tier, decision.deployment, bigger.tier, bigger.deployment)
+    stats.escalated = True
+    stats.tier, stats.deployment, stats.max_tokens = bigger.tier, bigger.deployment, bigger.max_tokens
+    fallback_client = create_azure_openai_model_client(model=bigger.deployment)
+    retried = await run_tool_loop(fallback_client, build_messages(system_prompt, task), stats,
+                                  max_tokens=bigger.max_tokens)
+    retried_valid = bool(retried) and parse_agent_output(agent_name, retried).ok
+    model_router.record_result(bigger, retried_valid, stats.answer_tokens, truncated=stats.finish_reason == "length")
+    return retried if retried_valid or not content else content
+
+
+async def stream_task_events(task: Awaitable[Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run an awaitable that (directly or via an agent) calls run_autogen_mcp_task,
+    streaming model output while it runs. Yields "delta", "tool_calls" and
+    "cache_hit" events as they happen, then {"event": "done", "result": ...}
+    or {"event": "error", "error": ...}.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    token = _stream_sink.set(queue)
+    try:
+        # The task copies the current context, so it sees the sink
+        runner = asyncio.ensure_future(task)
+    finally:
+        _stream_sink.reset(token)
+
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, runner}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            while not queue.empty():
+                yield queue.get_nowait()
+            break
+
+        if runner.exception() is not None:
+            yield {"event": "error", "error": str(runner.exception())}
+        else:
+            yield {"event": "done", "result": runner.result()}
+    finally:
+        if not runner.done():
+            runner.cancel()
+
+
+def stream_autogen_mcp_task(**kwargs) -> AsyncIterator[Dict[str, Any]]:
+    """Async-iterator form of run_autogen_mcp_task (same keyword arguments)"""
+    return stream_task_events(run_autogen_mcp_task(**kwargs))
 
 
 async def run_autogen_mcp_task(
@@ -784,87 +1587,121 @@ async def run_autogen_mcp_task(
     tool_overrides: Optional[Dict[str, Tool]] = None,
     model: Optional[str] = None,
     use_azure: bool = False,
+    data_digest: Optional[str] = None,
+    use_cache: bool = True,
+    priority: Optional[str] = None,
 ) -> str:
-    """Run AutoGen task with Supabase API tools instead of MCP"""
+    """
+    Run AutoGen task with Supabase API tools instead of MCP
+
+    Responses are cached by hash(deployment, system prompt, task, data digest).
+    Pass `data_digest` when the caller already summarised its input data;
+    otherwise it is derived from the user's rows. A cache hit skips both the
+    LLM call and the database write (the output was persisted when cached).
+    
+    LLM requests go through the gateway at `priority` (default: the
+    surrounding llm_priority() block). GatewayOverloaded propagates so the
+    caller can shed load instead of reporting an analysis error.
+    """
+    if priority is not None:
+        with llm_priority(priority):
+            return await run_autogen_mcp_task(
+                agent_name=agent_name, system_prompt=system_prompt, task=task, user_id=user_id,
+                mcp_config_path=mcp_config_path, mcp_server_name=mcp_server_name,
+                tool_overrides=tool_overrides, model=model, use_azure=use_azure,
+                data_digest=data_digest, use_cache=use_cache
+            )
+    
+    # Every log record of this run carries its correlation ID
+    with correlation(new_run_id(), agent_name) as run_id:
+        return await _run_task(agent_name, system_prompt, task, user_id, model, use_azure,
+                               data_digest, use_cache, run_id)
+
+
+async def _run_task(agent_name: str, system_prompt: str, task: str, user_id: str, model: Optional[str],
+                    use_azure: bool, data_digest: Optional[str], use_cache: bool, run_id: str) -> str:
+    """Body of run_autogen_mcp_task, inside the run's logging correlation"""
+    # Route to a deployment tier unless the caller picked a model
+    decision = model_router.route(agent_name) if model is None else None
     
     # Create model client (Azure OpenAI only)
-    if use_azure and os.getenv("AZURE_OPENAI_API_KEY"):
+    if use_azure and llm_backend_configured():
         try:
-            print("Using Azure OpenAI")
-            model_client = create_azure_openai_model_client(model=model)
+            model_client = create_azure_openai_model_client(model=decision.deployment if decision else model)
         except Exception as e:
-            print(f"Azure OpenAI failed: {str(e)}")
+            log.error("Azure OpenAI client failed to initialize: %s", e)
             raise RuntimeError("Azure OpenAI is required but failed to initialize")
     else:
         raise RuntimeError("Azure OpenAI is required. Please set AZURE_OPENAI_API_KEY and use_azure=True")
     
-    # Create tools as simple functions (AutoGen will handle them)
-    tools = [postgrestRequest, sqlToRest]
+    started = time.monotonic()
+    cache_key = None
+    if use_cache and response_cache is not None:
+        if data_digest is None:
+            data_digest = await user_data_digest(user_id)
+        if data_digest is not None:
+            cache_key = make_cache_key(model_client.deployment, system_prompt, task, data_digest)
+            cached = response_cache.get(cache_key, agent_name)
+            if cached is not None:
+                log.info("LLM cache hit", extra={"user_id": user_id})
+                sink = _stream_sink.get()
+                if sink is not None:
+                    sink.put_nowait({"event": "cache_hit", "agent": agent_name})
+                stats = RunStats(agent_name=agent_name, user_id=user_id, run_id=run_id,
+                                 response_cached=True, outcome="cached")
+                await _finish_run(stats, started)
+                return cached
     
-    # Create agent with tools
-    agent = AssistantAgent(
-        name=agent_name,
-        model_client=model_client,
-        tools=tools,
-        system_message=system_prompt,
-        reflect_on_tool_use=False,
-    )
+    stats = RunStats(agent_name=agent_name, user_id=user_id, run_id=run_id, deployment=model_client.deployment,
+                     tier=decision.tier if decision else None,
+                     max_tokens=decision.max_tokens if decision else None)
+    run_token = _current_run.set(stats)
     
-    # Create a simple conversation and run it
+    # Run the tool-calling conversation
     try:
-        print(f"\n{'*'*80}")
-        print(f"STARTING AGENT: {agent_name.upper()}")
-        print(f"{'*'*80}")
-        print(f"[AutoGen] Running task for {agent_name}")
-        print(f"[AutoGen] Task: {task[:200]}...")
-        print(f"[AutoGen] Full Task:\n{task}")
-        print(f"{'*'*80}")
-        
-        # Create messages for the model
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": task}
-        ]
-        
-        print(f"[AutoGen] Sending messages to Azure OpenAI...")
-        print(f"[AutoGen] System prompt: {system_prompt[:100]}...")
-        
-        # Call the model client directly
-        model_result = await model_client.create(messages)
-        
-        print(f"[AutoGen] Model result type: {type(model_result)}")
-        print(f"[AutoGen] Model result: {str(model_result)[:200]}...")
-        
-        # Extract the response from the model result
-        if hasattr(model_result, 'choices') and model_result.choices:
-            choice = model_result.choices[0]
-            if hasattr(choice, 'message') and choice.message:
-                content = choice.message.content
-                print(f"[AutoGen] Extracted content: {content[:200]}...")
-                print(f"\n{'='*80}")
-                print(f"AGENT {agent_name.upper()} RESPONSE:")
-                print(f"{'='*80}")
-                print(content)
-                print(f"{'='*80}")
-                print(f"END OF {agent_name.upper()} RESPONSE\n")
-                
-                # Write structured output to database if applicable
-                if agent_name in ["budget_agent", "recommendation_agent", "pattern_agent", "risk_agent", "tax_agent", "volatility_agent", "financial_agent", "action_agent", "savings_investment_agent", "bill_payment_agent", "goals_agent"]:
-                    await write_agent_output_to_db(user_id, agent_name, content)
-                
-                return content
+        log.info("Agent run started", extra={"user_id": user_id, "task": task})
+        # Full prompts only for sampled runs
+        payload_log.info("Agent prompt", extra={"system_prompt": system_prompt, "task": task})
         
-        # Fallback extraction methods
-        if hasattr(model_result, 'content'):
-            return str(model_result.content)
-        elif isinstance(model_result, str):
-            return model_result
-        else:
-            print(f"[AutoGen] Could not extract content from result: {type(model_result)}")
+        # Static system prompt first (cacheable prefix), per-user task last,
+        # trimmed to the agent's prompt budget
+        task, budget_report = budgeter.fit(agent_name, system_prompt, task, TOOL_SCHEMAS)
+        stats.prompt_trimmed_tokens = budget_report["trimmed_tokens"]
+        
+        log.debug("Sending messages", extra={"deployment": model_client.deployment, "max_tokens": stats.max_tokens,
+                                             "prompt_budget": budget_report})
+        
+        content = await run_routed(agent_name, system_prompt, task, model_client, decision, stats)
+        
+        if not content:
+            log.warning("No content generated")
+            stats.outcome = "empty"
             return "Analysis completed but no content generated"
         
+        payload_log.info("Agent response", extra={"response": content})
+        
+        # Write structured output to database if applicable
+        persisted = True
+        if agent_name in DB_WRITING_AGENTS:
+            persisted = await write_agent_output_to_db(user_id, agent_name, content)
+        
+        # Only cache answers that made it to the database
+        if cache_key is not None and persisted:
+            response_cache.put(cache_key, agent_name, content)
+        
+        return content
+        
+    except GatewayOverloaded as e:
+        log.warning("Rejected by LLM gateway: %s", e)
+        stats.outcome = "rejected"
+        raise
+    
     except Exception as e:
-        print(f"[AutoGen] Error in agent execution: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error in agent execution: %s", e)
+        stats.outcome = "error"
         return f"Error during analysis: {str(e)}"
+    
+    finally:
+        _current_run.reset(run_token)
+        await _finish_run(stats, started)
+        log.info("Agent run finished", extra={"run": stats.to_dict()})
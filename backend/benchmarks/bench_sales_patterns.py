@@ -0,0 +1,130 @@
+"""
+Benchmark: SalesPatternAgent.analyze_patterns aggregation
+
+Compares the six pattern views (hour, weekday, week, day of month, category,
+payment method) computed three ways over synthetic sales:
+    rows      one loop per view over the row dicts, parsing dates each time
+              (the implementation before TransactionFrame)
+    per-view  one TransactionFrame.group_totals call per view
+    fused     one TransactionFrame.aggregate call for all six views
+The frame build (date parsing, category coding) is timed separately: it
+happens once per user load and is shared with the other agents.
+
+Usage:
+    python benchmarks/bench_sales_patterns.py [--sizes 10000,100000,1000000] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'agents'))
+
+from transaction_frame import TransactionFrame
+from sales_pattern_agent import SalesPatternAgent
+
+
+def make_rows(n, seed=7):
+    rng = random.Random(seed)
+    now = datetime(2025, 6, 30, 22, 0, 0)
+    categories = ['grocery', 'beverages', 'snacks', 'household', 'tobacco', None]
+    methods = ['cash', 'card', 'apple_pay', 'bank_transfer', None]
+    return [{
+        'transaction_type': 'sale',
+        'amount_aed': round(rng.uniform(2, 400), 2),
+        'category': rng.choice(categories),
+        'payment_method': rng.choice(methods),
+        'date': (now - timedelta(seconds=rng.randrange(90 * 86400))).isoformat() + '+04:00',
+    } for _ in range(n)]
+
+
+def rows_baseline(rows):
+    """The six per-view loops as analyze_patterns ran them over row dicts"""
+    def by_date(key_fn):
+        out = defaultdict(lambda: [0, 0])
+        for txn in rows:
+            date_str = txn.get('date', '')
+            if date_str:
+                dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+                bucket = out[key_fn(dt)]
+                bucket[0] += 1
+                bucket[1] += txn.get('amount_aed', 0)
+        return out
+
+    def by_field(field, default):
+        out = defaultdict(lambda: [0, 0])
+        for txn in rows:
+            bucket = out[txn.get(field) or default]
+            bucket[0] += 1
+            bucket[1] += txn.get('amount_aed', 0)
+        return out
+
+    return {
+        'hour': by_date(lambda dt: dt.hour),
+        'weekday': by_date(lambda dt: dt.weekday()),
+        'week': by_date(lambda dt: dt.strftime('%Y-W%W')),
+        'day_of_month': by_date(lambda dt: dt.day),
+        'category': by_field('category', 'uncategorized'),
+        'payment_method': by_field('payment_method', 'cash'),
+    }
+
+
+def per_view(frame, mask):
+    return {by: frame.group_totals(by, mask) for by in SalesPatternAgent.PATTERN_GROUPINGS}
+
+
+def fused(frame, mask):
+    return frame.aggregate(SalesPatternAgent.PATTERN_GROUPINGS, mask)
+
+
+def best_of(fn, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def same_totals(expected, actual):
+    for by, groups in expected.items():
+        if set(groups) != set(actual[by]):
+            return False
+        for key, (count, total) in groups.items():
+            got_count, got_total = actual[by][key]
+            if count != got_count or abs(total - got_total) > 1e-6 * max(1.0, abs(total)):
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # 'with build' charges the one-off frame build to this analysis alone
+    print(f"{'rows':>9} {'build':>9} {'rows loop':>10} {'per-view':>9} {'fused':>9} "
+          f"{'vs rows':>8} {'with build':>10} {'vs per-view':>11}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        rows = make_rows(n)
+        build, frame = best_of(lambda: TransactionFrame.from_rows(rows), 1)
+        mask = frame.mask('sale')
+
+        t_rows, expected = best_of(lambda: rows_baseline(rows), 1 if n >= 1_000_000 else args.repeat)
+        t_view, by_view = best_of(lambda: per_view(frame, mask), args.repeat)
+        t_fused, combined = best_of(lambda: fused(frame, mask), args.repeat)
+
+        if not (same_totals(expected, combined) and same_totals(by_view, combined)):
+            print(f"{n:>9} results differ between implementations")
+            continue
+        print(f"{n:>9} {build:>8.3f}s {t_rows:>9.3f}s {t_view:>8.4f}s {t_fused:>8.4f}s "
+              f"{t_rows / t_fused:>7.0f}x {t_rows / (build + t_fused):>9.1f}x {t_view / t_fused:>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+LLM Response Cache
+Content-addressed cache for agent completions: in-memory LRU + SQLite tier
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict, defaultdict
+from typing import Dict, Any, Optional, Tuple
+
+from structured_log import get_logger
+
+
+log = get_logger("llm_cache")
+
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_DISK_ENTRIES = 20000
+DEFAULT_DB_PATH = Path(__file__).parent / ".cache" / "llm_cache.sqlite3"
+
+
+def make_cache_key(model: str, system_prompt: str, task: str, data_digest: str) -> str:
+    """Hash of everything that determines the completion"""
+    h = hashlib.sha256()
+    for part in (model, system_prompt, task, data_digest):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier response cache:
+    - Memory: OrderedDict LRU bounded by max_entries
+    - Disk: SQLite table surviving restarts (and shared by processes on the host)
+    Entries expire after ttl_seconds in both tiers.
+    """
+
+    def __init__(self, db_path: Optional[Path] = DEFAULT_DB_PATH,
+                 ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "disk_hits": 0})
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        if db_path is not None:
+            try:
+                Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " agent_name TEXT,"
+                    " value TEXT NOT NULL,"
+                    " created_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.warning("Disk tier disabled: %s", e)
+                self._db = None
+
+    def get(self, key: str, agent_name: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats[agent_name]["hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    self._remember(key, row[1], row[0])
+                    self._stats[agent_name]["hits"] += 1
+                    self._stats[agent_name]["disk_hits"] += 1
+                    return row[0]
+
+            self._stats[agent_name]["misses"] += 1
+            return None
+
+    def put(self, key: str, agent_name: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, agent_name, value, created_at) VALUES (?, ?, ?, ?)",
+                    (key, agent_name, value, now)
+                )
+                self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._db.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    " SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, created_at: float, value: str):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate per agent and overall"""
+        with self._lock:
+            agents = {}
+            total_hits = total_misses = 0
+            for agent_name, s in self._stats.items():
+                lookups = s["hits"] + s["misses"]
+                agents[agent_name] = {
+                    **s,
+                    "hit_rate": round(s["hits"] / lookups, 3) if lookups else 0.0
+                }
+                total_hits += s["hits"]
+                total_misses += s["misses"]
+            lookups = total_hits + total_misses
+            return {
+                "enabled": True,
+                "memory_entries": len(self._memory),
+                "disk_enabled": self._db is not None,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": total_hits,
+                "misses": total_misses,
+                "hit_rate": round(total_hits / lookups, 3) if lookups else 0.0,
+                "agents": agents
+            }
+
+
+def digest_payload(payload: Any) -> str:
+    """Stable digest of any JSON-serialisable input data"""
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _create_default_cache() -> Optional[LLMResponseCache]:
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    db_path = os.getenv("LLM_CACHE_PATH")
+    return LLMResponseCache(
+        db_path=Path(db_path) if db_path else DEFAULT_DB_PATH,
+        ttl_seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    )
+
+
+# Process-wide cache (None when disabled)
+response_cache = _create_default_cache()
@@ -0,0 +1,347 @@
+"""
+LLM Gateway
+Global concurrency limit, priority queueing and backpressure for LLM requests.
+
+Every completion request takes a slot from the gateway for as long as it is
+in flight. Waiting requests are served in order of (enqueue time + priority
+offset), so interactive requests overtake batch work without starving it: a
+batch request that has waited longer than the offset gap goes first. When
+the queue is full, or a request waits longer than the queue timeout, the
+request is rejected with GatewayOverloaded instead of piling up.
+
+By default the gateway is in-process. To share one limit across uvicorn
+workers and the scheduler, run the socket server and point every process at
+it:
+    python llm_gateway.py --listen unix:/tmp/kamai_llm_gateway.sock
+    LLM_GATEWAY_URL=unix:/tmp/kamai_llm_gateway.sock
+(tcp://127.0.0.1:8766 works too.) A slot is held by an open connection, so a
+crashed client releases its slots automatically.
+"""
+
+import os
+import json
+import time
+import heapq
+import asyncio
+import argparse
+import itertools
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import llm_metrics
+from structured_log import get_logger
+
+
+log = get_logger("llm_gateway")
+
+# Priority offsets in seconds: a request is served as if enqueued this much later
+PRIORITIES = {
+    "interactive": 0.0,
+    "default": 30.0,
+    "batch": 120.0,
+}
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_QUEUE_TIMEOUT = 300.0
+
+
+class GatewayOverloaded(Exception):
+    """Raised when the gateway queue is full or a request waited too long"""
+
+    def __init__(self, message: str, retry_after: float = 5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def priority_offset(priority: str) -> float:
+    return PRIORITIES.get(priority, PRIORITIES["default"])
+
+
+class _Waiter:
+    """A queued acquire; `granted` and `abandoned` are only changed under the gateway lock"""
+    __slots__ = ("future", "granted", "abandoned")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.granted = False
+        self.abandoned = False
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class LLMGateway:
+    """
+    Counting semaphore with a priority heap of waiters. Thread-safe, and
+    waiters may belong to different event loops (slots are handed over with
+    call_soon_threadsafe).
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: List[Tuple[float, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_GATEWAY_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+            max_queue=int(os.getenv("LLM_GATEWAY_MAX_QUEUE", DEFAULT_MAX_QUEUE)),
+            queue_timeout=float(os.getenv("LLM_GATEWAY_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)),
+        )
+
+    def _queued(self) -> int:
+        return sum(1 for _, _, waiter in self._waiters if not waiter.abandoned)
+
+    def _reject(self, agent: str, priority: str, reason: str):
+        self.rejected += 1
+        llm_metrics.registry.inc("llm_gateway_rejected_total", {"agent": agent, "priority": priority})
+        raise GatewayOverloaded(reason)
+
+    async def acquire(self, priority: str = "default", agent: str = "unknown") -> float:
+        """Wait for a slot; returns seconds waited. Raises GatewayOverloaded."""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._queued():
+                self._in_flight += 1
+                self.granted += 1
+                return 0.0
+            if self._queued() >= self.max_queue:
+                self._reject(agent, priority, f"LLM gateway queue full ({self.max_queue} waiting)")
+            waiter = _Waiter(loop.create_future())
+            heapq.heappush(self._waiters, (started + priority_offset(priority), next(self._seq), waiter))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if not waiter.granted:
+                    waiter.abandoned = True
+                    self._reject(agent, priority, f"Waited {self.queue_timeout:g}s for an LLM slot")
+            # Granted as the timeout fired: keep the slot
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    waiter.abandoned = True
+                    raise
+            # The slot was already handed to us; give it back
+            self.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self.granted += 1
+            self.wait_seconds += waited
+        llm_metrics.registry.observe("llm_gateway_wait_seconds", {"priority": priority}, waited)
+        return waited
+
+    def release(self):
+        """Return a slot, handing it straight to the next live waiter"""
+        with self._lock:
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.abandoned:
+                    continue
+                # The slot transfers; the in-flight count is unchanged
+                try:
+                    waiter.future.get_loop().call_soon_threadsafe(_wake, waiter.future)
+                except RuntimeError:  # the waiter's event loop is gone
+                    waiter.abandoned = True
+                    continue
+                waiter.granted = True
+                return
+            self._in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "default", agent: str = "unknown"):
+        waited = await self.acquire(priority, agent)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": "local",
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queued": self._queued(),
+                "max_queue": self.max_queue,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "avg_wait_seconds": round(self.wait_seconds / self.granted, 3) if self.granted else 0.0,
+            }
+
+
+# ----------------------------------------------------------------------------
+# Socket server mode. Line protocol, one JSON object per line:
+#   client -> {"op": "acquire", "priority": "batch", "agent": "tax_agent"}
+#   server -> {"granted": true, "waited": 1.2}
+#          or {"granted": false, "error": "...", "retry_after": 5}
+#   client -> {"op": "stats"}   server -> {...}
+# The slot is released when the client closes the connection.
+# ----------------------------------------------------------------------------
+
+def _parse_address(url: str) -> Tuple[str, Any]:
+    if url.startswith("unix:"):
+        return "unix", url[len("unix:"):]
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://"):].rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"Unsupported LLM gateway address: {url} (use unix:/path or tcp://host:port)")
+
+
+class GatewayServer:
+    """Serves an LLMGateway to other processes"""
+
+    def __init__(self, gateway: LLMGateway):
+        self.gateway = gateway
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        holding = False
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            if request.get("op") == "stats":
+                writer.write((json.dumps(self.gateway.stats()) + "\n").encode())
+                await writer.drain()
+                return
+
+            try:
+                waited = await self.gateway.acquire(request.get("priority", "default"),
+                                                    request.get("agent", "unknown"))
+            except GatewayOverloaded as e:
+                writer.write((json.dumps({"granted": False, "error": str(e),
+                                          "retry_after": e.retry_after}) + "\n").encode())
+                await writer.drain()
+                return
+            holding = True
+            writer.write((json.dumps({"granted": True, "waited": waited}) + "\n").encode())
+            await writer.drain()
+            # Hold the slot until the client disconnects
+            await reader.read()
+        except (ConnectionError, json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+            log.warning("Client error: %s", e)
+        finally:
+            if holding:
+                self.gateway.release()
+            writer.close()
+
+    async def serve(self, url: str):
+        kind, address = _parse_address(url)
+        if kind == "unix":
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await asyncio.start_unix_server(self._handle, path=address)
+        else:
+            server = await asyncio.start_server(self._handle, host=address[0], port=address[1])
+        log.info("Listening on %s (concurrency %d, queue %d)",
+                 url, self.gateway.max_concurrency, self.gateway.max_queue)
+        async with server:
+            await server.serve_forever()
+
+
+class RemoteGateway:
+    """Client for a GatewayServer; falls back to an in-process gateway if it is unreachable"""
+
+    def __init__(self, url: str, fallback: LLMGateway):
+        self.url = url
+        self.kind, self.address = _parse_address(url)
+        self.fallback = fallback
+        self._warned = False
+
+    async def _connect(self):
+        if self.kind == "unix":
+            return await asyncio.open_unix_connection(self.address)
+        return await asyncio.open_connection(*self.address)
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "default", agent: str = "unknown"):
+        try:
+            reader, writer = await self._connect()
+        except OSError as e:
+            if not self._warned:
+                log.warning("%s unreachable (%s); using the in-process gateway", self.url, e)
+                self._warned = True
+            async with self.fallback.slot(priority, agent) as waited:
+                yield waited
+            return
+
+        try:
+            writer.write((json.dumps({"op": "acquire", "priority": priority, "agent": agent}) + "\n").encode())
+            await writer.drain()
+            line = await reader.readline()
+            reply = json.loads(line) if line else {"granted": False, "error": "gateway closed the connection"}
+            if not reply.get("granted"):
+                raise GatewayOverloaded(reply.get("error", "LLM gateway rejected the request"),
+                                        retry_after=reply.get("retry_after", 5.0))
+            yield reply.get("waited", 0.0)
+        finally:
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": "remote", "url": self.url}
+
+    async def remote_stats(self) -> Dict[str, Any]:
+        try:
+            reader, writer = await self._connect()
+        except OSError as e:
+            return {"mode": "remote", "url": self.url, "error": str(e)}
+        try:
+            writer.write(b'{"op": "stats"}\n')
+            await writer.drain()
+            return {**json.loads(await reader.readline()), "mode": "remote", "url": self.url}
+        finally:
+            writer.close()
+
+
+_local_gateway = LLMGateway.from_env()
+_gateway_url = os.getenv("LLM_GATEWAY_URL")
+gateway = RemoteGateway(_gateway_url, _local_gateway) if _gateway_url else _local_gateway
+
+
+async def gateway_stats() -> Dict[str, Any]:
+    if isinstance(gateway, RemoteGateway):
+        return await gateway.remote_stats()
+    return gateway.stats()
+
+
+async def check_admission():
+    """Raise GatewayOverloaded when the queue is already full, so new work is shed up front"""
+    stats = await gateway_stats()
+    if "max_queue" in stats and stats["queued"] >= stats["max_queue"]:
+        raise GatewayOverloaded(f"LLM gateway queue full ({stats['queued']} waiting)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared LLM concurrency gateway")
+    parser.add_argument("--listen", default=os.getenv("LLM_GATEWAY_LISTEN", "unix:/tmp/kamai_llm_gateway.sock"),
+                        help="unix:/path or tcp://host:port")
+    parser.add_argument("--concurrency", type=int, default=_local_gateway.max_concurrency)
+    parser.add_argument("--max-queue", type=int, default=_local_gateway.max_queue)
+    parser.add_argument("--queue-timeout", type=float, default=_local_gateway.queue_timeout)
+    args = parser.parse_args()
+
+    server = GatewayServer(LLMGateway(args.concurrency, args.max_queue, args.queue_timeout))
+    asyncio.run(server.serve(args.listen))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+LLM Hedging
+Hedged requests for tail latency: if a completion hasn't returned within a
+deadline derived from the deployment's recent p95 latency, the same request
+is sent to a secondary deployment, the first successful answer wins and the
+other request is cancelled.
+
+Hedges are rationed (LLM_HEDGE_MAX_RATIO of requests, 10% by default) so a
+deployment-wide slowdown can't double the spend.
+"""
+
+import os
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+
+import llm_metrics
+
+
+# Latency samples kept per deployment, and how many are needed for a p95
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Rolling completion latencies per deployment"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, deployment: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(deployment)
+            if samples is None:
+                samples = self._samples[deployment] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, deployment: str, q: float) -> Optional[float]:
+        """q-quantile of recent latencies, or None with fewer than MIN_SAMPLES"""
+        with self._lock:
+            samples = sorted(self._samples.get(deployment) or ())
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            deployments = list(self._samples)
+        return {
+            deployment: {
+                "samples": len(self._samples[deployment]),
+                "p50": self.percentile(deployment, 0.5),
+                "p95": self.percentile(deployment, 0.95),
+            }
+            for deployment in deployments
+        }
+
+
+class HedgePolicy:
+    """
+    When to hedge and where to. The deadline is the primary deployment's
+    p-quantile latency times a multiplier (a fixed default until enough
+    samples exist), never below a floor. Each request earns max_ratio of a
+    hedge credit and each hedge spends one.
+    """
+
+    def __init__(self, secondary: Optional[str] = None, quantile: float = 0.95,
+                 multiplier: float = 1.0, min_deadline: float = 2.0,
+                 default_deadline: float = 30.0, max_ratio: float = 0.1,
+                 tracker: Optional[LatencyTracker] = None):
+        self.secondary = secondary
+        self.quantile = quantile
+        self.multiplier = multiplier
+        self.min_deadline = min_deadline
+        self.default_deadline = default_deadline
+        self.max_ratio = max_ratio
+        self.tracker = tracker or LatencyTracker()
+        self._credit = 1.0
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    @classmethod
+    def from_env(cls) -> "HedgePolicy":
+        return cls(
+            secondary=os.getenv("LLM_HEDGE_DEPLOYMENT") or None,
+            quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+            multiplier=float(os.getenv("LLM_HEDGE_MULTIPLIER", "1.0")),
+            min_deadline=float(os.getenv("LLM_HEDGE_MIN_DEADLINE", "2")),
+            default_deadline=float(os.getenv("LLM_HEDGE_DEFAULT_DEADLINE", "30")),
+            max_ratio=float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1")),
+        )
+
+    def secondary_for(self, deployment: str) -> Optional[str]:
+        """Deployment to hedge to, or None when hedging doesn't apply"""
+        if not self.secondary or self.secondary == deployment or self.max_ratio <= 0:
+            return None
+        return self.secondary
+
+    def deadline(self, deployment: str) -> float:
+        observed = self.tracker.percentile(deployment, self.quantile)
+        if observed is None:
+            return self.default_deadline
+        return max(self.min_deadline, observed * self.multiplier)
+
+    def note_request(self):
+        with self._lock:
+            self._credit = min(5.0, self._credit + self.max_ratio)
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0 - 1e-9:  # float sums of max_ratio
+                self.denied += 1
+                return False
+            self._credit -= 1.0
+            self.hedged += 1
+            return True
+
+    def record_outcome(self, deployment: str, winner: str):
+        """Which side answered a hedged request"""
+        with self._lock:
+            if winner == "secondary":
+                self.hedge_wins += 1
+        llm_metrics.registry.inc("llm_hedges_total", {"deployment": deployment, "winner": winner})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {"hedged": self.hedged, "hedge_wins": self.hedge_wins, "denied": self.denied}
+        return {
+            "secondary": self.secondary,
+            "quantile": self.quantile,
+            "max_ratio": self.max_ratio,
+            **counts,
+            "latency": self.tracker.stats(),
+        }
+
+
+def _consume_result(task: asyncio.Future):
+    # Retrieve the loser's outcome so asyncio doesn't log it as unhandled
+    if not task.cancelled():
+        task.exception()
+
+
+async def hedged_call(primary: Callable[[], Awaitable[Any]],
+                      secondary: Callable[[], Awaitable[Any]],
+                      deadline: float,
+                      may_hedge: Callable[[], bool]) -> Tuple[Any, str]:
+    """
+    Await primary(); if it hasn't finished within `deadline` seconds and
+    may_hedge() allows it, also start secondary(). Returns (result, "primary"
+    or "secondary") for the first to succeed, cancelling the other. If both
+    fail, the first error is raised.
+    """
+    first = asyncio.ensure_future(primary())
+    first.add_done_callback(_consume_result)
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait({first}, timeout=deadline)
+        if done or not may_hedge():
+            return await first, "primary"
+
+        second = asyncio.ensure_future(secondary())
+        second.add_done_callback(_consume_result)
+        tasks.append(second)
+        pending = {first, second}
+        errors = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Prefer the primary when both land in the same tick
+            for task in sorted(done, key=lambda t: t is not first):
+                if task.exception() is None:
+                    return task.result(), "primary" if task is first else "secondary"
+                errors.append(task.exception())
+        raise errors[0]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+policy = HedgePolicy.from_env()
+
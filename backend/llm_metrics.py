@@ -0,0 +1,157 @@
+"""
+LLM Metrics
+In-process counters and histograms for LLM usage and latency, rendered in
+the Prometheus text exposition format (no client library dependency)
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict, Any, List, Tuple
+
+
+# Histogram buckets (seconds)
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+QUEUE_BUCKETS = (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and cumulative histograms keyed by label set"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self._histograms: Dict[str, Dict[LabelKey, Dict[str, Any]]] = defaultdict(dict)
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = ("counter", help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self._help[name] = ("histogram", help_text)
+        self._buckets[name] = buckets
+
+    def inc(self, name: str, labels: Dict[str, str], amount: float = 1.0):
+        with self._lock:
+            self._counters[name][_label_key(labels)] += amount
+
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms[name].get(key)
+            if series is None:
+                series = {"counts": [0] * len(self._buckets[name]), "sum": 0.0, "count": 0}
+                self._histograms[name][key] = series
+            for i, bound in enumerate(self._buckets[name]):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text) in self._help.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for key, value in self._counters.get(name, {}).items():
+                        lines.append(f"{name}{_format_labels(key)} {value:g}")
+                else:
+                    for key, series in self._histograms.get(name, {}).items():
+                        for bound, count in zip(self._buckets[name], series["counts"]):
+                            lines.append(f"{name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {count}")
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {series['count']}")
+                        lines.append(f"{name}_sum{_format_labels(key)} {series['sum']:.6f}")
+                        lines.append(f"{name}_count{_format_labels(key)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-agent totals, sorted by tokens then wall-clock time"""
+        agents: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        with self._lock:
+            for name in ("llm_prompt_tokens_total", "llm_cached_prompt_tokens_total", "llm_completion_tokens_total",
+                         "llm_requests_total", "llm_retries_total", "agent_runs_total"):
+                for key, value in self._counters.get(name, {}).items():
+                    agent = dict(key).get("agent", "unknown")
+                    agents[agent][name] += value
+            for name in ("agent_run_seconds", "llm_queue_seconds", "llm_network_seconds"):
+                for key, series in self._histograms.get(name, {}).items():
+                    agent = dict(key).get("agent", "unknown")
+                    agents[agent][name] += series["sum"]
+        rows = [{"agent": agent, **{k: round(v, 3) for k, v in values.items()}} for agent, values in agents.items()]
+        rows.sort(key=lambda r: (r.get("llm_prompt_tokens_total", 0) + r.get("llm_completion_tokens_total", 0),
+                                 r.get("agent_run_seconds", 0)), reverse=True)
+        return {"agents": rows}
+
+
+registry = MetricsRegistry()
+registry.counter("llm_requests_total", "Chat completion HTTP requests by agent, deployment and status")
+registry.counter("llm_retries_total", "Chat completion retries (429/5xx/transport errors)")
+registry.counter("llm_prompt_tokens_total", "Prompt tokens reported by the API")
+registry.counter("llm_completion_tokens_total", "Completion tokens reported by the API")
+registry.counter("llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prompt cache")
+registry.counter("agent_runs_total", "run_autogen_mcp_task invocations by agent and outcome")
+registry.counter("agent_tool_calls_total", "Tool calls executed by agent")
+registry.counter("agent_tool_results_trimmed_total", "Tool results shrunk to fit the prompt budget")
+registry.counter("agent_tool_result_trimmed_tokens_total", "Tokens dropped from tool results to fit the prompt budget")
+registry.counter("agent_output_invalid_total", "Agent answers rejected by JSON extraction or schema validation")
+registry.counter("llm_hedges_total", "Hedged completion requests by primary deployment and winning side")
+registry.counter("llm_gateway_rejected_total", "LLM requests rejected by the gateway (queue full or timed out)")
+registry.histogram("llm_gateway_wait_seconds", "Time spent waiting for an LLM gateway slot", QUEUE_BUCKETS)
+registry.histogram("llm_queue_seconds", "Time spent waiting for rate-limit admission per request", QUEUE_BUCKETS)
+registry.histogram("llm_network_seconds", "HTTP round-trip time per chat completion request", LATENCY_BUCKETS)
+registry.histogram("agent_run_seconds", "Wall-clock time per run_autogen_mcp_task invocation", LATENCY_BUCKETS)
+
+
+def record_request(agent: str, deployment: str, status: str, queue_seconds: float,
+                   network_seconds: float, retry: bool):
+    """One HTTP attempt against the chat completions endpoint"""
+    labels = {"agent": agent, "deployment": deployment}
+    registry.inc("llm_requests_total", {**labels, "status": status})
+    registry.observe("llm_queue_seconds", labels, queue_seconds)
+    registry.observe("llm_network_seconds", labels, network_seconds)
+    if retry:
+        registry.inc("llm_retries_total", labels)
+
+
+def record_run(agent: str, outcome: str, seconds: float, prompt_tokens: int,
+               completion_tokens: int, tool_calls: int, cached_prompt_tokens: int = 0):
+    """One completed run_autogen_mcp_task invocation"""
+    labels = {"agent": agent}
+    registry.inc("agent_runs_total", {**labels, "outcome": outcome})
+    registry.observe("agent_run_seconds", labels, seconds)
+    registry.inc("llm_prompt_tokens_total", labels, prompt_tokens)
+    registry.inc("llm_completion_tokens_total", labels, completion_tokens)
+    registry.inc("llm_cached_prompt_tokens_total", labels, cached_prompt_tokens)
+    registry.inc("agent_tool_calls_total", labels, tool_calls)
+
+
+def record_tool_results_trimmed(agent: str, results: int, tokens: int):
+    """Tool results shrunk in one tool round to fit the prompt budget"""
+    labels = {"agent": agent}
+    registry.inc("agent_tool_results_trimmed_total", labels, results)
+    registry.inc("agent_tool_result_trimmed_tokens_total", labels, tokens)
+
+
+def record_invalid_output(agent: str, stage: str):
+    """An agent answer that could not be extracted or failed its schema"""
+    registry.inc("agent_output_invalid_total", {"agent": agent, "stage": stage})
@@ -0,0 +1,202 @@
+"""
+LLM Rate Limiter
+Per-deployment token buckets sized from the Azure OpenAI RPM/TPM quota
+"""
+
+import os
+import time
+import asyncio
+from typing import Dict, Any, List, Optional, Mapping
+
+
+# Defaults used when no quota is configured for a deployment
+DEFAULT_RPM = 10
+DEFAULT_TPM = 50000
+
+# Rough characters-per-token ratio for English/JSON prompts
+CHARS_PER_TOKEN = 4
+# Per-message overhead the chat format adds (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_prompt_tokens(messages: List[Any]) -> int:
+    """Cheap prompt token estimate (no tokenizer dependency)"""
+    total = 0
+    for msg in messages:
+        if isinstance(msg, dict):
+            content = msg.get("content") or ""
+        else:
+            content = getattr(msg, "content", None) or str(msg)
+        if not isinstance(content, str):
+            content = str(content)
+        total += len(content) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def estimate_request_tokens(messages: List[Any], max_tokens: int) -> int:
+    """
+    Tokens Azure charges against TPM when admitting a request.
+    Azure counts the prompt plus the requested max_tokens, not the
+    completion actually produced, so both are included.
+    """
+    return estimate_prompt_tokens(messages) + max_tokens
+
+
+class TokenBucket:
+    """Continuous-refill token bucket"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.level = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.level = min(self.capacity, self.level + elapsed * self.refill_per_second)
+            self.updated_at = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be consumed (0 if available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_per_second
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def clamp(self, remaining: float, now: float):
+        """Never believe we have more than the server says is left"""
+        self._refill(now)
+        self.level = min(self.level, float(remaining))
+
+
+class DeploymentRateLimiter:
+    """
+    Admits requests to one Azure deployment:
+    - Request bucket refills at RPM/60 per second (bursts up to RPM)
+    - Token bucket refills at TPM/60 per second (bursts up to TPM)
+    - Retry-After / x-ratelimit-* response headers tighten both buckets
+    Callers are admitted in FIFO order.
+    """
+
+    def __init__(self, deployment: str, rpm: int, tpm: int):
+        self.deployment = deployment
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, estimated_tokens: int) -> float:
+        """
+        Wait until the request fits within quota and reserve it
+
+        Returns:
+            Seconds spent waiting for admission
+        """
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.blocked_until - now,
+                    self.requests.time_until(1, now),
+                    self.tokens.time_until(estimated_tokens, now),
+                )
+                if wait <= 0:
+                    self.requests.consume(1, now)
+                    self.tokens.consume(estimated_tokens, now)
+                    return now - started
+                await asyncio.sleep(wait)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """
+        Charge any under-estimate once the real prompt size is known.
+        Over-estimates are not credited back: Azure admits on prompt + max_tokens.
+        """
+        if actual_tokens is None:
+            return
+        if actual_tokens > estimated_tokens:
+            self.tokens.consume(actual_tokens - estimated_tokens, time.monotonic())
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Apply Retry-After and x-ratelimit-remaining-* headers from a response"""
+        now = time.monotonic()
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+        remaining_requests = _header_float(headers, "x-ratelimit-remaining-requests")
+        if remaining_requests is not None:
+            self.requests.clamp(remaining_requests, now)
+
+        remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None:
+            self.tokens.clamp(remaining_tokens, now)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        return {
+            "deployment": self.deployment,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests_available": round(self.requests.level, 2),
+            "tokens_available": round(self.tokens.level),
+            "blocked_for_seconds": round(max(0.0, self.blocked_until - now), 2),
+        }
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to back off, from retry-after-ms or retry-after"""
+    retry_ms = _header_float(headers, "retry-after-ms")
+    if retry_ms is not None:
+        return retry_ms / 1000.0
+    return _header_float(headers, "retry-after")
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _quota_from_env(deployment: str, kind: str, default: int) -> int:
+    """AZURE_OPENAI_<KIND>_<DEPLOYMENT> overrides AZURE_OPENAI_<KIND>"""
+    suffix = "".join(c if c.isalnum() else "_" for c in deployment).upper()
+    value = os.getenv(f"AZURE_OPENAI_{kind}_{suffix}") or os.getenv(f"AZURE_OPENAI_{kind}")
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+
+_limiters: Dict[str, DeploymentRateLimiter] = {}
+
+
+def get_rate_limiter(deployment: str) -> DeploymentRateLimiter:
+    """Process-wide limiter for a deployment, created on first use"""
+    limiter = _limiters.get(deployment)
+    if limiter is None:
+        limiter = DeploymentRateLimiter(
+            deployment,
+            rpm=_quota_from_env(deployment, "RPM", DEFAULT_RPM),
+            tpm=_quota_from_env(deployment, "TPM", DEFAULT_TPM),
+        )
+        _limiters[deployment] = limiter
+    return limiter
+
+
+def rate_limiter_stats() -> List[Dict[str, Any]]:
+    return [limiter.stats() for limiter in _limiters.values()]
@@ -0,0 +1,350 @@
+"""
+LLM Stub Server
+Azure OpenAI-compatible local endpoint serving canned, schema-valid JSON per
+agent, for exercising and benchmarking the agent pipeline without a live
+deployment.
+
+Run:
+    python llm_stub_server.py --port 8765
+Point the backend at it:
+    LLM_BACKEND=stub LLM_STUB_URL=http://127.0.0.1:8765
+
+Knobs (env or CLI):
+    LLM_STUB_LATENCY_DIST     fixed | uniform | lognormal (default lognormal)
+    LLM_STUB_LATENCY_MS       median latency per completion (default 800)
+    LLM_STUB_LATENCY_SIGMA    lognormal sigma / uniform +- fraction (default 0.5)
+    LLM_STUB_429_RATE         fraction of requests answered with 429 (default 0)
+    LLM_STUB_RETRY_AFTER_MS   retry-after-ms sent with injected 429s (default 500)
+    LLM_STUB_SEED             RNG seed for latency and 429 injection (default 42)
+"""
+
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class StubConfig:
+    latency_dist: str = "lognormal"
+    latency_ms: float = 800.0
+    latency_sigma: float = 0.5
+    rate_429: float = 0.0
+    retry_after_ms: int = 500
+    seed: int = 42
+
+    @classmethod
+    def from_env(cls) -> "StubConfig":
+        return cls(
+            latency_dist=os.getenv("LLM_STUB_LATENCY_DIST", cls.latency_dist),
+            latency_ms=float(os.getenv("LLM_STUB_LATENCY_MS", cls.latency_ms)),
+            latency_sigma=float(os.getenv("LLM_STUB_LATENCY_SIGMA", cls.latency_sigma)),
+            rate_429=float(os.getenv("LLM_STUB_429_RATE", cls.rate_429)),
+            retry_after_ms=int(os.getenv("LLM_STUB_RETRY_AFTER_MS", cls.retry_after_ms)),
+            seed=int(os.getenv("LLM_STUB_SEED", cls.seed)),
+        )
+
+
+def _canned_responses() -> Dict[str, Dict[str, Any]]:
+    """Outputs matching what write_agent_output_to_db expects for each agent"""
+    today = datetime.now().date()
+    week_end = (today + timedelta(days=6)).isoformat()
+    month_end = (today + timedelta(days=29)).isoformat()
+
+    income_patterns = {
+        "average_weekly_income": 10500.00,
+        "income_volatility": 0.35,
+        "seasonal_factors": "Weekend peaks; slower mid-week",
+        "confidence_score": 0.8
+    }
+    income_forecast = {
+        "forecast_period_days": 30,
+        "pessimistic_scenario": {"expected_income": 35000.00, "confidence": 0.15, "daily_average": 1166.67,
+                                 "risk_factors": ["Seasonal decline"]},
+        "realistic_scenario": {"expected_income": 45000.00, "confidence": 0.65, "daily_average": 1500.00,
+                               "risk_factors": ["Normal market conditions"]},
+        "optimistic_scenario": {"expected_income": 55000.00, "confidence": 0.20, "daily_average": 1833.33,
+                                "risk_factors": ["Festival season"]},
+        "volatility_score": 0.42,
+        "volatility_category": "moderate",
+        "trend_direction": "stable",
+        "forecast_confidence": 0.68,
+        "recommendation": "Maintain 3-month emergency fund due to moderate volatility"
+    }
+    budgets = [
+        {
+            "budget_type": budget_type,
+            "valid_from": today.isoformat(),
+            "valid_until": week_end,
+            "total_income_expected": income,
+            "fixed_costs": {"rent": 12000},
+            "variable_costs": {"food": 3000, "fuel": 2000},
+            "savings_target": savings,
+            "discretionary_budget": discretionary,
+            "category_limits": {"food": 3500, "fuel": 2500},
+            "confidence_score": 0.8
+        }
+        for budget_type, income, savings, discretionary in (
+            ("feast_week", 45000.00, 15000.00, 6000.00),
+            ("famine_week", 15000.00, 0.00, 0.00),
+        )
+    ]
+    risk_assessment = {
+        "overall_risk_level": "medium",
+        "risk_score": 4.9,
+        "risk_factors": [{"factor": "Emergency fund", "impact": "3.5 months coverage"}],
+        "debt_to_income_ratio": 0.19,
+        "emergency_fund_coverage": 3.5,
+        "escalation_needed": False,
+        "recommended_actions": [{"action": "Build emergency fund", "description": "Target 6 months of expenses"}],
+        "ai_risk_analysis": "Moderate risk profile"
+    }
+    cashflow_status = {
+        "status": "on_track",
+        "days_remaining_in_month": 12,
+        "month_to_date": {"income": 28000, "expenses": 17000, "net": 11000},
+        "upcoming_bills": {"total_due": 6000, "count": 2, "next_due_date": week_end, "next_due_amount": 4000},
+        "projected_gap": 5000,
+        "daily_earning_target": 500,
+        "message": "You're on track! At current pace, you'll have Rs 5,000 buffer after all bills.",
+        "recommendations": ["Keep weekend shifts"],
+        "confidence_score": 0.8
+    }
+
+    return {
+        "pattern_agent": {"income_patterns": income_patterns},
+        "volatility_agent": {"income_forecast": income_forecast},
+        "budget_agent": {"budgets": budgets},
+        "risk_agent": {"risk_assessment": risk_assessment},
+        "cashflow_agent": cashflow_status,
+        "fused_agent": {
+            "income_patterns": income_patterns,
+            "income_forecast": income_forecast,
+            "budgets": budgets,
+            "risk_assessment": risk_assessment,
+            "cashflow_status": cashflow_status
+        },
+        "tax_agent": {"tax_record": {
+            "financial_year": "2025-26",
+            "total_income": 540000.00,
+            "taxable_income": 190000.00,
+            "tax_liability": 0.00,
+            "regime": "new",
+            "itr_form": "ITR-4"
+        }},
+        "financial_agent": {"financial_health": {
+            "health_category": "fair",
+            "overall_score": 62,
+            "savings_rate": 0.18,
+            "debt_ratio": 0.19,
+            "emergency_fund_months": 3.5
+        }},
+        "action_agent": {"action_plan": {
+            "plan_type": "automation",
+            "actions": [{"action_id": "auto_save", "description": "Move Rs 200 to savings daily",
+                         "target_amount": 200, "frequency": "daily"}]
+        }},
+        "savings_investment_agent": {"savings_plan": {
+            "emergency_fund": {"target_amount": 60000, "current_amount": 20000, "monthly_contribution": 4000,
+                               "priority": "high", "status": "in_progress", "reasoning": "3-6 months of expenses"},
+            "investment_recommendations": [{"investment_type": "recurring_deposit", "provider": "Post Office",
+                                            "recommended_amount": 1000, "frequency": "monthly",
+                                            "expected_return": 6.7, "risk_level": "low",
+                                            "reasoning": "Safe, flexible"}]
+        }},
+        "bill_payment_agent": {"bill_analysis": {
+            "bills": [{"bill_name": "Rent", "bill_type": "rent", "amount": 12000, "due_date": month_end,
+                       "frequency": "monthly", "priority": "high", "auto_pay_recommended": False,
+                       "payment_method": "upi", "status": "pending"}]
+        }},
+        "goals_agent": {"goals_plan": {
+            "goals": [{"goal_name": "Emergency fund", "goal_type": "savings", "description": "3 months buffer",
+                       "target_amount": 60000, "current_amount": 20000, "target_date": month_end,
+                       "priority": 1, "status": "in_progress", "monthly_target": 4000,
+                       "progress_percentage": 33, "milestones": [], "action_steps": []}]
+        }},
+        "recommendation_agent": {"recommendations": [{
+            "title": "Start a daily auto-save",
+            "description": "Save Rs 200 every day you earn",
+            "category": "savings",
+            "priority": "high"
+        }]},
+        "knowledge_agent": {"matched_schemes": [{
+            "scheme_name": "PM-SYM",
+            "eligibility": "eligible",
+            "benefit": "Rs 3,000 monthly pension after 60"
+        }]},
+        "context_agent": {"context": {"weather_impact": "none", "seasonal_factors": "festival season"}},
+    }
+
+
+# System prompt openings used to recognise agents that don't send x-agent-name
+PROMPT_SIGNATURES = {
+    "Pattern Recognition Agent": "pattern_agent",
+    "Income Volatility Forecaster": "volatility_agent",
+    "Budget Analysis Engine": "budget_agent",
+    "Risk Assessment Engine": "risk_agent",
+    "Cash Flow Monitor Agent": "cashflow_agent",
+    "core financial analysis engine": "fused_agent",
+    "Tax and Compliance Engine": "tax_agent",
+    "Financial Health Evaluator": "financial_agent",
+    "Action Execution Engine": "action_agent",
+    "Savings & Investment Planning Agent": "savings_investment_agent",
+    "Automated Bill Payment Decisions Agent": "bill_payment_agent",
+    "Financial Goal-Based Planning Agent": "goals_agent",
+    "Recommendation Engine": "recommendation_agent",
+    "Knowledge Integration Engine": "knowledge_agent",
+    "Context Intelligence Engine": "context_agent",
+}
+
+
+def identify_agent(headers, messages: List[Dict[str, Any]]) -> Optional[str]:
+    agent = headers.get("x-agent-name")
+    if agent:
+        return agent
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    for signature, name in PROMPT_SIGNATURES.items():
+        if signature in system:
+            return name
+    return None
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class StubLLM:
+    """Latency sampling, 429 injection and response shaping"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.responses = _canned_responses()
+        self.stats = {"requests": 0, "throttled": 0, "by_agent": {}}
+
+    def sample_latency(self) -> float:
+        c = self.config
+        median = c.latency_ms / 1000.0
+        if c.latency_dist == "fixed":
+            return median
+        if c.latency_dist == "uniform":
+            return max(0.0, self.rng.uniform(median * (1 - c.latency_sigma), median * (1 + c.latency_sigma)))
+        return median * math.exp(self.rng.gauss(0.0, c.latency_sigma))
+
+    def should_throttle(self) -> bool:
+        return self.config.rate_429 > 0 and self.rng.random() < self.config.rate_429
+
+    def content_for(self, agent: Optional[str]) -> str:
+        payload = self.responses.get(agent or "", {"result": "ok", "agent": agent})
+        return json.dumps(payload)
+
+
+def create_stub_app(config: Optional[StubConfig] = None) -> FastAPI:
+    stub = StubLLM(config or StubConfig.from_env())
+    app = FastAPI(title="LLM Stub Server")
+    app.state.stub = stub
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        agent = identify_agent(request.headers, messages)
+
+        stub.stats["requests"] += 1
+        stub.stats["by_agent"][agent or "unknown"] = stub.stats["by_agent"].get(agent or "unknown", 0) + 1
+
+        if stub.should_throttle():
+            stub.stats["throttled"] += 1
+            retry_ms = stub.config.retry_after_ms
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"code": "429", "message": "Rate limit is exceeded (stub)."}},
+                headers={"retry-after-ms": str(retry_ms), "retry-after": str(max(1, math.ceil(retry_ms / 1000)))}
+            )
+
+        content = stub.content_for(agent)
+        prompt_tokens = sum(_estimate_tokens(m.get("content") or "") + 4 for m in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _estimate_tokens(content),
+            "total_tokens": prompt_tokens + _estimate_tokens(content)
+        }
+        completion_id = f"chatcmpl-stub-{stub.stats['requests']}"
+        created = int(time.time())
+        latency = stub.sample_latency()
+
+        if body.get("stream"):
+            async def events():
+                # ~20% of the latency before the first token, the rest spread over chunks
+                await asyncio.sleep(latency * 0.2)
+                pieces = [content[i:i + 24] for i in range(0, len(content), 24)] or [""]
+                per_piece = latency * 0.8 / len(pieces)
+                for piece in pieces:
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                             "model": deployment,
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(per_piece)
+                final = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": deployment, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield f"data: {json.dumps({'id': completion_id, 'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return stub.stats
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    defaults = StubConfig.from_env()
+    parser = argparse.ArgumentParser(description="Azure OpenAI-compatible LLM stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default=defaults.latency_dist)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--rate-429", type=float, default=defaults.rate_429)
+    parser.add_argument("--retry-after-ms", type=int, default=defaults.retry_after_ms)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        rate_429=args.rate_429,
+        retry_after_ms=args.retry_after_ms,
+        seed=args.seed,
+    )
+    print(f"LLM stub on http://{args.host}:{args.port} ({config})")
+    uvicorn.run(create_stub_app(config), host=args.host, port=args.port)
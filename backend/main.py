@@ -13,10 +13,11 @@ This backend:
 import os
 import sys
 import asyncio
+import json
 from datetime import datetime
 from typing import Dict, Any, Optional
 from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -45,6 +46,13 @@ from savings_investment_agent import SavingsInvestmentAgent
 from bill_payment_agent import BillPaymentAgent
 from goals_agent import FinancialGoalsAgent
 from cashflow_agent import CashFlowMonitorAgent
+from fused_agent import FusedCoreAnalysisAgent
+from autogen_runtime import close_model_clients, get_run_stats, stream_task_events, llm_priority, data_digest_scope
+from llm_cache import response_cache
+import llm_metrics
+from model_router import router as model_router
+from llm_gateway import GatewayOverloaded, check_admission, gateway_stats
+from llm_hedging import policy as hedge_policy
 
 # Initialize FastAPI
 app = FastAPI(
@@ -72,6 +80,7 @@ app.add_middleware(
 # Request/Response Models
 class AnalysisRequest(BaseModel):
     user_id: str
+    fused: Optional[bool] = None  # None = FUSED_AGENT_MODE env default
 
 class AnalysisResponse(BaseModel):
     status: str
@@ -111,9 +120,19 @@ class AgentOrchestrator:
             "goals": FinancialGoalsAgent(mcp_servers),            # Financial goals
             "cashflow": CashFlowMonitorAgent(mcp_servers),        # NEW: Daily cash flow alerts
         }
+        # Fused mode: pattern, volatility, budget, risk and cashflow in one LLM request
+        self.fused_agent = FusedCoreAnalysisAgent(mcp_servers)
+        self.fused_agent_keys = {"pattern", "volatility", "budget", "risk", "cashflow"}
+        self.fused_mode = os.getenv("FUSED_AGENT_MODE", "false").lower() == "true"
 
-    async def run_all_agents(self, user_id: str) -> Dict[str, Any]:
-        """Run 7 core agents in sequence for efficient analysis"""
+    async def run_all_agents(self, user_id: str, fused: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Run 7 core agents in sequence for efficient analysis
+
+        In fused mode the five core agents (pattern, volatility, budget,
+        cashflow, risk) are answered by a single LLM request.
+        """
+        fused = self.fused_mode if fused is None else fused
 
         print(f"\n{'='*60}")
         print(f"Starting streamlined analysis for user {user_id}")
@@ -147,28 +166,53 @@ class AgentOrchestrator:
             ("goals", "Goal Tracker"),                # Milestones
         ]
 
-        for idx, (agent_key, agent_name) in enumerate(agent_names, 1):
-            print(f"\n[{idx}/10] Running {agent_name} Agent...")
-
-            try:
-                result = await self.agents[agent_key].analyze_user(user_id)
-                results["agents"][agent_key] = result
-
-                # Update status
-                analysis_status[user_id]["agents_completed"] = idx
-                analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
-
-                print(f"+ {agent_name} completed")
-
-            except Exception as e:
-                print(f"X {agent_name} failed: {str(e)}")
-                results["agents"][agent_key] = {
-                    "success": False,
-                    "error": str(e)
-                }
-
-            # Minimal pause between agents (reduced from 2s to 0.5s)
-            await asyncio.sleep(0.5)
+        # Agents without a precomputed digest share one per analysis
+        try:
+            with data_digest_scope():
+                if fused:
+                    print(f"\n[1-{len(self.fused_agent_keys)}/10] Running fused core analysis...")
+                    fused_result = await self.fused_agent.analyze_user(user_id)
+                    for agent_key in self.fused_agent_keys:
+                        results["agents"][agent_key] = fused_result["sections"].get(agent_key) or {
+                            "success": False,
+                            "error": fused_result.get("error", "Fused analysis failed")
+                        }
+                    analysis_status[user_id]["agents_completed"] = len(self.fused_agent_keys)
+                    analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
+                    print(f"{'+' if fused_result['success'] else 'X'} Fused core analysis completed")
+                    agent_names = [(key, name) for key, name in agent_names if key not in self.fused_agent_keys]
+
+                offset = len(results["agents"])
+                for idx, (agent_key, agent_name) in enumerate(agent_names, offset + 1):
+                    print(f"\n[{idx}/10] Running {agent_name} Agent...")
+
+                    try:
+                        result = await self.agents[agent_key].analyze_user(user_id)
+                        results["agents"][agent_key] = result
+
+                        # Update status
+                        analysis_status[user_id]["agents_completed"] = idx
+                        analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
+
+                        print(f"+ {agent_name} completed")
+
+                    except GatewayOverloaded:
+                        raise
+
+                    except Exception as e:
+                        print(f"X {agent_name} failed: {str(e)}")
+                        results["agents"][agent_key] = {
+                            "success": False,
+                            "error": str(e)
+                        }
+
+                    # Minimal pause between agents (reduced from 2s to 0.5s)
+                    await asyncio.sleep(0.5)
+        except GatewayOverloaded:
+            # LLM capacity is saturated: stop here so the caller can shed load
+            analysis_status[user_id]["status"] = "rejected"
+            analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
+            raise
 
         results["analysis_completed"] = datetime.now().isoformat()
 
@@ -187,6 +231,22 @@ class AgentOrchestrator:
 orchestrator = AgentOrchestrator()
 
 
+@app.exception_handler(GatewayOverloaded)
+async def gateway_overloaded_handler(request, exc: GatewayOverloaded):
+    """LLM capacity is saturated: ask the client to retry instead of queueing more work"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after))}
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_model_clients():
+    """Close pooled LLM connections"""
+    await close_model_clients()
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -222,8 +282,10 @@ async def trigger_analysis(request: AnalysisRequest, background_tasks: Backgroun
             detail=f"Analysis already in progress for user {user_id}"
         )
 
+    await check_admission()
+
     # Start analysis in background
-    background_tasks.add_task(orchestrator.run_all_agents, user_id)
+    background_tasks.add_task(orchestrator.run_all_agents, user_id, request.fused)
 
     return AnalysisResponse(
         status="started",
@@ -297,6 +359,35 @@ async def get_agent_logs(user_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to fetch agent logs: {str(e)}")
 
 
+@app.get("/api/analyze-stream/{agent_key}/{user_id}")
+async def analyze_stream(agent_key: str, user_id: str):
+    """
+    Run one agent and stream its output as server-sent events.
+    Events: delta (answer text as it is generated), tool_calls, cache_hit,
+    then done (the agent's result) or error.
+    """
+    agent = orchestrator.fused_agent if agent_key == "fused" else orchestrator.agents.get(agent_key)
+    if agent is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown agent '{agent_key}'. Available: {', '.join(orchestrator.agents)}"
+        )
+
+    await check_admission()
+
+    async def event_stream():
+        # A user is watching: serve ahead of background analyses
+        with llm_priority("interactive"):
+            async for event in stream_task_events(agent.analyze_user(user_id)):
+                yield f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/api/analyze-sync")
 async def trigger_analysis_sync(request: AnalysisRequest):
     """
@@ -311,9 +402,14 @@ async def trigger_analysis_sync(request: AnalysisRequest):
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
 
+    await check_admission()
+
     try:
-        results = await orchestrator.run_all_agents(user_id)
+        with llm_priority("interactive"):
+            results = await orchestrator.run_all_agents(user_id, request.fused)
         return results
+    except GatewayOverloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -359,16 +455,22 @@ async def trigger_quick_analysis(request: QuickAnalysisRequest, background_tasks
             ("cashflow", "Cash Flow Monitor"),
         ]
 
-        for idx, (agent_key, agent_name) in enumerate(quick_agents, 1):
-            print(f"\n[{idx}/3] Running {agent_name} Agent...")
-            try:
-                await orchestrator.agents[agent_key].analyze_user(user_id)
-                analysis_status[user_id]["agents_completed"] = idx
-                analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
-                print(f"+ {agent_name} completed")
-            except Exception as e:
-                print(f"X {agent_name} failed: {str(e)}")
-            await asyncio.sleep(0.3)
+        with data_digest_scope():
+            for idx, (agent_key, agent_name) in enumerate(quick_agents, 1):
+                print(f"\n[{idx}/3] Running {agent_name} Agent...")
+                try:
+                    await orchestrator.agents[agent_key].analyze_user(user_id)
+                    analysis_status[user_id]["agents_completed"] = idx
+                    analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
+                    print(f"+ {agent_name} completed")
+                except GatewayOverloaded as e:
+                    print(f"X {agent_name} rejected, stopping quick analysis: {str(e)}")
+                    analysis_status[user_id]["status"] = "rejected"
+                    analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
+                    return
+                except Exception as e:
+                    print(f"X {agent_name} failed: {str(e)}")
+                await asyncio.sleep(0.3)
 
         analysis_status[user_id]["status"] = "completed"
         analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
@@ -376,6 +478,8 @@ async def trigger_quick_analysis(request: QuickAnalysisRequest, background_tasks
         print(f"Quick analysis complete for user {user_id}")
         print(f"{'='*60}\n")
 
+    await check_admission()
+
     background_tasks.add_task(run_quick_agents, user_id)
 
     return {
@@ -408,9 +512,12 @@ async def match_government_schemes(user_id: str):
     try:
         print(f"\n[Scheme Matching] Running AI matching for user {user_id}")
 
+        await check_admission()
+
         # Run Knowledge Agent to match schemes
         knowledge_agent = orchestrator.agents["knowledge"]
-        result = await knowledge_agent.analyze_user(user_id)
+        with llm_priority("interactive"):
+            result = await knowledge_agent.analyze_user(user_id)
 
         print(f"[Scheme Matching] AI matching completed for user {user_id}")
 
@@ -422,6 +529,9 @@ async def match_government_schemes(user_id: str):
             "timestamp": datetime.now().isoformat()
         }
 
+    except GatewayOverloaded:
+        raise
+
     except Exception as e:
         print(f"[Scheme Matching] Error: {str(e)}")
         raise HTTPException(
@@ -454,6 +564,50 @@ async def health_check():
     }
 
 
+@app.get("/api/llm-cache/stats")
+async def llm_cache_stats():
+    """LLM response cache hit rate, overall and per agent"""
+    if response_cache is None:
+        return {"enabled": False}
+    return response_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """LLM usage and latency metrics in Prometheus text format"""
+    return PlainTextResponse(llm_metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/llm-usage")
+async def llm_usage():
+    """Per-agent token and wall-clock totals, most expensive first"""
+    return llm_metrics.registry.summary()
+
+
+@app.get("/api/agent-runs")
+async def agent_runs(limit: int = 50):
+    """Per-run accounting (turns, tokens, tool calls and latency), newest first"""
+    return {"runs": get_run_stats(limit)}
+
+
+@app.get("/api/llm-gateway")
+async def llm_gateway_stats():
+    """LLM gateway concurrency, queue depth and rejections"""
+    return await gateway_stats()
+
+
+@app.get("/api/llm-hedging")
+async def llm_hedging_stats():
+    """Hedged request counts and the per-deployment latencies behind the deadlines"""
+    return hedge_policy.stats()
+
+
+@app.get("/api/model-routes")
+async def model_routes():
+    """Per-agent deployment tier and output budget, with the measurements behind them"""
+    return model_router.snapshot()
+
+
 if __name__ == "__main__":
     import uvicorn
 
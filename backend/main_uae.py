@@ -12,13 +12,13 @@ This backend:
 
 import os
 import sys
+import hmac
 import asyncio
-from datetime import datetime
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, conint, conlist
 from dotenv import load_dotenv
 
 # Fix Windows console encoding for Unicode characters
@@ -41,6 +41,12 @@ from reorder_agent import ReorderAgent
 from uae_programs_agent import UAEProgramsAgent
 from recommendation_agent_uae import RecommendationAgent
 from sales_pattern_agent import SalesPatternAgent
+from batch_loader import batch_loader, prefetch_cache
+from transaction_frame import frame_scope
+from sales_rollups import sales_rollups
+from structured_log import get_logger
+
+log = get_logger("uae")
 
 # Initialize FastAPI
 app = FastAPI(
@@ -65,10 +71,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def transaction_frame_scope(request, call_next):
+    """Agents called by one request share transaction frames; the next request reads fresh rows"""
+    with frame_scope():
+        return await call_next(request)
+
+
 # Request/Response Models
 class AnalysisRequest(BaseModel):
     user_id: str
 
+class BatchAnalysisRequest(BaseModel):
+    user_ids: List[str]
+
+# Most shops one batch sales request may cover
+MAX_BATCH_SHOPS = int(os.getenv("MAX_BATCH_SHOPS", 100))
+# Longest demand prediction horizon (days)
+MAX_DEMAND_DAYS = 365
+
+class PeakTimesBatchRequest(BaseModel):
+    user_ids: conlist(str, min_length=1, max_length=MAX_BATCH_SHOPS)
+    days: conint(ge=1) = 30
+
+class ForecastBatchRequest(BaseModel):
+    user_ids: conlist(str, min_length=1, max_length=MAX_BATCH_SHOPS)
+    days_ahead: conint(ge=1) = 7
+
 class AnalysisResponse(BaseModel):
     status: str
     message: str
@@ -105,9 +134,7 @@ class UAEAgentOrchestrator:
     async def run_all_agents(self, user_id: str) -> Dict[str, Any]:
         """Run all 8 UAE agents in sequence"""
 
-        print(f"\n{'='*60}")
-        print(f"Starting StoreBuddy UAE analysis for user {user_id}")
-        print(f"{'='*60}\n")
+        log.info("UAE analysis started", extra={"user_id": user_id})
 
         results = {
             "user_id": user_id,
@@ -135,48 +162,52 @@ class UAEAgentOrchestrator:
             ("recommendation", "Recommendations", "التوصيات"),
         ]
 
-        for idx, (agent_key, agent_name, agent_name_ar) in enumerate(agent_sequence, 1):
-            print(f"\n[{idx}/8] Running {agent_name} Agent...")
+        # Agents share one transaction frame per analysis
+        with frame_scope():
+            for idx, (agent_key, agent_name, agent_name_ar) in enumerate(agent_sequence, 1):
+                log.info("[%d/8] Running %s agent", idx, agent_name, extra={"user_id": user_id})
 
-            try:
-                agent = self.agents[agent_key]
+                try:
+                    agent = self.agents[agent_key]
                 
-                # Call appropriate method based on agent
-                if agent_key == "profit":
-                    result = await agent.analyze(user_id)
-                elif agent_key == "credit_risk":
-                    result = await agent.get_collection_priority(user_id)
-                elif agent_key == "vat":
-                    result = await agent.calculate_vat_position(user_id)
-                elif agent_key == "business_health":
-                    result = await agent.calculate_health_score(user_id)
-                elif agent_key == "reorder":
-                    result = await agent.get_reorder_alerts(user_id)
-                elif agent_key == "uae_programs":
-                    result = await agent.find_matching_programs(user_id)
-                elif agent_key == "recommendation":
-                    result = await agent.get_daily_recommendations(user_id)
-                elif agent_key == "sales_pattern":
-                    result = await agent.analyze_patterns(user_id)
-                else:
-                    result = {"status": "unknown_agent"}
-
-                results["agents"][agent_key] = result
-
-                # Update status
-                analysis_status[user_id]["agents_completed"] = idx
-                analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
-
-                print(f"✓ {agent_name} completed")
-
-            except Exception as e:
-                print(f"✗ {agent_name} failed: {str(e)}")
-                results["agents"][agent_key] = {
-                    "status": "error",
-                    "error": str(e)
-                }
-
-            await asyncio.sleep(0.5)
+                    # Call appropriate method based on agent
+                    if agent_key == "profit":
+                        result = await agent.analyze(user_id)
+                    elif agent_key == "credit_risk":
+                        # Refresh trust scores first so the collection list ranks on current data
+                        await agent.recompute_trust_scores(user_id)
+                        result = await agent.get_collection_priority(user_id)
+                    elif agent_key == "vat":
+                        result = await agent.calculate_vat_position(user_id)
+                    elif agent_key == "business_health":
+                        result = await agent.calculate_health_score(user_id)
+                    elif agent_key == "reorder":
+                        result = await agent.get_reorder_alerts(user_id)
+                    elif agent_key == "uae_programs":
+                        result = await agent.find_matching_programs(user_id)
+                    elif agent_key == "recommendation":
+                        result = await agent.get_daily_recommendations(user_id)
+                    elif agent_key == "sales_pattern":
+                        result = await agent.analyze_patterns(user_id)
+                    else:
+                        result = {"status": "unknown_agent"}
+
+                    results["agents"][agent_key] = result
+
+                    # Update status
+                    analysis_status[user_id]["agents_completed"] = idx
+                    analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
+
+                    log.info("%s completed", agent_name, extra={"user_id": user_id})
+
+                except Exception as e:
+                    log.warning("%s failed: %s", agent_name, e, extra={"user_id": user_id})
+                    results["agents"][agent_key] = {
+                        "status": "error",
+                        "error": str(e)
+                    }
+
+                await asyncio.sleep(0.5)
 
         results["analysis_completed"] = datetime.now().isoformat()
 
@@ -184,12 +215,52 @@ class UAEAgentOrchestrator:
         analysis_status[user_id]["status"] = "completed"
         analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
 
-        print(f"\n{'='*60}")
-        print(f"Analysis complete for user {user_id}")
-        print(f"{'='*60}\n")
+        log.info("UAE analysis complete", extra={"user_id": user_id})
+
+        return results
+
+    async def run_scheduled_cycle(self, user_ids: List[str]) -> Dict[str, Any]:
+        """
+        Run all agents for many shops (nightly cycle).
+        Data is prefetched one chunk of users at a time so each table costs
+        one paged query per chunk instead of one query per user.
+        """
+        results = {}
+
+        for chunk in batch_loader.chunks(user_ids):
+            log.info("Prefetching data for %d users", len(chunk))
+            try:
+                per_user = await batch_loader.load_chunk(chunk)
+            except Exception as e:
+                # Agents fall back to their own per-user queries
+                log.warning("Prefetch failed for %d users: %s", len(chunk), e)
+                per_user = {}
+            try:
+                if sales_rollups is not None:
+                    await self._rebuild_rollups(per_user)
+                with frame_scope():
+                    for user_id in chunk:
+                        results[user_id] = await self.run_all_agents(user_id)
+            finally:
+                prefetch_cache.clear(chunk)
 
         return results
 
+    async def _rebuild_rollups(self, per_user: Dict[str, Dict[str, List[Dict]]]):
+        """
+        Reseed the rollups from the prefetched window; its first (partial) day
+        is not claimed. Users whose transaction read failed keep their previous
+        buckets, which expire on their own.
+        """
+        since = datetime.now() - timedelta(days=179)
+        for user_id, tables in per_user.items():
+            if 'transactions' not in tables:
+                continue
+            try:
+                await asyncio.to_thread(sales_rollups.rebuild, user_id, tables['transactions'], since)
+            except Exception as e:
+                log.warning("Rollup rebuild failed: %s", e, extra={"user_id": user_id})
+
 
 # Global orchestrator instance
 orchestrator = UAEAgentOrchestrator()
@@ -235,6 +306,27 @@ async def trigger_analysis(request: AnalysisRequest, background_tasks: Backgroun
     )
 
 
+@app.post("/api/analyze-batch")
+async def trigger_batch_analysis(request: BatchAnalysisRequest, background_tasks: BackgroundTasks):
+    """
+    Trigger analysis for many shops with chunked data prefetching
+    """
+    user_ids = [u for u in request.user_ids if u]
+
+    if not user_ids:
+        raise HTTPException(status_code=400, detail="user_ids is required")
+
+    background_tasks.add_task(orchestrator.run_scheduled_cycle, user_ids)
+
+    return {
+        "status": "started",
+        "message": f"Batch analysis started for {len(user_ids)} users",
+        "user_count": len(user_ids),
+        "chunk_size": batch_loader.chunk_size,
+        "analysis_started": datetime.now().isoformat()
+    }
+
+
 @app.get("/api/status/{user_id}", response_model=StatusResponse)
 async def get_analysis_status(user_id: str):
     """Get current status of analysis for a user"""
@@ -277,6 +369,16 @@ async def get_customer_trust_score(user_id: str, customer_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/credit/trust-scores/{user_id}/recompute")
+async def recompute_trust_scores(user_id: str):
+    """Recompute and save trust scores for all of a shop's customers"""
+    try:
+        result = await orchestrator.agents["credit_risk"].recompute_trust_scores(user_id)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/credit/collection-priority/{user_id}")
 async def get_collection_priority(user_id: str):
     """Get prioritized list of customers for credit collection"""
@@ -392,8 +494,18 @@ async def get_reorder_alerts(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/reorder/predict/{user_id}")
+async def predict_demand_bulk(user_id: str, days_ahead: int = Query(30, ge=1, le=MAX_DEMAND_DAYS)):
+    """Predict demand for every active inventory item"""
+    try:
+        result = await orchestrator.agents["reorder"].predict_demand_bulk(user_id, days_ahead)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/reorder/predict/{user_id}/{item_id}")
-async def predict_demand(user_id: str, item_id: str, days_ahead: int = 30):
+async def predict_demand(user_id: str, item_id: str, days_ahead: int = Query(30, ge=1, le=MAX_DEMAND_DAYS)):
     """Predict demand for a specific item"""
     try:
         result = await orchestrator.agents["reorder"].predict_demand(user_id, item_id, days_ahead)
@@ -492,15 +604,25 @@ async def get_sales_patterns(user_id: str, days: int = 90):
 
 
 @app.get("/api/sales/peak-times/{user_id}")
-async def get_peak_times(user_id: str):
+async def get_peak_times(user_id: str, days: int = Query(30, ge=1)):
     """Identify peak selling times"""
     try:
-        result = await orchestrator.agents["sales_pattern"].get_peak_times(user_id)
+        result = await orchestrator.agents["sales_pattern"].get_peak_times(user_id, days)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/sales/peak-times/batch")
+async def get_peak_times_batch(request: PeakTimesBatchRequest):
+    """Peak selling times and 7x24 heatmaps for several shops"""
+    try:
+        results = await orchestrator.agents["sales_pattern"].get_peak_times_bulk(request.user_ids, request.days)
+        return {"status": "success", "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/sales/customers/{user_id}")
 async def get_customer_segments(user_id: str):
     """Get customer segments based on transaction patterns"""
@@ -512,7 +634,7 @@ async def get_customer_segments(user_id: str):
 
 
 @app.get("/api/sales/forecast/{user_id}")
-async def forecast_sales(user_id: str, days_ahead: int = 7):
+async def forecast_sales(user_id: str, days_ahead: int = Query(7, ge=1)):
     """Forecast sales for next N days"""
     try:
         result = await orchestrator.agents["sales_pattern"].forecast_sales(user_id, days_ahead)
@@ -521,6 +643,35 @@ async def forecast_sales(user_id: str, days_ahead: int = 7):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/sales/forecast/batch")
+async def forecast_sales_batch(request: ForecastBatchRequest):
+    """Sales forecasts for several shops, fitted together"""
+    try:
+        results = await orchestrator.agents["sales_pattern"].forecast_sales_bulk(request.user_ids, request.days_ahead)
+        return {"status": "success", "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/webhooks/transactions")
+async def transaction_webhook(event: Dict[str, Any], x_webhook_secret: Optional[str] = Header(None)):
+    """
+    Database webhook for the transactions table (INSERT/UPDATE/DELETE).
+    Keeps the sales rollups current between scheduled cycles; redelivered
+    events are applied once.
+    """
+    secret = os.getenv("ROLLUP_WEBHOOK_SECRET")
+    if not secret:
+        raise HTTPException(status_code=503, detail="Webhook secret is not configured")
+    if not hmac.compare_digest(x_webhook_secret or "", secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    if sales_rollups is None:
+        return {"status": "skipped", "message": "Sales rollups are disabled"}
+
+    applied = await asyncio.to_thread(sales_rollups.apply_event, event)
+    return {"status": "success" if applied else "ignored", "applied": applied}
+
+
 # ===== QUICK ANALYSIS =====
 @app.post("/api/analyze-quick")
 async def trigger_quick_analysis(request: AnalysisRequest, background_tasks: BackgroundTasks):
@@ -541,9 +692,7 @@ async def trigger_quick_analysis(request: AnalysisRequest, background_tasks: Bac
 
     async def run_quick_agents(user_id: str):
         """Run only 3 essential agents"""
-        print(f"\n{'='*60}")
-        print(f"Starting QUICK analysis for user {user_id}")
-        print(f"{'='*60}\n")
+        log.info("Quick analysis started", extra={"user_id": user_id})
 
         analysis_status[user_id] = {
             "status": "in_progress",
@@ -559,7 +708,7 @@ async def trigger_quick_analysis(request: AnalysisRequest, background_tasks: Bac
         ]
 
         for idx, (agent_key, agent_name) in enumerate(quick_agents, 1):
-            print(f"\n[{idx}/3] Running {agent_name} Agent...")
+            log.info("[%d/3] Running %s agent", idx, agent_name, extra={"user_id": user_id})
             try:
                 agent = orchestrator.agents[agent_key]
                 if agent_key == "profit":
@@ -571,16 +720,14 @@ async def trigger_quick_analysis(request: AnalysisRequest, background_tasks: Bac
                     
                 analysis_status[user_id]["agents_completed"] = idx
                 analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
-                print(f"✓ {agent_name} completed")
+                log.info("%s completed", agent_name, extra={"user_id": user_id})
             except Exception as e:
-                print(f"✗ {agent_name} failed: {str(e)}")
+                log.warning("%s failed: %s", agent_name, e, extra={"user_id": user_id})
             await asyncio.sleep(0.3)
 
         analysis_status[user_id]["status"] = "completed"
         analysis_status[user_id]["last_updated"] = datetime.now().isoformat()
-        print(f"\n{'='*60}")
-        print(f"Quick analysis complete for user {user_id}")
-        print(f"{'='*60}\n")
+        log.info("Quick analysis complete", extra={"user_id": user_id})
 
     background_tasks.add_task(run_quick_agents, user_id)
 
@@ -0,0 +1,260 @@
+"""
+Model Router
+Maps each agent to a deployment tier and output budget, adjusted from measured
+latency, truncation and schema-validation results.
+
+Tiers (smallest first), each naming an Azure deployment:
+    small     AZURE_OPENAI_DEPLOYMENT_SMALL   (defaults to AZURE_OPENAI_DEPLOYMENT)
+    standard  AZURE_OPENAI_DEPLOYMENT
+    large     AZURE_OPENAI_MODEL_FALLBACK     (defaults to AZURE_OPENAI_DEPLOYMENT)
+
+A run starts on the agent's routed tier; an answer that fails its schema is
+retried once on the next larger tier with a distinct deployment.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+
+from structured_log import get_logger
+
+
+log = get_logger("model_router")
+
+TIERS = ("small", "standard", "large")
+
+# Output budgets are never adapted outside these bounds
+MIN_MAX_TOKENS = 512
+MAX_MAX_TOKENS = 8192
+# Output budget = this multiple of the largest recent completion
+HEADROOM = 1.5
+# Below this schema success rate (over the recent window) an agent is promoted
+PROMOTE_BELOW_SUCCESS = 0.8
+# Outcomes remembered per agent, and how many are needed before adjusting
+WINDOW = 20
+MIN_SAMPLES = 3
+# Weight of the newest sample in latency averages
+EWMA_ALPHA = 0.3
+# Latency averages not updated for this long are ignored, so a tier that was
+# skipped for being slow gets routed to (and measured) again
+LATENCY_MAX_AGE_SECONDS = 600
+
+
+@dataclass
+class Route:
+    tier: str
+    max_tokens: int
+
+
+# Starting routes; outputs like bill lists or a cash flow status are small
+DEFAULT_ROUTES: Dict[str, Route] = {
+    "pattern_agent": Route("small", 1024),
+    "volatility_agent": Route("small", 1536),
+    "cashflow_agent": Route("small", 1024),
+    "bill_payment_agent": Route("small", 1536),
+    "action_agent": Route("small", 1536),
+    "financial_agent": Route("small", 1536),
+    "risk_agent": Route("small", 2048),
+    "goals_agent": Route("small", 2048),
+    "budget_agent": Route("standard", 2048),
+    "savings_investment_agent": Route("standard", 2048),
+    "recommendation_agent": Route("standard", 3072),
+    "tax_agent": Route("standard", 3072),
+    "knowledge_agent": Route("standard", 4096),
+    "fused_agent": Route("standard", 4096),
+}
+DEFAULT_ROUTE = Route("standard", MAX_MAX_TOKENS)
+
+
+def tier_deployments() -> Dict[str, str]:
+    standard = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4.1")
+    return {
+        "small": os.getenv("AZURE_OPENAI_DEPLOYMENT_SMALL", standard),
+        "standard": standard,
+        "large": os.getenv("AZURE_OPENAI_MODEL_FALLBACK", standard),
+    }
+
+
+def _parse_routes(raw: str) -> Dict[str, Route]:
+    """"bill_payment_agent=small:1024,tax_agent=large:4096" -> {agent: Route}"""
+    routes = {}
+    for part in raw.split(","):
+        name, _, spec = part.partition("=")
+        tier, _, max_tokens = spec.partition(":")
+        if name.strip() and tier.strip() in TIERS and max_tokens.strip().isdigit():
+            routes[name.strip()] = Route(tier.strip(), int(max_tokens))
+    return routes
+
+
+@dataclass
+class AgentHistory:
+    """Recent outcomes for one agent"""
+    validations: deque = field(default_factory=lambda: deque(maxlen=WINDOW))
+    completion_tokens: deque = field(default_factory=lambda: deque(maxlen=WINDOW))
+    truncations: int = 0
+    promoted_tier: Optional[str] = None
+    max_tokens: Optional[int] = None
+
+    def success_rate(self) -> Optional[float]:
+        if len(self.validations) < MIN_SAMPLES:
+            return None
+        return sum(self.validations) / len(self.validations)
+
+
+@dataclass
+class RouteDecision:
+    agent_name: str
+    tier: str
+    deployment: str
+    max_tokens: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"agent": self.agent_name, "tier": self.tier,
+                "deployment": self.deployment, "max_tokens": self.max_tokens}
+
+
+class ModelRouter:
+    """
+    Routing table plus the measurements that adjust it:
+    - max_tokens tracks HEADROOM x the largest recent completion and doubles
+      after a truncated ("length") answer
+    - an agent whose schema success rate drops below PROMOTE_BELOW_SUCCESS
+      moves up a tier; it moves back down once the larger tier is reliable
+    - if a smaller tier's deployment is currently slower than the next tier's
+      for the same agent (e.g. throttled), the faster deployment is used.
+      Latency is tracked per (agent, deployment), since agents with long
+      outputs are slower on every deployment; the comparison needs samples
+      of the agent on both deployments from the last LATENCY_MAX_AGE_SECONDS.
+      A skipped tier's sample expires, so the agent goes back to it and the
+      comparison is made again on fresh numbers
+    """
+
+    def __init__(self, routes: Optional[Dict[str, Route]] = None,
+                 deployments: Optional[Dict[str, str]] = None):
+        self.routes = dict(DEFAULT_ROUTES)
+        self.routes.update(routes or {})
+        self.deployments = deployments or tier_deployments()
+        self._history: Dict[str, AgentHistory] = {}
+        # (agent, deployment) -> (EWMA seconds per request, monotonic time of the last sample)
+        self._latency: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        return cls(routes=_parse_routes(os.getenv("MODEL_ROUTES", "")))
+
+    def _agent(self, agent_name: str) -> AgentHistory:
+        history = self._history.get(agent_name)
+        if history is None:
+            history = self._history[agent_name] = AgentHistory()
+        return history
+
+    def _recent_latency(self, agent_name: str, deployment: str, now: float) -> Optional[float]:
+        sample = self._latency.get((agent_name, deployment))
+        if sample is None or now - sample[1] > LATENCY_MAX_AGE_SECONDS:
+            return None
+        return sample[0]
+
+    def route(self, agent_name: str) -> RouteDecision:
+        base = self.routes.get(agent_name, DEFAULT_ROUTE)
+        with self._lock:
+            history = self._agent(agent_name)
+            tier = history.promoted_tier or base.tier
+            max_tokens = history.max_tokens or base.max_tokens
+
+            # Skip to the next tier while it is a different, faster deployment
+            now = time.monotonic()
+            index = TIERS.index(tier)
+            while index + 1 < len(TIERS):
+                current = self._recent_latency(agent_name, self.deployments[TIERS[index]], now)
+                bigger = self._recent_latency(agent_name, self.deployments[TIERS[index + 1]], now)
+                if self.deployments[TIERS[index]] == self.deployments[TIERS[index + 1]]:
+                    break
+                if current is None or bigger is None or current <= bigger:
+                    break
+                index += 1
+            tier = TIERS[index]
+
+        return RouteDecision(agent_name, tier, self.deployments[tier], max_tokens)
+
+    def escalate(self, decision: RouteDecision) -> Optional[RouteDecision]:
+        """Next larger tier with a different deployment, or None"""
+        for tier in TIERS[TIERS.index(decision.tier) + 1:]:
+            if self.deployments[tier] != decision.deployment:
+                max_tokens = min(MAX_MAX_TOKENS, max(decision.max_tokens, self.routes.get(
+                    decision.agent_name, DEFAULT_ROUTE).max_tokens) * 2)
+                return RouteDecision(decision.agent_name, tier, self.deployments[tier], max_tokens)
+        return None
+
+    def record_latency(self, agent_name: str, deployment: str, seconds: float):
+        """One HTTP round trip of an agent's request against a deployment"""
+        key = (agent_name, deployment)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._recent_latency(agent_name, deployment, now)
+            self._latency[key] = (seconds if previous is None else (
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous), now)
+
+    def record_result(self, decision: RouteDecision, valid: bool,
+                      completion_tokens: int = 0, truncated: bool = False):
+        """Outcome of one answer produced under a routing decision"""
+        base = self.routes.get(decision.agent_name, DEFAULT_ROUTE)
+        with self._lock:
+            history = self._agent(decision.agent_name)
+            history.validations.append(1 if valid else 0)
+
+            if truncated:
+                history.truncations += 1
+                history.max_tokens = min(MAX_MAX_TOKENS, decision.max_tokens * 2)
+            elif valid and completion_tokens:
+                history.completion_tokens.append(completion_tokens)
+                if len(history.completion_tokens) >= MIN_SAMPLES:
+                    target = int(max(history.completion_tokens) * HEADROOM)
+                    history.max_tokens = max(MIN_MAX_TOKENS, min(MAX_MAX_TOKENS, target))
+
+            rate = history.success_rate()
+            if rate is None:
+                return
+            tier = history.promoted_tier or base.tier
+            if rate < PROMOTE_BELOW_SUCCESS and tier != TIERS[-1]:
+                history.promoted_tier = TIERS[TIERS.index(tier) + 1]
+                history.validations.clear()
+                log.warning("%s: schema success %.0f%%, promoting to %s",
+                            decision.agent_name, rate * 100, history.promoted_tier)
+            elif rate == 1.0 and history.promoted_tier and len(history.validations) == WINDOW:
+                history.promoted_tier = None if TIERS.index(tier) - 1 <= TIERS.index(base.tier) \
+                    else TIERS[TIERS.index(tier) - 1]
+                history.validations.clear()
+                log.info("%s: reliable on %s, returning to %s",
+                         decision.agent_name, tier, history.promoted_tier or base.tier)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current routes, adjustments and deployment latencies"""
+        with self._lock:
+            latency: Dict[str, Dict[str, float]] = {}
+            for (agent_name, deployment), (seconds, _) in self._latency.items():
+                latency.setdefault(agent_name, {})[deployment] = round(seconds, 3)
+            agents = {}
+            for name in sorted(set(self.routes) | set(self._history) | set(latency)):
+                base = self.routes.get(name, DEFAULT_ROUTE)
+                history = self._history.get(name)
+                rate = history.success_rate() if history else None
+                agents[name] = {
+                    "base_tier": base.tier,
+                    "base_max_tokens": base.max_tokens,
+                    "tier": (history.promoted_tier if history else None) or base.tier,
+                    "max_tokens": (history.max_tokens if history else None) or base.max_tokens,
+                    "schema_success_rate": round(rate, 3) if rate is not None else None,
+                    "truncations": history.truncations if history else 0,
+                    "latency_ewma_seconds": latency.get(name, {}),
+                }
+            return {
+                "deployments": dict(self.deployments),
+                "agents": agents,
+            }
+
+
+router = ModelRouter.from_env()
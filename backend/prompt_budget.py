@@ -0,0 +1,253 @@
+"""
+Prompt Budget
+Prompt layout and per-agent token ceilings.
+
+Requests are assembled as [tools][system prompt][task], where tools and the
+system prompt are the static, byte-identical prefix that provider-side prompt
+caching can reuse, and the task carries everything per-user. When the prompt
+is over the agent's ceiling only the task is trimmed: embedded JSON context
+blocks are shrunk first (long lists keep their ends), then the task middle.
+Tool results added during the tool loop are held to what is left of the
+same ceiling, shrunk the same way and marked as trimmed.
+"""
+
+import os
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+from llm_rate_limiter import CHARS_PER_TOKEN, MESSAGE_OVERHEAD_TOKENS
+from structured_log import get_logger
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # optional dependency (or its encoding files) unavailable
+    _ENCODING = None
+
+
+log = get_logger("prompt_budget")
+
+DEFAULT_PROMPT_TOKEN_BUDGET = 6000
+# Lists inside context blocks are never cut below this many items
+MIN_LIST_ITEMS = 4
+TRIM_MARKER = "\n...[{} tokens of context trimmed to fit the prompt budget]...\n"
+# Each tool result keeps at least this many tokens, even over budget
+MIN_TOOL_RESULT_TOKENS = 256
+# Appended to a trimmed tool result so the model knows it is looking at part of the data
+TOOL_TRIM_NOTE = "\n[tool result trimmed by {} tokens to fit the prompt budget; query a narrower range for the rest]"
+OMITTED_MARKER = "...[{} items omitted]"
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text (tiktoken when installed, otherwise a character estimate)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN
+
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Tokens in chat messages, including the tool calls of assistant turns"""
+    total = 0
+    for m in messages:
+        total += count_tokens(m.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        if m.get("tool_calls"):
+            total += count_tokens(json.dumps(m["tool_calls"], separators=(",", ":")))
+    return total
+
+
+def count_tool_tokens(tools: Optional[List[Dict[str, Any]]]) -> int:
+    """Tokens the tool schemas add to every request"""
+    return count_tokens(json.dumps(tools, separators=(",", ":"))) if tools else 0
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    """"tax_agent=8000,knowledge_agent=5000" -> {agent: ceiling}"""
+    budgets = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip().isdigit():
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+class TokenBudgeter:
+    """Per-agent prompt token ceilings and the trimming that enforces them"""
+
+    def __init__(self, default_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+                 agent_budgets: Optional[Dict[str, int]] = None):
+        self.default_budget = default_budget
+        self.agent_budgets = agent_budgets or {}
+
+    @classmethod
+    def from_env(cls) -> "TokenBudgeter":
+        return cls(
+            default_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", DEFAULT_PROMPT_TOKEN_BUDGET)),
+            agent_budgets=_parse_budgets(os.getenv("PROMPT_TOKEN_BUDGETS", ""))
+        )
+
+    def budget_for(self, agent_name: str) -> int:
+        return self.agent_budgets.get(agent_name, self.default_budget)
+
+    def fit(self, agent_name: str, system_prompt: str, task: str,
+            tools: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, Dict[str, int]]:
+        """
+        Trim the task so tool schemas + system prompt + task fit the agent's
+        ceiling. Returns the (possibly) trimmed task and a report of the
+        token counts.
+        """
+        budget = self.budget_for(agent_name)
+        static_tokens = count_tool_tokens(tools) + count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        task_tokens = count_tokens(task) + MESSAGE_OVERHEAD_TOKENS
+        report = {
+            "budget": budget,
+            "static_tokens": static_tokens,
+            "task_tokens": task_tokens,
+            "trimmed_tokens": 0
+        }
+        allowance = budget - static_tokens - MESSAGE_OVERHEAD_TOKENS
+        if task_tokens - MESSAGE_OVERHEAD_TOKENS <= allowance:
+            return task, report
+
+        if allowance <= 0:
+            log.warning("%s: system prompt alone (%d tokens) exceeds budget %d", agent_name, static_tokens, budget)
+            allowance = 0
+
+        fitted = _shrink_context_lines(task, allowance)
+        if count_tokens(fitted) > allowance:
+            fitted = _truncate_middle(fitted, allowance)
+
+        report["trimmed_tokens"] = task_tokens - MESSAGE_OVERHEAD_TOKENS - count_tokens(fitted)
+        report["task_tokens"] = count_tokens(fitted) + MESSAGE_OVERHEAD_TOKENS
+        log.info("%s: trimmed %d tokens to fit %d", agent_name, report["trimmed_tokens"], budget)
+        return fitted, report
+
+    def fit_tool_results(self, agent_name: str, messages: List[Dict[str, Any]],
+                         results: List[Dict[str, Any]],
+                         tools: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, Any]], int, int]:
+        """
+        Shrink tool-result messages so the conversation so far (messages and
+        tool schemas) plus the results fit the agent's ceiling; the remaining
+        allowance is split evenly between the results. JSON results are
+        shrunk like context blocks, anything else loses its middle, and every
+        shrunk result ends with a note saying how much was dropped.
+        Returns the results, the number of tokens trimmed and the number of
+        results that were shrunk.
+        """
+        budget = self.budget_for(agent_name)
+        used = count_tool_tokens(tools) + count_message_tokens(messages) + MESSAGE_OVERHEAD_TOKENS * len(results)
+        sizes = [count_tokens(r.get("content") or "") for r in results]
+        if not results or used + sum(sizes) <= budget:
+            return results, 0, 0
+
+        share = max(MIN_TOOL_RESULT_TOKENS, (budget - used) // len(results))
+        # Room for the note itself
+        share_body = max(0, share - count_tokens(TOOL_TRIM_NOTE.format(max(sizes))))
+        trimmed = shrunk = 0
+        for result, size in zip(results, sizes):
+            if size <= share:
+                continue
+            content = result["content"]
+            try:
+                content = json.dumps(shrink_json(json.loads(content), share_body), separators=(",", ":"), default=str)
+            except json.JSONDecodeError:
+                pass
+            content = _truncate_middle(content, share_body)
+            dropped = size - count_tokens(content)
+            content += TOOL_TRIM_NOTE.format(dropped)
+            trimmed += dropped
+            shrunk += 1
+            result["content"] = content
+        log.warning("%s: trimmed %d tokens from %d tool result(s) to fit %d", agent_name, trimmed, shrunk, budget)
+        return results, trimmed, shrunk
+
+
+def shrink_json(value: Any, max_tokens: int) -> Any:
+    """
+    Halve the longest list in a JSON value until it fits max_tokens (or no
+    list can shrink further). Kept items are the first and last ones, with a
+    marker string recording how many were dropped.
+    """
+    def render(v):
+        return json.dumps(v, separators=(",", ":"), default=str)
+
+    while count_tokens(render(value)) > max_tokens:
+        longest = _longest_list(value)
+        if longest is None:
+            break
+        # Fold an earlier marker into the new one
+        dropped = sum(_omitted_count(item) for item in longest)
+        items = [item for item in longest if not _omitted_count(item)]
+        keep = max(MIN_LIST_ITEMS, len(items) // 2)
+        head, tail = keep - keep // 2, keep // 2
+        dropped += len(items) - keep
+        longest[:] = items[:head] + [OMITTED_MARKER.format(dropped)] + items[len(items) - tail:]
+    return value
+
+
+def _omitted_count(item: Any) -> int:
+    if isinstance(item, str) and item.startswith("...[") and item.endswith(" items omitted]"):
+        return int(item[4:].split()[0])
+    return 0
+
+
+def _longest_list(value: Any) -> Optional[list]:
+    """Longest list that can still be shrunk"""
+    best = None
+    stack = [value]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            if len(current) > MIN_LIST_ITEMS + 1 and (best is None or len(current) > len(best)):
+                best = current
+            stack.extend(current)
+    return best
+
+
+def _shrink_context_lines(task: str, allowance: int) -> str:
+    """Shrink the JSON blocks embedded in a task (one per line, as render_context emits them)"""
+    lines = task.split("\n")
+    blocks = []
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped[:1] in ("{", "[") and len(stripped) > 200:
+            try:
+                blocks.append((i, json.loads(stripped)))
+            except json.JSONDecodeError:
+                continue
+    if not blocks:
+        return task
+
+    other_tokens = count_tokens("\n".join(l for i, l in enumerate(lines) if i not in dict(blocks)))
+    share = max(0, allowance - other_tokens) // len(blocks)
+    for i, value in blocks:
+        lines[i] = json.dumps(shrink_json(value, share), separators=(",", ":"), default=str)
+    return "\n".join(lines)
+
+
+def _truncate_middle(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of the text (instructions and the closing ask)"""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    keep_chars = int(len(text) * max_tokens / total)
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    return text[:head] + TRIM_MARKER.format(total - max_tokens) + (text[-tail:] if tail else "")
+
+
+def build_messages(system_prompt: str, task: str) -> List[Dict[str, Any]]:
+    """
+    Chat messages with the static prefix first. The system prompt is sent
+    exactly as the agent defined it so its bytes match across calls.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": task}
+    ]
+
+
+budgeter = TokenBudgeter.from_env()
@@ -0,0 +1,206 @@
+"""
+Structured Logging
+Non-blocking JSON logging for the agent hot path.
+
+Records are handed to a QueueHandler and written to stdout by a background
+QueueListener thread, so request handlers never block on terminal I/O. Each
+record carries the current run's correlation ID and agent, string payload
+fields are truncated, and INFO/DEBUG records from sampled loggers are kept
+for a deterministic fraction of runs (a sampled run logs completely).
+
+Env:
+    LOG_LEVEL              DEBUG | INFO | WARNING ... (default INFO)
+    LOG_FORMAT             json | text (default json)
+    LOG_MAX_FIELD_CHARS    truncate payload strings to this length (default 500)
+    LOG_SAMPLE_RATES       logger=rate pairs, e.g. "kamai.payload=0.05,kamai.llm=0.5"
+"""
+
+import os
+import sys
+import json
+import uuid
+import zlib
+import queue
+import atexit
+import logging
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+
+ROOT_LOGGER = "kamai"
+# Default sampling: full prompts/responses are kept for 5% of runs
+DEFAULT_SAMPLE_RATES = {f"{ROOT_LOGGER}.payload": 0.05}
+DEFAULT_MAX_FIELD_CHARS = 500
+
+_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_run_id", default=None)
+_agent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_agent", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def correlation(run_id: str, agent: Optional[str] = None):
+    """Tag every record logged inside the block with run_id (and agent)"""
+    run_token = _run_id.set(run_id)
+    agent_token = _agent.set(agent) if agent is not None else None
+    try:
+        yield run_id
+    finally:
+        _run_id.reset(run_token)
+        if agent_token is not None:
+            _agent.reset(agent_token)
+
+
+def current_run_id() -> Optional[str]:
+    return _run_id.get()
+
+
+def _truncate(value: Any, limit: int) -> Any:
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + f"...[+{len(value) - limit} chars]"
+    return value
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the correlation ID and agent of the current context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "run_id"):
+            record.run_id = _run_id.get()
+        if not hasattr(record, "agent"):
+            record.agent = _agent.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps INFO/DEBUG records of a logger (and its children) for `rate` of
+    runs, chosen by hashing the run ID so a run is either logged fully or not
+    at all. WARNING and above always pass.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Longest prefix wins
+        self.rates = sorted(rates.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def _rate(self, name: str) -> Optional[float]:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1:
+            return True
+        key = getattr(record, "run_id", None) or f"{record.name}:{record.msg}"
+        return (zlib.crc32(key.encode()) % 10000) < rate * 10000
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; `extra` fields become top-level keys"""
+
+    def __init__(self, max_field_chars: int = DEFAULT_MAX_FIELD_CHARS):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            # Warnings and errors keep their full message (tracebacks included)
+            "msg": record.getMessage() if record.levelno >= logging.WARNING
+                   else _truncate(record.getMessage(), self.max_field_chars),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and value is not None:
+                entry[key] = _truncate(value, self.max_field_chars)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line format for local development"""
+
+    def __init__(self, max_field_chars: int = DEFAULT_MAX_FIELD_CHARS):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RESERVED and v is not None}
+        if fields:
+            line += " " + " ".join(f"{k}={_truncate(v, self.max_field_chars)!r}" for k, v in fields.items())
+        return line
+
+
+def _parse_rates(raw: str) -> Dict[str, float]:
+    rates = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        try:
+            rates[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return rates
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Install the queue handler on the package logger (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    max_chars = int(os.getenv("LOG_MAX_FIELD_CHARS", DEFAULT_MAX_FIELD_CHARS))
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter(max_chars) if fmt == "text" else JSONFormatter(max_chars))
+
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    rates.update(_parse_rates(os.getenv("LOG_SAMPLE_RATES", "")))
+
+    # Unbounded queue: put_nowait never blocks the caller
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler = logging.handlers.QueueHandler(log_queue)
+    # Filters run on the caller's thread, where the context variables live
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    root.addHandler(handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the package root, configuring logging on first use"""
+    configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -0,0 +1,41 @@
+"""
+Fused answers written end to end: every section must validate and reach
+its own table write, so fused runs are cached and not counted as invalid.
+"""
+
+import json
+import asyncio
+
+import requests
+
+import llm_metrics
+import autogen_runtime
+from agent_output import parse_agent_output
+from llm_stub_server import _canned_responses
+
+
+class _Created:
+    status_code = 201
+    text = ""
+
+
+def test_cashflow_section_validates_unwrapped():
+    cashflow = _canned_responses()["fused_agent"]["cashflow_status"]
+    assert parse_agent_output("cashflow_agent", json.dumps(cashflow)).ok
+
+
+def test_fused_payload_written_end_to_end(monkeypatch):
+    posted = []
+    invalid = []
+    monkeypatch.setattr(requests, "post", lambda url, **kwargs: posted.append(url) or _Created())
+    monkeypatch.setattr(llm_metrics, "record_invalid_output", lambda agent, stage: invalid.append((agent, stage)))
+
+    fused = _canned_responses()["fused_agent"]
+    written = asyncio.run(autogen_runtime.write_agent_output_to_db(
+        "user-1", autogen_runtime.FUSED_AGENT_NAME, json.dumps(fused)
+    ))
+
+    assert written is True
+    assert invalid == []
+    tables = {url.rsplit("/", 1)[-1] for url in posted}
+    assert {"income_patterns", "risk_assessments", "budgets"} <= tables
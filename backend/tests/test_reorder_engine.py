@@ -0,0 +1,87 @@
+"""
+Reorder kernel: safety stock and reorder points, EOQ capped by cover days,
+and order quantities that honour both the supplier minimum and pack sizes.
+"""
+
+import numpy as np
+import pytest
+
+from reorder_engine import (
+    reorder_kernel, service_level_z, URGENCY_LEVELS, NO_DEMAND_DAYS,
+    DEFAULT_ORDER_COST_AED, ANNUAL_HOLDING_RATE
+)
+
+
+def _kernel(**overrides):
+    """One SKU per array entry; defaults describe a steadily selling item"""
+    columns = {
+        'stock': [10.0],
+        'demand': [4.0],
+        'demand_std': [2.0],
+        'lead_time': [4.0],
+        'service_z': [1.645],
+        'pack_size': [1.0],
+        'min_order_qty': [0.0],
+        'unit_cost': [10.0],
+        'max_cover_days': [60.0],
+        'static_reorder_point': [0.0],
+    }
+    columns.update(overrides)
+    size = max(len(v) for v in columns.values())
+    arrays = {k: np.resize(np.asarray(v, dtype=np.float64), size) for k, v in columns.items()}
+    return reorder_kernel(**arrays)
+
+
+def test_service_level_z():
+    np.testing.assert_allclose(service_level_z([0.5, 0.95]), [0.0, 1.645], atol=1e-3)
+
+
+def test_safety_stock_and_reorder_point():
+    result = _kernel()
+    safety = 1.645 * 2.0 * np.sqrt(4.0)
+    assert result['safety_stock'][0] == pytest.approx(safety)
+    assert result['reorder_point'][0] == pytest.approx(4.0 * 4.0 + safety)
+    assert result['needs_reorder'][0]
+    assert result['days_until_stockout'][0] == pytest.approx(2.5)
+
+
+def test_order_quantity_is_eoq_capped_by_cover():
+    eoq = np.sqrt(2 * 4.0 * 365 * DEFAULT_ORDER_COST_AED / (10.0 * ANNUAL_HOLDING_RATE))
+    result = _kernel(max_cover_days=[90.0, 10.0])
+    assert result['order_quantity'][0] == np.ceil(eoq)
+    assert result['order_quantity'][1] == 40
+
+
+def test_minimum_applies_before_pack_rounding():
+    # 240 units (60 days of cover); minimum 250 in packs of 24 rounds up to 264, not 250
+    result = _kernel(pack_size=[24.0], min_order_qty=[250.0])
+    quantity = result['order_quantity'][0]
+    assert quantity == 264
+    assert quantity % 24 == 0
+    assert quantity >= 250
+
+
+def test_quantities_are_whole_packs_above_the_minimum():
+    rng = np.random.default_rng(11)
+    size = 200
+    pack_size = rng.integers(1, 30, size).astype(np.float64)
+    min_order_qty = rng.integers(0, 300, size).astype(np.float64)
+    result = _kernel(
+        stock=rng.uniform(0, 50, size),
+        demand=rng.uniform(0, 10, size),
+        pack_size=pack_size,
+        min_order_qty=min_order_qty,
+        unit_cost=rng.uniform(0, 20, size),
+    )
+    quantity = result['order_quantity']
+    assert np.all(quantity % pack_size == 0)
+    assert np.all(quantity >= min_order_qty)
+
+
+def test_no_demand_and_urgency():
+    result = _kernel(stock=[5.0, 5.0, 30.0], demand=[0.0, 5.0, 1.0], demand_std=[0.0, 0.0, 0.0],
+                     max_cover_days=[60.0])
+    assert result['days_until_stockout'][0] == NO_DEMAND_DAYS
+    assert result['order_quantity'][0] == 0
+    assert URGENCY_LEVELS[result['urgency'][1]] == 'CRITICAL'
+    assert URGENCY_LEVELS[result['urgency'][2]] == 'LOW'
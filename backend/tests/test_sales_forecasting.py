@@ -0,0 +1,92 @@
+"""
+Batched sales forecasts: output shapes and bounds, model selection under a
+budget, and Holt-Winters recovering a weekly pattern.
+"""
+
+import asyncio
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+import sales_forecasting
+from sales_forecasting import (
+    forecast_many, daily_series, _holt_winters, SEASON, MIN_SALES_DAYS, MODELS
+)
+from sales_pattern_agent import SalesPatternAgent
+
+WEEK = np.array([100.0, 120.0, 90.0, 110.0, 150.0, 300.0, 250.0])
+
+
+def _weekly(days, noise=0.0, seed=3):
+    rng = np.random.default_rng(seed)
+    series = np.tile(WEEK, days // SEASON + 1)[:days]
+    return series + rng.normal(0, noise, days)
+
+
+def test_holt_winters_recovers_weekly_pattern():
+    history = np.stack([_weekly(84), _weekly(84) * 2])
+    forecast, residuals, factors = _holt_winters(history, 14)
+
+    assert forecast.shape == (2, 14)
+    assert residuals.shape == (2, 84 - SEASON)
+    assert factors.shape == (2, 14)
+    # Day 84 continues the pattern at slot 84 % 7
+    expected = np.roll(np.tile(WEEK, 2), -(84 % SEASON))
+    np.testing.assert_allclose(forecast[0], expected, rtol=0.05)
+    np.testing.assert_allclose(forecast[1], expected * 2, rtol=0.05)
+    # Uncertainty grows with the horizon
+    assert np.all(np.diff(factors, axis=1) >= 0)
+
+
+def test_forecast_many_shapes_and_bounds():
+    history = np.stack([_weekly(89, noise=10), np.full(89, 5.0), np.zeros(89)])
+    fitted = forecast_many(history, 8, budget_ms=10_000)
+
+    assert len(fitted['model']) == 3
+    assert set(fitted['model']) <= set(MODELS)
+    assert fitted['models_evaluated'] == list(MODELS)
+    for key in ('forecast', 'lower', 'upper'):
+        assert fitted[key].shape == (3, 8)
+        assert np.all(fitted[key] >= 0)
+    assert np.all(fitted['lower'] <= fitted['forecast'])
+    assert np.all(fitted['forecast'] <= fitted['upper'])
+    # A flat shop is forecast flat
+    np.testing.assert_allclose(fitted['forecast'][1], 5.0)
+
+
+def test_forecast_many_keeps_seasonal_naive_when_budget_is_spent(monkeypatch):
+    ticks = iter(range(0, 10_000, 1))
+    monkeypatch.setattr(sales_forecasting.time, "perf_counter", lambda: next(ticks))
+    fitted = forecast_many(np.stack([_weekly(60)]), 7, budget_ms=0)
+
+    assert fitted['models_evaluated'] == ['seasonal_naive']
+    assert fitted['model'] == ['seasonal_naive']
+
+
+def test_forecast_many_needs_enough_history():
+    with pytest.raises(ValueError):
+        forecast_many(np.ones((1, SEASON)), 7)
+
+
+def test_daily_series_fills_missing_days():
+    series = daily_series({'2026-01-02': 5.0, '2026-01-04': 7.0, '2025-12-31': 9.0},
+                          date(2026, 1, 1), date(2026, 1, 4))
+    np.testing.assert_array_equal(series, [0.0, 5.0, 0.0, 7.0])
+
+
+def test_bulk_forecast_gates_on_days_with_sales(monkeypatch):
+    today = datetime.now().date()
+    busy_burst = {(today - timedelta(days=d)).isoformat(): (20, 400.0) for d in (1, 2, 3)}
+    regular = {(today - timedelta(days=d)).isoformat(): (1, float(WEEK[d % SEASON]))
+               for d in range(1, MIN_SALES_DAYS + 1)}
+    daily = {"burst": busy_burst, "regular": regular}
+
+    async def get_daily_sales(self, user_id, start_date):
+        return daily[user_id]
+
+    monkeypatch.setattr(SalesPatternAgent, "_get_daily_sales", get_daily_sales)
+    results = asyncio.run(SalesPatternAgent().forecast_sales_bulk(["burst", "regular"], 7))
+
+    assert results["burst"]["message"] == "Insufficient data for forecast"
+    assert len(results["regular"]["forecasts"]) == 7
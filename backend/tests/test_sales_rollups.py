@@ -0,0 +1,118 @@
+"""
+Sales rollups agree with themselves however they were built (stand-in
+triggers, rebuild, webhook events) and with the transaction frame they
+replace, over day-aligned windows.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from sales_rollups import SalesRollupStore, GROUPINGS, day_start
+from transaction_frame import TransactionFrame
+
+USER = "user-1"
+NOW = datetime(2026, 3, 18, 15, 30)
+STANDIN_COLUMNS = ("id", "user_id", "transaction_type", "amount_aed", "category_name",
+                   "payment_method", "transaction_date", "transaction_time")
+
+
+def _rows(count=400, days=60):
+    rng = random.Random(7)
+    rows = []
+    for i in range(count):
+        stamp = NOW - timedelta(minutes=rng.randrange(days * 24 * 60))
+        rows.append({
+            "id": f"t{i}",
+            "user_id": USER,
+            "transaction_type": rng.choice(("sale", "sale", "sale", "expense", "purchase")),
+            "amount_aed": round(rng.uniform(1, 500), 2),
+            "category_name": rng.choice(("groceries", "drinks", "snacks", None)),
+            "payment_method": rng.choice(("cash", "card", None)),
+            "transaction_date": stamp.date().isoformat(),
+            "transaction_time": stamp.strftime("%H:%M:%S"),
+        })
+    return rows
+
+
+def _all_groupings(store, transaction_type="sale", since=None):
+    return store.aggregate(USER, tuple(GROUPINGS), transaction_type, since)
+
+
+def _assert_same(left, right):
+    assert left.keys() == right.keys()
+    for by in left:
+        assert left[by].keys() == right[by].keys(), by
+        for key, (count, revenue) in left[by].items():
+            assert right[by][key][0] == count, (by, key)
+            assert right[by][key][1] == pytest.approx(revenue), (by, key)
+
+
+def _insert_standin(store, rows):
+    placeholders = ", ".join("?" for _ in STANDIN_COLUMNS)
+    store.connection.executemany(
+        f"INSERT INTO transactions ({', '.join(STANDIN_COLUMNS)}) VALUES ({placeholders})",
+        [tuple(row[c] for c in STANDIN_COLUMNS) for row in rows]
+    )
+    store.connection.commit()
+
+
+def test_standin_triggers_match_rebuild():
+    rows = _rows()
+    triggered = SalesRollupStore(":memory:", standin=True, max_age=None)
+    _insert_standin(triggered, rows)
+    # Updates and deletes move rows between buckets
+    triggered.connection.execute("UPDATE transactions SET amount_aed = 10, payment_method = 'card' WHERE id = 't1'")
+    triggered.connection.execute("DELETE FROM transactions WHERE id = 't2'")
+    triggered.connection.commit()
+
+    rows[1] = {**rows[1], "amount_aed": 10, "payment_method": "card"}
+    del rows[2]
+    rebuilt = SalesRollupStore(":memory:", max_age=None)
+    rebuilt.rebuild(USER, rows, NOW - timedelta(days=60))
+
+    for transaction_type in ("sale", "expense", "purchase"):
+        _assert_same(_all_groupings(triggered, transaction_type), _all_groupings(rebuilt, transaction_type))
+
+
+def test_apply_event_is_idempotent():
+    rows = _rows(50)
+    store = SalesRollupStore(":memory:", max_age=None)
+    once = SalesRollupStore(":memory:", max_age=None)
+    for row in rows:
+        event = {"type": "INSERT", "record": row, "old_record": None}
+        assert store.apply_event(event) is True
+        # A webhook redelivery changes nothing
+        assert store.apply_event(dict(event)) is False
+        once.record(row)
+
+    update = {"type": "UPDATE", "record": {**rows[0], "amount_aed": 1}, "old_record": rows[0]}
+    assert store.apply_event(update) is True
+    assert store.apply_event(update) is False
+    once.remove(rows[0])
+    once.record({**rows[0], "amount_aed": 1})
+
+    _assert_same(_all_groupings(store), _all_groupings(once))
+
+
+def test_rollups_match_frame_over_day_aligned_window():
+    rows = _rows()
+    store = SalesRollupStore(":memory:", max_age=None)
+    store.rebuild(USER, rows, NOW - timedelta(days=60))
+    frame = TransactionFrame.from_rows(rows)
+
+    # A window starting mid-day reads the same whole days from either path
+    since = day_start(NOW - timedelta(days=30))
+    assert store.covers(USER, since)
+    from_frame = frame.aggregate(tuple(GROUPINGS), frame.mask("sale", since))
+    _assert_same(_all_groupings(store, since=since), from_frame)
+
+    until = day_start(NOW - timedelta(days=10))
+    assert store.total(USER, "expense", since, until) == pytest.approx(
+        frame.sum("amount_aed", frame.mask("expense", since, until)))
+
+
+def test_day_start_truncates_to_midnight():
+    assert day_start(NOW) == datetime(2026, 3, 18)
+    assert day_start(NOW.date()) == datetime(2026, 3, 18)
@@ -691,6 +691,21 @@ CREATE TRIGGER trigger_calculate_transaction_totals
 BEFORE INSERT OR UPDATE ON transactions
 FOR EACH ROW EXECUTE FUNCTION calculate_transaction_totals();
 
+-- Bulk trust score write-back ([{id, score}]); touches only trust_score
+CREATE OR REPLACE FUNCTION update_trust_scores(scores JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    updated INTEGER;
+BEGIN
+    UPDATE customers c
+    SET trust_score = s.score
+    FROM jsonb_to_recordset(scores) AS s(id UUID, score INTEGER)
+    WHERE c.id = s.id;
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    RETURN updated;
+END;
+$$ LANGUAGE plpgsql;
+
 -- =====================================================
 -- DONE!
 -- =====================================================
@@ -304,6 +304,24 @@ CREATE POLICY IF NOT EXISTS "Users can view own vat returns" ON vat_returns FOR
 CREATE POLICY IF NOT EXISTS "Users can view own health scores" ON business_health_scores FOR ALL USING (true);
 CREATE POLICY IF NOT EXISTS "Users can view own reorder alerts" ON reorder_alerts FOR ALL USING (true);
 
+-- ============================================================================
+-- STEP 13: Bulk trust score write-back ([{id, score}]); touches only trust_score
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION update_trust_scores(scores JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    updated INTEGER;
+BEGIN
+    UPDATE customers c
+    SET trust_score = s.score
+    FROM jsonb_to_recordset(scores) AS s(id UUID, score INTEGER)
+    WHERE c.id = s.id;
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    RETURN updated;
+END;
+$$ LANGUAGE plpgsql;
+
 -- ============================================================================
 -- DONE! Schema updated for StoreBuddy UAE
 -- ============================================================================